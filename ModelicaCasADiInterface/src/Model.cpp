@@ -284,7 +284,8 @@ namespace ModelicaCasADi
         if (!var->getVar().isSymbolic()) {
             throw std::runtime_error("The supplied variable is not symbolic and can not be variable");
         }
-        dirty = true;            // todo: only if (dependent) parameter, or with dependent attributes?
+        setDirty();              // todo: only if (dependent) parameter, or with dependent attributes?
+        setAttributesChanged();
         handleVariableTypeForAddedVariable(var);
         z.push_back(var.getNode());
     }
@@ -412,6 +413,7 @@ namespace ModelicaCasADi
             }
         }
         dirty = false;
+        ++parameterRevision;
     }
 
     void Model::setUpValAndSymbolVecs() {
@@ -82,6 +82,8 @@ namespace ModelicaCasADi
             /** Create a blank, uninitialized Model */
             Model() {
                 dirty = false;
+                attributeRevision = 0;
+                parameterRevision = 0;
                 timeVar = casadi::MX(0);
                                  //The default container is flat
                 equations_ = new FlatEquations();
@@ -241,7 +243,20 @@ namespace ModelicaCasADi
             virtual std::vector< Ref<Variable> >  getEliminatedVariables();
 
             /** Notify the Model that dependent parameters and attributes may need to be recalculated. */
-            void setDirty() { dirty = true; }
+            void setDirty() { dirty = true; ++parameterRevision; }
+            /** Notify the Model that a variable attribute other than a binding expression has changed. */
+            void setAttributesChanged() { ++attributeRevision; }
+            /**
+             * Counter that is increased when a variable is added or an attribute other than
+             * a binding expression is changed. Used to invalidate cached attribute values.
+             */
+            long getAttributeRevision() const { return attributeRevision; }
+            /**
+             * Counter that is increased when a binding expression is changed or dependent
+             * parameters are recalculated, i.e. when parameter values and attributes that
+             * depend on them may change.
+             */
+            long getParameterRevision() const { return parameterRevision; }
 
             /** Notify the Model if it has a BLT for DAE equations **/
             virtual bool hasBLT() const;
@@ -316,6 +331,10 @@ namespace ModelicaCasADi
             /// Indicates whether any parameter values have been updated since
             /// dependent parameters were last recalculated.
             bool dirty;
+            /// See getAttributeRevision
+            long attributeRevision;
+            /// See getParameterRevision
+            long parameterRevision;
             /// For classification according to the VariableKind enum. Differentiated variables may have their
             /// myDerivativeVariable field set in the process.
             VariableKind classifyVariable(Ref<Variable> var) const;
@@ -142,6 +142,9 @@ void Variable::setAttribute(AttributeKey key, AttributeValue val) {
                 throw std::runtime_error("It is not allowed to change binding expression of dependent parameters");
             }
         }
+    } else if (key != "evaluatedBindingExpression") {
+        // Evaluated binding expressions follow from the binding expressions
+        myModel().setAttributesChanged();
     }
     
     if (isAlias()) {
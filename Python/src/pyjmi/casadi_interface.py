@@ -212,6 +212,10 @@ class Model(CI_Model):
         """
         Helper method for getting values of variable attributes.
 
+        The values are cached. Attribute values that do not depend on any
+        parameters are kept until an attribute is changed, other values until
+        a parameter value is changed.
+
         Parameters::
 
             var --
@@ -231,6 +235,96 @@ class Model(CI_Model):
 
             Value of attribute attr of Variable var.
         """
+        (const_cache, par_cache) = self._get_attr_caches()
+        key = (var.getName(), attr)
+        try:
+            return const_cache[key]
+        except KeyError:
+            pass
+        try:
+            return par_cache[key]
+        except KeyError:
+            pass
+        (val, constant) = self._eval_attr(var, attr)
+        if constant:
+            const_cache[key] = val
+        else:
+            par_cache[key] = val
+        return val
+
+    def get_attr_array(self, variables, attr, names=None):
+        """
+        Get the values of an attribute for several variables.
+
+        The arrays are cached in the same way as the values given by get_attr,
+        so repeated calls with unchanged attributes and parameters do not
+        evaluate any attributes.
+
+        Parameters::
+
+            variables --
+                List of Variable objects to get attribute values from.
+
+            attr --
+                Attribute whose values are sought, see get_attr.
+
+            names --
+                The names of the variables. Given to avoid looking them up
+                when the array is already cached.
+                Default: None
+
+        Returns::
+
+            Array with the values of attribute attr.
+        """
+        if names is None:
+            names = [var.getName() for var in variables]
+        (const_cache, par_cache) = self._get_attr_caches()
+        key = (tuple(names), attr)
+        try:
+            return const_cache[key].copy()
+        except KeyError:
+            pass
+        try:
+            return par_cache[key].copy()
+        except KeyError:
+            pass
+        values = N.array([self.get_attr(var, attr) for var in variables],
+                         dtype=float)
+        constant = all([(name, attr) in const_cache for name in names])
+        if constant:
+            const_cache[key] = values
+        else:
+            par_cache[key] = values
+        return values.copy()
+
+    def _get_attr_caches(self):
+        """
+        Returns the dictionaries with cached attribute values that do not
+        depend on parameters and that do, emptied if out of date.
+        """
+        attr_rev = self.getAttributeRevision()
+        par_rev = self.getParameterRevision()
+        try:
+            caches = self._attr_caches
+        except AttributeError:
+            caches = None
+        if caches is None or caches[0] != attr_rev:
+            caches = (attr_rev, {}, par_rev, {})
+        elif caches[2] != par_rev:
+            caches = (attr_rev, caches[1], par_rev, {})
+        self._attr_caches = caches
+        return (caches[1], caches[3])
+
+    def _eval_attr(self, var, attr):
+        """
+        Evaluate an attribute value, see get_attr.
+
+        Returns::
+
+            A tuple (value, constant), where constant is True if the value
+            does not depend on any parameters.
+        """
         if attr == "_value":
             val = var.getAttribute('evaluatedBindingExpression')
             if val is None:
@@ -242,127 +336,185 @@ class Model(CI_Model):
                     else:
                         raise RuntimeError("BUG: Unable to evaluate " +
                                            "value of %s." % var.getName())
-            return val.getValue()
+            return (val.getValue(), False)
         elif attr == "comment":
             var_desc = var.getAttribute("comment")
             if var_desc is None:
-                return ""
+                return ("", True)
             else:
-                return var_desc.getName()
+                return (var_desc.getName(), True)
         elif attr == "nominal":
             if var.isDerivative():
                 var = var.getMyDifferentiatedVariable()
             val_expr = var.getAttribute(attr)
-            return self.evaluateExpression(val_expr)
+            return (self.evaluateExpression(val_expr), val_expr.isConstant())
         else:
             val_expr = var.getAttribute(attr)
             if val_expr is None:
                 if attr == "free":
-                    return False
+                    return (False, True)
                 elif attr == "initialGuess":
-                    return self.get_attr(var, "start")
+                    return self._eval_attr(var, "start")
                 else:
                     raise ValueError("Variable %s does not have attribute %s."
                                      % (var.getName(), attr))
-            return self.evaluateExpression(val_expr)
+            return (self.evaluateExpression(val_expr), val_expr.isConstant())
 
     def augment_sensitivities(self, parameters):
         """
         Adds forward sensitivity variables and equations for all model variables with respect to given parameters.
 
+        The Jacobians of the DAE and initial residuals with respect to the
+        variables and the parameters are computed once, as sparse matrices,
+        and shared by the sensitivity equations of all parameters.
+
         Parameters::
 
             parameters --
                 List of parameter names for which to compute sensitivities.
         """
-        ###################################################################
-        ###           This code does not exploit DAE sparsity!          ###
-        ### Although this will probably not affect online computations. ###
-        ###################################################################
-
         # Get residuals and variables
         dae = self.getDaeResidual()
         init = self.getInitialResidual()
-        var_kinds = {'dx': self.DERIVATIVE,
-                     'x': self.DIFFERENTIATED,
-                     'w': self.REAL_ALGEBRAIC}
-        mvar_vectors = {'dx': N.array([var for var in self.getVariables(var_kinds['dx'])
-                                       if (not var.isAlias() and not var.wasEliminated())]),
-                        'x': N.array([var for var in self.getVariables(var_kinds['x'])
-                                      if (not var.isAlias() and not var.wasEliminated())]),
-                        'w': N.array([var for var in self.getVariables(var_kinds['w'])
-                                      if (not var.isAlias() and not var.wasEliminated())])}
-        mvar_par = N.array([self.getVariable(par) for par in parameters])
+        var_kinds = ['dx', 'x', 'w']
+        kind_map = {'dx': self.DERIVATIVE,
+                    'x': self.DIFFERENTIATED,
+                    'w': self.REAL_ALGEBRAIC}
+        mvar_vectors = {}
+        for vk in var_kinds:
+            mvar_vectors[vk] = [var for var in self.getVariables(kind_map[vk])
+                                if (not var.isAlias() and not var.wasEliminated())]
+        mvar_par = [self.getVariable(par) for par in parameters]
 
         # Add sensitivity variables
+        sens_vars = []
         for par in mvar_par:
-            par_var = par.getVar()
+            sens_vars_par = {'dx': [], 'x': [], 'w': []}
             for mvar in mvar_vectors['x']:
                 # States
-                mvar_var = mvar.getVar()
                 name = "d%s/d%s" % (mvar.getName(), par.getName())
                 sens_var = casadi.MX.sym(name)
                 sens = ci.RealVariable(self, sens_var, ci.RealVariable.INTERNAL, ci.RealVariable.CONTINUOUS)
                 self.addVariable(sens)
+                sens_vars_par['x'].append(sens_var)
 
                 # State derivatives
-                dx_mvar = mvar.getMyDerivativeVariable()
-                dx_mvar_var = dx_mvar.getVar()
                 dx_name = "der(d%s/d%s)" % (mvar.getName(), par.getName())
                 dx_sens_var = casadi.MX.sym(dx_name)
                 dx_sens = ci.DerivativeVariable(self, dx_sens_var, sens)
                 self.addVariable(dx_sens)
+            for mvar in mvar_vectors['dx']:
+                name = "der(d%s/d%s)" % (mvar.getMyDifferentiatedVariable().getName(), par.getName())
+                sens_vars_par['dx'].append(self.getVariable(name).getVar())
             for mvar in mvar_vectors['w']:
                 # Algebraics
-                mvar_var = mvar.getVar()
                 name = "d%s/d%s" % (mvar.getName(), par.getName())
                 sens_var = casadi.MX.sym(name)
                 sens = ci.RealVariable(self, sens_var, ci.RealVariable.INTERNAL, ci.RealVariable.CONTINUOUS)
                 self.addVariable(sens)
-
-        # Compute derivatives
-        dfdx = {}
-        df0dx = {}
-        for vk in var_kinds:
-            dfdx[vk] = {}
-            df0dx[vk] = {}
-            for mvar in mvar_vectors[vk]:
-                mvar_var = mvar.getVar()
-                dfdx[vk][mvar.getName()] = N.array([casadi.jacobian(dae_eq, mvar_var) for dae_eq in dae])
-                df0dx[vk][mvar.getName()] = N.array([casadi.jacobian(init_eq, mvar_var) for init_eq in init])
-        
-        # Add sensitivity differential equations
+                sens_vars_par['w'].append(sens_var)
+            sens_vars.append(casadi.vertcat(sens_vars_par['dx'] + sens_vars_par['x'] + sens_vars_par['w']))
+
+        # Replace the variables and parameters by vectors, so that the
+        # Jacobians of all residuals can be computed at once, with their
+        # sparsity exploited
+        model_vars = [mvar.getVar() for vk in var_kinds for mvar in mvar_vectors[vk]]
+        par_vars = [par.getVar() for par in mvar_par]
+        v = casadi.MX.sym("v", len(model_vars))
+        p = casadi.MX.sym("p", len(par_vars))
+        res = casadi.vertcat([dae, init])
+        [res] = casadi.substitute([res], model_vars + par_vars,
+                                  [v[i] for i in xrange(len(model_vars))] +
+                                  [p[i] for i in xrange(len(par_vars))])
+        dfdv = casadi.jacobian(res, v)
+        dfdp = casadi.jacobian(res, p)
+        [dfdv, dfdp] = casadi.substitute([dfdv, dfdp], [v, p],
+                                         [casadi.vertcat(model_vars), casadi.vertcat(par_vars)])
+
+        # Add sensitivity differential and initial equations. The sparse
+        # product only involves the structurally nonzero Jacobian entries.
         mx_zero = casadi.MX(0.)
-        for par in mvar_par:
-            for i in xrange(dae.numel()):
-                eq = mx_zero
-                for vk in var_kinds:
-                    for mvar in mvar_vectors[vk]:
-                        if vk == "dx":
-                            name = "der(d%s/d%s)" % (mvar.getMyDifferentiatedVariable().getName(), par.getName())
-                        else:
-                            name = "d%s/d%s" % (mvar.getName(), par.getName())
-                        sens_var = self.getVariable(name).getVar()
-                        eq += dfdx[vk][mvar.getName()][i] * sens_var
-                eq += casadi.jacobian(dae[i], par.getVar())
-                sens_eq = ci.Equation(eq, mx_zero)
-                self.addDaeEquation(sens_eq)
-
-        # Add sensitivity initial equations
-        for par in mvar_par:
-            for i in xrange(init.numel()):
-                init_eq = mx_zero
-                for vk in var_kinds:
-                    for mvar in mvar_vectors[vk]:
-                        if vk == "dx":
-                            name = "der(d%s/d%s)" % (mvar.getMyDifferentiatedVariable().getName(), par.getName())
-                        else:
-                            name = "d%s/d%s" % (mvar.getName(), par.getName())
-                        sens_var = self.getVariable(name).getVar()
-                        init_eq += df0dx[vk][mvar.getName()][i] * sens_var
-                init_eq += casadi.jacobian(init[i], par.getVar())
-                sens_init_eq = ci.Equation(init_eq, mx_zero)
-                self.addInitialEquation(sens_init_eq)
+        n_dae = dae.numel()
+        for (j, par) in enumerate(mvar_par):
+            sens_res = casadi.mul(dfdv, sens_vars[j]) + dfdp[:, j]
+            for i in xrange(n_dae):
+                self.addDaeEquation(ci.Equation(sens_res[i], mx_zero))
+            for i in xrange(n_dae, res.numel()):
+                self.addInitialEquation(ci.Equation(sens_res[i], mx_zero))
+
+def _cholesky(A, n):
+    """
+    Symbolic Cholesky factorization A = L*L^T of a symmetric positive definite
+    n x n MX matrix.
+
+    Returns::
+
+        The lower triangular factor L as a list of rows, where row i contains
+        the MX elements L[i, 0], ..., L[i, i].
+    """
+    L = []
+    for i in xrange(n):
+        row = []
+        for j in xrange(i + 1):
+            # Row j of L, which for the diagonal is the row being computed
+            L_j = row if j == i else L[j]
+            s = A[i, j]
+            for k in xrange(j):
+                s = s - row[k] * L_j[k]
+            if i == j:
+                row.append(casadi.sqrt(s))
+            else:
+                row.append(s / L[j][j])
+        L.append(row)
+    return L
+
+def _invert_lower(L, n):
+    """
+    Symbolic inverse of a lower triangular matrix given as returned by
+    _cholesky, by forward substitution.
+
+    Returns::
+
+        The inverse in the same form as L.
+    """
+    L_inv = []
+    for i in xrange(n):
+        row = []
+        for j in xrange(i):
+            s = 0
+            for k in xrange(j, i):
+                s = s - L[i][k] * L_inv[k][j]
+            row.append(s / L[i][i])
+        row.append(1. / L[i][i])
+        L_inv.append(row)
+    return L_inv
+
+def _design_criterion(Fisher, n, design):
+    """
+    Symbolic design criterion of an n x n Fisher matrix, as described for
+    OptimizationProblem.setup_oed.
+
+    Returns::
+
+        The criterion as an MX scalar.
+    """
+    if design == "T":
+        return -casadi.trace(Fisher)
+    L = _cholesky(Fisher, n)
+    if design == "D":
+        return -2 * sum([casadi.log(L[i][i]) for i in xrange(n)])
+    L_inv = _invert_lower(L, n)
+    if design == "A":
+        return sum([l * l for row in L_inv for l in row])
+
+    # F^-1 = L^-T * L^-1
+    L_inv = casadi.vertcat([casadi.horzcat(row + (n - len(row)) * [casadi.MX(0.)])
+                            for row in L_inv])
+    Fisher_inv = casadi.mul(L_inv.T, L_inv)
+    Fisher_inv_pow = Fisher_inv
+    for k in xrange(3):
+        Fisher_inv_pow = casadi.mul(Fisher_inv_pow, Fisher_inv_pow)
+    return casadi.trace(Fisher_inv_pow) ** (1. / 8)
 
 class OptimizationProblem(Model, CI_OP, ModelBase):
 
@@ -542,32 +694,43 @@ class OptimizationProblem(Model, CI_OP, ModelBase):
             design --
                 Design criterion.
 
-                Possible values: "A", "T"
+                Possible values: "A", "D", "E", "T"
+
+                "A": Minimize trace(F^-1), where F is the Fisher matrix.
+
+                "D": Minimize -log(det(F)).
+
+                "E": Minimize trace(F^-8)^(1/8), a smooth approximation of
+                the inverse of the smallest eigenvalue of F.
+
+                "T": Minimize -trace(F).
+
+                The A, D and E criteria are formed from a Cholesky
+                factorization of F, so F must be positive definite.
         """
+        if design not in ["A", "D", "E", "T"]:
+            raise ValueError("Invalid design %s." % design)
+        sigma = N.asarray(sigma)
+
         # Augment sensitivities and add timed variables
         self.augment_sensitivities(parameters)
         timed_sens = self.create_timed_sensitivities(outputs, parameters, time_points)
         
-        # Create sensitivity and Fisher matrices
+        # Create sensitivity and Fisher matrices. The Fisher matrix is
+        # assembled as sum_i Q_i^T * (sum_j sigma_ij * Q_j), where zero
+        # entries of sigma are skipped.
         Q = []
         for j in xrange(len(outputs)):
             Q.append(casadi.vertcat([casadi.horzcat([s.getVar() for s in timed_sens[i][j]])
                                      for i in xrange(len(time_points))]))
-        Fisher = sum([sigma[i, j] * casadi.mul(Q[i].T, Q[j]) for i in xrange(len(outputs))
-                      for j in xrange(len(outputs))])
+        Fisher = 0
+        for i in xrange(len(outputs)):
+            weighted_Q = [sigma[i, j] * Q[j] for j in xrange(len(outputs)) if sigma[i, j] != 0]
+            if len(weighted_Q) > 0:
+                Fisher += casadi.mul(Q[i].T, sum(weighted_Q[1:], weighted_Q[0]))
 
         # Define the objective
-        if design == "A":
-            b = casadi.MX.sym("b", Fisher.shape[1], 1)
-            Fisher_inv = casadi.jacobian(casadi.solve(Fisher, b), b)
-            obj = casadi.trace(Fisher_inv)
-        elif design == "T":
-            obj = -casadi.trace(Fisher)
-        elif design == "D":
-            obj = -casadi.det(Fisher)
-            raise NotImplementedError("D-optimal design is not supported.")
-        else:
-            raise ValueError("Invalid design %s." % design)
+        obj = _design_criterion(Fisher, len(parameters), design)
         old_obj = self.getObjective()
         self.setObjective(old_obj + obj)
          
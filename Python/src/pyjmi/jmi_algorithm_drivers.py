@@ -225,6 +225,21 @@ class LocalDAECollocationAlg(AlgorithmBase):
             if self.hs != "free":
                 raise ValueError("free_element_lengths_data can only be " + \
                                  'given if self.hs == "free".')
+
+        # Check validity of mesh_refinement
+        if self.mesh_refinement is not None:
+            if not isinstance(self.mesh_refinement, MeshRefinementData):
+                raise ValueError("mesh_refinement must be an instance of " +
+                                 "MeshRefinementData.")
+            if self.hs == "free":
+                raise ValueError("mesh_refinement can not be used if " +
+                                 'hs == "free".')
+            if self.blocking_factors is not None:
+                raise NotImplementedError("mesh_refinement does not work " +
+                                          "with blocking factors.")
+            if self.eliminate_der_var:
+                raise NotImplementedError("mesh_refinement does not work " +
+                                          "with eliminate_der_var.")
         
         # Check validity of discr
         if self.discr == "LGL":
@@ -351,6 +366,42 @@ class LocalDAECollocationAlg(AlgorithmBase):
         Solve the optimization problem using ipopt solver. 
         """
         self.nlp.solve_and_write_result()
+        if self.mesh_refinement is not None:
+            self._refine_mesh()
+
+    def _refine_mesh(self):
+        """
+        Refine the mesh and solve the problem again until the estimated
+        collocation errors are within the tolerance, see the option
+        mesh_refinement.
+        """
+        data = self.mesh_refinement
+        for iteration in xrange(data.max_iter + 1):
+            errors = self.nlp.get_element_errors()
+            if self.verbosity >= 1:
+                print("Mesh refinement iteration %d: %d elements, " %
+                      (iteration, self.nlp.n_e) +
+                      "maximum estimated error %g." % N.max(errors))
+            if iteration == data.max_iter:
+                break
+            hs = data.refine(N.array(self.nlp.h[1:], dtype=float), errors,
+                             self.nlp.n_cp)
+            if hs is None:
+                break
+
+            # Transcribe the problem on the new mesh, starting from the
+            # previous solution
+            t0_init = time.clock()
+            options = LocalDAECollocationAlgOptions(self.options)
+            options['n_e'] = len(hs)
+            options['hs'] = list(hs)
+            options['init_traj'] = self.nlp.get_result_data()
+            options['init_dual'] = None
+            self.nlp = LocalDAECollocator(self.op, options)
+            self._set_solver_options()
+            self.nlp.solver_object.init()
+            self.nlp.times['init'] = time.clock() - t0_init
+            self.nlp.solve_and_write_result()
 
     def get_result(self):
         """ 
@@ -518,6 +569,20 @@ class LocalDAECollocationAlgOptions(OptionBase):
             pyjmi.optimization.casadi_collocation.FreeElementLengthsData
             Default: None
 
+        mesh_refinement --
+            Data used for adaptive mesh refinement. If not None, the
+            collocation error of each element is estimated after the problem
+            has been solved, and the problem is solved again on a refined
+            mesh, initialized with the previous solution, until the estimated
+            errors are within the tolerance. The options n_e and hs only
+            determine the initial mesh. init_dual is only used for the
+            initial mesh. Not compatible with hs = "free" and blocking
+            factors.
+
+            Type: None or
+            pyjmi.optimization.casadi_collocation.MeshRefinementData
+            Default: None
+
         discr --
             Determines the collocation scheme used to discretize the problem.
             
@@ -627,6 +692,20 @@ class LocalDAECollocationAlgOptions(OptionBase):
             Type: str
             Default: ""
         
+        result_file_format --
+            Specifies the format of the result file.
+
+            Possible values: "txt" and "mat"
+
+            "txt": Dymola's textual result file format.
+
+            "mat": Dymola's binary result file format (MATLAB v4), which is
+            considerably smaller and faster to write and load than the textual
+            format for large problems.
+
+            Type: str
+            Default: "txt"
+        
         result_mode --
             Specifies the output format of the optimization result.
             
@@ -775,6 +854,7 @@ class LocalDAECollocationAlgOptions(OptionBase):
                 'nominal_traj': None,
                 'nominal_traj_mode': {"_default_mode": "linear"},
                 'result_file_name': "",
+                'result_file_format': "txt",
                 'write_scaled_result': False,
                 'print_condition_numbers': False,
                 'result_mode': "collocation_points",
@@ -791,6 +871,7 @@ class LocalDAECollocationAlgOptions(OptionBase):
                 'verbosity': 3,
                 'explicit_hessian': False,
                 'order': "default",
+                'mesh_refinement': None,
                 'IPOPT_options': {'dual_inf_tol': 1e100,
                                   'constr_viol_tol': 1e100,
                                   'compl_inf_tol': 1e100,
@@ -28,6 +28,108 @@ import jmi
 from pyjmi.common.io import ResultWriter
 from pyjmi.common import xmlparser
 
+def write_data_block(f, data, block_size=1000):
+    """
+    Write a two dimensional array of trajectory data to an open textual 
+    Dymola result file, one row per line with every value formatted as 
+    ' %.14E'.
+
+    The values are formatted a block of rows at a time with a single format 
+    operation, rather than one value at a time.
+
+    Parameters::
+
+        f --
+            The file object to write to.
+
+        data --
+            A two dimensional array of floats.
+
+        block_size --
+            The number of rows that are formatted in each write.
+            Default: 1000
+    """
+    data = N.atleast_2d(N.asarray(data, dtype=float))
+    (n_points, n_vars) = data.shape
+    row_format = ' %.14E' * n_vars + '\n'
+    for i in xrange(0, n_points, block_size):
+        block = data[i:i+block_size]
+        f.write((row_format * len(block)) % tuple(block.ravel()))
+
+def _char_matrix(strings, pad='\0'):
+    """
+    Create a character matrix with one (utf-8 encoded) string per row, 
+    padded with pad to the length of the longest string.
+    """
+    strings = [s.encode('utf-8') if isinstance(s, unicode) else str(s) 
+               for s in strings]
+    width = max([len(s) for s in strings] + [1])
+    return N.array([s.ljust(width, pad) for s in strings], 
+                   dtype='S%d' % width).view(N.uint8).reshape(-1, width)
+
+def _write_mat4_matrix(f, name, matrix, text=False):
+    """
+    Write a two dimensional matrix to an open file in MATLAB v4 format. 
+    Character matrices are stored as bytes, integer matrices as 32 bit 
+    integers and all other matrices as doubles.
+    """
+    if text:
+        (type_code, dtype) = (51, '<u1')
+    elif matrix.dtype.kind in 'iu':
+        (type_code, dtype) = (20, '<i4')
+    else:
+        (type_code, dtype) = (0, '<f8')
+    (n_rows, n_cols) = matrix.shape
+    f.write(N.array([type_code, n_rows, n_cols, 0, len(name) + 1], 
+                    dtype='<i4').tostring())
+    f.write(name + '\0')
+    # MATLAB matrices are stored in column major order
+    f.write(N.ascontiguousarray(matrix.T, dtype=dtype).tostring())
+
+def write_result_binary(file_name, names, descriptions, data_info, data_1, 
+                        data_2):
+    """
+    Write a result file in Dymola's binary result file format, that is a 
+    MATLAB v4 file with the transposed ('binTrans') layout.
+
+    Parameters::
+
+        file_name --
+            The name of the result file.
+
+        names --
+            A list of variable names, starting with 'time'.
+
+        descriptions --
+            A list of variable descriptions, in the same order as names.
+
+        data_info --
+            A list with one (data set, column, 0, -1) tuple per variable, in 
+            the same order as names. Negated aliases have a negative column.
+
+        data_1 --
+            A two dimensional array with the start and final time in the 
+            first column followed by the parameter values, as in the textual 
+            format.
+
+        data_2 --
+            A two dimensional array with the time points in the first column 
+            followed by the trajectories, one row per time point.
+    """
+    f = open(file_name, 'wb')
+    try:
+        _write_mat4_matrix(f, 'Aclass', _char_matrix(
+            ['Atrajectory', '1.1', '', 'binTrans'], pad=' '), text=True)
+        _write_mat4_matrix(f, 'name', _char_matrix(names).T, text=True)
+        _write_mat4_matrix(f, 'description', 
+                           _char_matrix(descriptions).T, text=True)
+        _write_mat4_matrix(f, 'dataInfo', 
+                           N.array(data_info, dtype=N.int32).reshape(-1, 4).T)
+        _write_mat4_matrix(f, 'data_1', N.asarray(data_1, dtype=float).T)
+        _write_mat4_matrix(f, 'data_2', N.asarray(data_2, dtype=float).T)
+    finally:
+        f.close()
+
 def export_result_dymola(model, data, file_name='', format='txt', scaled=False):
     """
     Export an optimization or simulation result to file in Dymolas result file 
@@ -63,209 +165,203 @@ def export_result_dymola(model, data, file_name='', format='txt', scaled=False):
             the variable scaling factors of the model are used to reproduced the 
             unscaled variable values.
             Default: False
-
-    Limitations::
-    
-        Currently only textual format is supported.
     """
+    if format not in ('txt', 'mat'):
+        raise ValueError("Unknown result file format '%s', must be either " \
+                         "'txt' or 'mat'." % format)
 
-    if (format=='txt'):
-
-        if file_name=='':
-            file_name=model.get_identifier() + '_result.txt'
-
-        # Open file
-        f = codecs.open(file_name,'w','utf-8')
+    if file_name=='':
+        file_name=model.get_identifier() + '_result.' + format
 
-        # Write header
-        f.write('#1\n')
-        f.write('char Aclass(3,11)\n')
-        f.write('Atrajectory\n')
-        f.write('1.1\n')
-        f.write('\n')
-        
-        md = model._get_XMLDoc()
-        
-        # NOTE: it is essential that the lists 'names', 'aliases', 'descriptions' 
-        # and 'variabilities' are sorted in the same order and that this order 
-        # is: value reference order AND within the same value reference the 
-        # non-alias variable must be before its corresponding aliases. Otherwise 
-        # the header-writing algorithm further down will fail.
-        # Therefore the following code is needed...
-        
-        # all lists that we need for later
-        vrefs_alias = []
-        vrefs = []
-        names_alias = []
-        names = []
-        aliases_alias = []
-        aliases = []
-        descriptions_alias = []
-        descriptions = []
-        variabilities_alias = []
-        variabilities = []
-        
-        # go through all variables and split in non-alias/only-alias lists
-        for var in md.get_model_variables():
-            if var.get_alias() == xmlparser.NO_ALIAS:
-                vrefs.append(var.get_value_reference())
-                names.append(var.get_name())
-                aliases.append(var.get_alias())
-                descriptions.append(var.get_description())
-                variabilities.append(var.get_variability())
-            else:
-                vrefs_alias.append(var.get_value_reference())
-                names_alias.append(var.get_name())
-                aliases_alias.append(var.get_alias())
-                descriptions_alias.append(var.get_description())
-                variabilities_alias.append(var.get_variability())
-        
-        # extend non-alias lists with only-alias-lists
-        vrefs.extend(vrefs_alias)
-        names.extend(names_alias)
-        aliases.extend(aliases_alias)
-        descriptions.extend(descriptions_alias)
-        variabilities.extend(variabilities_alias)
-        
-        # zip to list of tuples and sort - non alias variables are now
-        # guaranteed to be first in list and all variables are in value reference 
-        # order
-        names = sorted(zip(
-            tuple(vrefs), 
-            tuple(names)), 
-            key=itemgetter(0))
-        aliases = sorted(zip(
-            tuple(vrefs), 
-            tuple(aliases)), 
-            key=itemgetter(0))
-        descriptions = sorted(zip(
-            tuple(vrefs), 
-            tuple(descriptions)), 
-            key=itemgetter(0))
-        variabilities = sorted(zip(
-            tuple(vrefs), 
-            tuple(variabilities)), 
-            key=itemgetter(0))
-        
-        num_vars = len(names)
+    md = model._get_XMLDoc()
+    
+    # NOTE: it is essential that the lists 'names', 'aliases', 'descriptions' 
+    # and 'variabilities' are sorted in the same order and that this order 
+    # is: value reference order AND within the same value reference the 
+    # non-alias variable must be before its corresponding aliases. Otherwise 
+    # the header-writing algorithm further down will fail.
+    # Therefore the following code is needed...
+    
+    # all lists that we need for later
+    vrefs_alias = []
+    vrefs = []
+    names_alias = []
+    names = []
+    aliases_alias = []
+    aliases = []
+    descriptions_alias = []
+    descriptions = []
+    variabilities_alias = []
+    variabilities = []
+    
+    # go through all variables and split in non-alias/only-alias lists
+    for var in md.get_model_variables():
+        if var.get_alias() == xmlparser.NO_ALIAS:
+            vrefs.append(var.get_value_reference())
+            names.append(var.get_name())
+            aliases.append(var.get_alias())
+            descriptions.append(var.get_description())
+            variabilities.append(var.get_variability())
+        else:
+            vrefs_alias.append(var.get_value_reference())
+            names_alias.append(var.get_name())
+            aliases_alias.append(var.get_alias())
+            descriptions_alias.append(var.get_description())
+            variabilities_alias.append(var.get_variability())
+    
+    # extend non-alias lists with only-alias-lists
+    vrefs.extend(vrefs_alias)
+    names.extend(names_alias)
+    aliases.extend(aliases_alias)
+    descriptions.extend(descriptions_alias)
+    variabilities.extend(variabilities_alias)
+    
+    # zip to list of tuples and sort - non alias variables are now
+    # guaranteed to be first in list and all variables are in value reference 
+    # order
+    names = sorted(zip(
+        tuple(vrefs), 
+        tuple(names)), 
+        key=itemgetter(0))
+    aliases = sorted(zip(
+        tuple(vrefs), 
+        tuple(aliases)), 
+        key=itemgetter(0))
+    descriptions = sorted(zip(
+        tuple(vrefs), 
+        tuple(descriptions)), 
+        key=itemgetter(0))
+    variabilities = sorted(zip(
+        tuple(vrefs), 
+        tuple(variabilities)), 
+        key=itemgetter(0))
+
+    # Data meta information, one (data set, column) pair per variable
+    offs = model.get_offsets()
+    n_parameters = offs[12] # offs[12] = offs_dx
+    data_info = [(0, 1)]
+
+    cnt_1 = 1
+    cnt_2 = 1
+    
+    for i, name in enumerate(names):
+        (ref, type) = jmi._translate_value_ref(name[0])
         
-        # Find the maximum name and description length
-        max_name_length = len('Time')
-        max_desc_length = len('Time in [s]')
+        if int(ref) < n_parameters: # Put parameters in data set
+            if aliases[i][1] == 0: # no alias
+                cnt_1 = cnt_1 + 1
+                data_info.append((1, cnt_1))
+            elif aliases[i][1] == 1: # alias
+                data_info.append((1, cnt_1))
+            else: # negated alias
+                data_info.append((1, -cnt_1))
+        else:
+            if aliases[i][1] == 0: # noalias
+                cnt_2 = cnt_2 + 1   
+                data_info.append((2, cnt_2))
+            elif aliases[i][1] == 1: # alias
+                data_info.append((2, cnt_2))
+            else: #neg alias
+                data_info.append((2, -cnt_2))
+
+    sc = N.asarray(model.jmimodel.get_variable_scaling_factors())
+    z = N.asarray(model.z)
+
+    rescale = (model.get_scaling_method() == 
+        jmi.JMI_SCALING_VARIABLES) and (not scaled)
+
+    # Data set 1 holds the parameters, data set 2 the trajectories. Time is
+    # never scaled.
+    n_vars = len(data[0,:])
+    par_vals = z[:n_parameters]
+    data_2 = N.array(data, dtype=float)
+    if rescale:
+        par_vals = par_vals*sc[:n_parameters]
+        data_2[:,1:] *= sc[n_parameters:n_parameters+n_vars-1]
+
+    if format == 'mat':
+        data_1 = N.empty((2, n_parameters + 1))
+        data_1[:,0] = [data[0,0], data[-1,0]]
+        data_1[:,1:] = par_vals
+        write_result_binary(
+            file_name, ['time'] + [name[1] for name in names],
+            ['Time in [s]'] + [desc[1] for desc in descriptions],
+            [(mat, ind, 0, -1) for (mat, ind) in data_info],
+            data_1, data_2)
+        return
+
+    # Open file
+    f = codecs.open(file_name,'w','utf-8')
+
+    # Write header
+    f.write('#1\n')
+    f.write('char Aclass(3,11)\n')
+    f.write('Atrajectory\n')
+    f.write('1.1\n')
+    f.write('\n')
+
+    num_vars = len(names)
+    
+    # Find the maximum name and description length
+    max_name_length = len('Time')
+    max_desc_length = len('Time in [s]')
+    
+    for i in range(len(names)):
+        name = names[i][1]
+        desc = descriptions[i][1]
         
-        for i in range(len(names)):
-            name = names[i][1]
-            desc = descriptions[i][1]
+        if (len(name)>max_name_length):
+            max_name_length = len(name)
             
-            if (len(name)>max_name_length):
-                max_name_length = len(name)
-                
-            if (len(desc)>max_desc_length):
-                max_desc_length = len(desc)
+        if (len(desc)>max_desc_length):
+            max_desc_length = len(desc)
 
-        f.write('char name(%d,%d)\n' % (num_vars + 1, max_name_length))
-        f.write('time\n')
-    
-        # write names
-        for name in names:
-            f.write(name[1] +'\n')
-
-        f.write('\n')
+    f.write('char name(%d,%d)\n' % (num_vars + 1, max_name_length))
+    f.write('time\n')
 
-        f.write('char description(%d,%d)\n' % (num_vars + 1, max_desc_length))
-        f.write('Time in [s]\n')
+    # write names
+    for name in names:
+        f.write(name[1] +'\n')
 
-        # write descriptions
-        for desc in descriptions:
-            f.write(desc[1]+'\n')
-            
-        f.write('\n')
+    f.write('\n')
 
-        # Write data meta information
-        offs = model.get_offsets()
-        n_parameters = offs[12] # offs[12] = offs_dx
-        f.write('int dataInfo(%d,%d)\n' % (num_vars + 1, 4))
-        f.write('0 1 0 -1 # time\n')
+    f.write('char description(%d,%d)\n' % (num_vars + 1, max_desc_length))
+    f.write('Time in [s]\n')
 
-        cnt_1 = 1
-        cnt_2 = 1
+    # write descriptions
+    for desc in descriptions:
+        f.write(desc[1]+'\n')
         
-        for i, name in enumerate(names):
-            (ref, type) = jmi._translate_value_ref(name[0])
-            
-            if int(ref) < n_parameters: # Put parameters in data set
-                if aliases[i][1] == 0: # no alias
-                    cnt_1 = cnt_1 + 1
-                    f.write('1 %d 0 -1 # ' % cnt_1 + name[1]+'\n')
-                elif aliases[i][1] == 1: # alias
-                    f.write('1 %d 0 -1 # ' % cnt_1 + name[1]+'\n')
-                else: # negated alias
-                    f.write('1 -%d 0 -1 # ' % cnt_1 + name[1] +'\n')
-                
-                
-            else:
-                if aliases[i][1] == 0: # noalias
-                    cnt_2 = cnt_2 + 1   
-                    f.write('2 %d 0 -1 # ' % cnt_2 + name[1] +'\n')
-                elif aliases[i][1] == 1: # alias
-                    f.write('2 %d 0 -1 # ' % cnt_2 + name[1] +'\n')
-                else: #neg alias
-                    f.write('2 -%d 0 -1 # ' % cnt_2 + name[1] +'\n')
-            
-                
-        f.write('\n')
-
-        sc = model.jmimodel.get_variable_scaling_factors()
-        z = model.z
+    f.write('\n')
 
-        rescale = (model.get_scaling_method() == 
-            jmi.JMI_SCALING_VARIABLES) and (not scaled)
-
-        # Write data
-        # Write data set 1
-        f.write('float data_1(%d,%d)\n' % (2, n_parameters + 1))
-        f.write("%.14E" % data[0,0])
-        str_text = ''
-        for ref in range(n_parameters):
-            #print ref
-            if rescale:
-                #print z[ref]*sc[ref]
-                #print "hej"
-                str_text += " %.14E" % (z[ref]*sc[ref])
-            else:
-                #print z[ref]
-                #print "hopp"
-                str_text += " %.14E" % (z[ref])
-                
-        f.write(str_text)
-        f.write('\n')
-        f.write("%.14E" % data[-1,0])
-        f.write(str_text)
+    # Write data meta information
+    f.write('int dataInfo(%d,%d)\n' % (num_vars + 1, 4))
+    f.write('0 1 0 -1 # time\n')
+    for (i, name) in enumerate(names):
+        f.write('%d %d 0 -1 # ' % data_info[i+1] + name[1] + '\n')
+            
+    f.write('\n')
 
-        f.write('\n\n')
+    # Write data
+    # Write data set 1
+    f.write('float data_1(%d,%d)\n' % (2, n_parameters + 1))
+    str_text = ''.join([" %.14E" % val for val in par_vals])
+    f.write("%.14E" % data[0,0])
+    f.write(str_text)
+    f.write('\n')
+    f.write("%.14E" % data[-1,0])
+    f.write(str_text)
 
-        # Write data set 2
-        n_vars = len(data[0,:])
-        n_points = len(data[:,0])
-        f.write('float data_2(%d,%d)\n' % (n_points, n_vars))
-        for i in range(n_points):
-            str = ''
-            for ref in range(n_vars):
-                if ref==0: # Don't scale time
-                    str = str + (" %.14E" % data[i,ref])
-                else:
-                    if rescale:
-                        str = str + (" %.14E" % (data[i,ref]*sc[ref-1+n_parameters]))
-                    else:
-                        str = str + (" %.14E" % data[i,ref])
-            f.write(str+'\n')
+    f.write('\n\n')
 
-        f.write('\n')
+    # Write data set 2
+    n_points = len(data[:,0])
+    f.write('float data_2(%d,%d)\n' % (n_points, n_vars))
+    write_data_block(f, data_2)
 
-        f.close()
+    f.write('\n')
 
-    else:
-        raise Error('Export on binary Dymola result files not yet supported.')
+    f.close()
 
 class ResultWriterDymolaSensitivity(ResultWriter):
     """
@@ -288,7 +384,9 @@ class ResultWriterDymolaSensitivity(ResultWriter):
                 
         Limitations::
         
-            Currently only textual format is supported.
+            Currently only textual format is supported. Use 
+            export_result_dymola with format 'mat' to write a complete 
+            result in the binary format.
         """
         self.model = model
         
@@ -532,6 +630,13 @@ class ResultWriterDymolaSensitivity(ResultWriter):
 
         self._nvariables_total = cnt_2 #Store the number of variables
         f.write('\n')
+        
+        # Scale factors and format string for a complete row in data set 2
+        # (time is not scaled)
+        self._scale = N.hstack(([1.0], 
+            N.asarray(sc)[n_parameters:n_parameters+cnt_2-1-len(self._sens_sc)],
+            self._sens_sc))
+        self._row_format = ' %.14E'*cnt_2 + '\n'
 
 
         # Write data
@@ -580,29 +685,14 @@ class ResultWriterDymolaSensitivity(ResultWriter):
                     data should consist of information about the status.
                     Default: None
         """
-        f = self._file
-        rescale = self._rescale
-        sc = self._sc
-        sens_sc = self._sens_sc
-        n_parameters = self._n_parameters
-
         if self._npoints == 0:
             self._tstart = data[0]
         
         #Write the point
-        str_text = (" %.14E" % data[0])
-        for j in xrange(self._nvariables_without_sens-1):
-            if rescale:
-                str_text = str_text + (" %.14E" %(data[1+j]*sc[j+n_parameters]))
-            else:
-                str_text = str_text + (" %.14E" % data[1+j])
-
-        for j in xrange(self._nvariables_total-self._nvariables_without_sens):
-            if rescale:
-                str_text = str_text + (" %.14E" %(data[j+self._nvariables_without_sens]*sens_sc[j]))
-            else:
-                str_text = str_text + (" %.14E" % data[j+self._nvariables_without_sens])
-        f.write(str_text+'\n')
+        values = N.asarray(data[:self._nvariables_total], dtype=float)
+        if self._rescale:
+            values = values*self._scale
+        self._file.write(self._row_format % tuple(values))
         
         #Update number of points
         self._npoints+=1
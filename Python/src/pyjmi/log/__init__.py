@@ -19,7 +19,8 @@
 The JModelica Python log analysis toolkit. 
 """
 
-from parser import parse_xml_log, parse_jmi_log, extract_jmi_log
+from parser import parse_xml_log, parse_jmi_log, extract_jmi_log, \
+     iterparse_xml_log, iterparse_jmi_log
 from jmi_log import gather_solves
 from prettyprinter import prettyprint_to_file
 
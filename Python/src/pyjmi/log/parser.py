@@ -40,6 +40,13 @@ semicolon_re = "((?:[^;']|(?:'[^']*'))*)(?:;|\Z)"
 comma_pattern     = re.compile(comma_re)
 semicolon_pattern = re.compile(semicolon_re)
 
+# Vectors and matrices with only these characters are parsed directly by NumPy
+numeric_re         = "^[-+0-9eE.,;\s]*$"
+integer_vector_re  = "^\s*[0-9]+\s*(?:,\s*[0-9]+\s*)*$"
+
+numeric_pattern        = re.compile(numeric_re)
+integer_vector_pattern = re.compile(integer_vector_re)
+
 def parse_value(text):
     """Parse the string text and return a string, float, or int."""
     text = text.strip()
@@ -55,10 +62,40 @@ def parse_value(text):
 #        return text
         return text.encode('ascii', 'xmlcharrefreplace') # avoid printing all strings as u'...'
 
+def parse_numeric(text, ndim):
+    """
+    Parse a vector (ndim = 1) or matrix (ndim = 2) of numbers directly into a
+    NumPy array, without parsing each element separately. Returns None if text
+    is not a vector or matrix of numbers.
+    """
+    if numeric_pattern.match(text) is None:
+        return None
+    if ndim == 1:
+        rows = [text]
+    else:
+        rows = text.split(';')
+    if all([integer_vector_pattern.match(row) for row in rows]):
+        dtype = int
+    else:
+        dtype = float
+    try:
+        values = np.array([row.split(',') for row in rows], dtype=dtype)
+    except ValueError:
+        return None
+    if values.ndim != 2:
+        # Rows of different lengths
+        return None
+    if ndim == 1:
+        return values[0]
+    return values
+
 def parse_vector(text):
     text = text.strip()
     if text == "":
         return np.zeros(0)
+    values = parse_numeric(text, 1)
+    if values is not None:
+        return values
     parts = comma_pattern.split(text)
     parts = parts[1::2]
     return np.asarray([parse_value(part) for part in parts])
@@ -67,6 +104,9 @@ def parse_matrix(text):
     text = text.strip()
     if text == "":
         return np.zeros((0,0))
+    values = parse_numeric(text, 2)
+    if values is not None:
+        return values
     parts = semicolon_pattern.split(text)
     parts = parts[1::2]
     return np.asarray([parse_vector(part) for part in parts])
@@ -134,11 +174,63 @@ class ContentHandler(sax.ContentHandler):
             self.create_comment()
             self.nodes.pop()
 
-def create_parser():
+leaf_types = ('value', 'vector', 'matrix')
+
+class StreamingContentHandler(ContentHandler):
+    """
+    Content handler that only builds the selected nodes, and hands them over
+    as soon as they are complete, see take_completed.
+
+    If types is None, the top level nodes are selected, i.e. the children of
+    the root node. Otherwise, the outermost nodes with a type in types are
+    selected, at any depth. Comments outside the selected nodes are dropped.
+    """
+    def __init__(self, types=None):
+        ContentHandler.__init__(self)
+        self.nodes = []
+        if isinstance(types, basestring):
+            types = [types]
+        self.types = types
+        self.depth = 0
+        self.completed = []
+
+    def take_completed(self):
+        """Return the nodes completed since the last call."""
+        completed = self.completed
+        self.completed = []
+        return completed
+
+    def characters(self, content):
+        if len(self.nodes) > 0:
+            self.chars.append(content)
+
+    def startElement(self, type, attrs):
+        leaf = type in leaf_types
+        if not leaf:
+            self.depth += 1
+        if len(self.nodes) > 0:
+            ContentHandler.startElement(self, type, attrs)
+        elif not leaf and self.depth > 1:
+            if ((self.types is None and self.depth == 2) or
+                (self.types is not None and type in self.types)):
+                self.chars = []
+                self.nodes.append(Node(type))
+
+    def endElement(self, type):
+        if len(self.nodes) > 0:
+            node = self.nodes[0]
+            ContentHandler.endElement(self, type)
+            if len(self.nodes) == 0:
+                self.completed.append(node)
+        if type not in leaf_types:
+            self.depth -= 1
+
+def create_parser(handler=None):
     # note: hope that we get an IncrementalParser,
     # or JMI log parsing won't work
     parser = sax.make_parser()
-    handler = ContentHandler()
+    if handler is None:
+        handler = ContentHandler()
     parser.setContentHandler(handler)
     return parser, handler
 
@@ -161,6 +253,44 @@ def parse_xml_log(filename, accept_errors=False):
         
     return handler.get_root()
 
+def iterparse_xml_log(filename, types=None, accept_errors=False,
+                      chunk_size=1 << 16):
+    """
+    Parse a pure XML JMI log as created by extract_jmi_log incrementally, and
+    yield the nodes as they are completed. Only the yielded nodes are kept in
+    memory, so the memory use does not grow with the size of the log.
+
+    If types is None, the top level nodes are yielded. Otherwise types is a
+    string or list of strings, and the outermost nodes with one of these
+    types are yielded, at any depth. If accept_errors is True and a parse
+    error occurs, the iteration stops at that point.
+    """
+    parser, handler = create_parser(StreamingContentHandler(types))
+    with open(filename, 'r') as f:
+        chunks = iter(lambda: f.read(chunk_size), '')
+        for node in _iterparse(parser, handler, chunks, accept_errors):
+            yield node
+
+def _iterparse(parser, handler, chunks, accept_errors):
+    """
+    Feed the chunks of text to parser, and yield the nodes completed by
+    handler.
+    """
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            for node in handler.take_completed():
+                yield node
+        parser.close()
+    except sax.SAXException as e:
+        if accept_errors:
+            print 'Warning: Failure during parsing of XML JMI log:\n', e
+            print 'Parsed log will be incomplete'
+        else:
+            raise Exception('Failed to parse XML JMI log:\n' + repr(e))
+    for node in handler.take_completed():
+        yield node
+
 # Support routines to parse JMI logs
 
 def parse_jmi_log(filename, modulename = 'Model', accept_errors=False):
@@ -186,6 +316,27 @@ def parse_jmi_log(filename, modulename = 'Model', accept_errors=False):
     
     return handler.get_root()
 
+def iterparse_jmi_log(filename, modulename = 'Model', types=None,
+                      accept_errors=False):
+    """
+    Parse the XML contents of a JMI log incrementally, and yield the nodes as
+    they are completed. Only the yielded nodes are kept in memory, so the
+    memory use does not grow with the size of the log.
+
+    modulename selects the module as recorded in the beginning of each line by
+    FMI Library. See iterparse_xml_log for the other arguments. For example,
+
+        for solve in iterparse_jmi_log(filename, types='NewtonSolve'):
+            ...
+
+    iterates over the Newton solves without building the rest of the log.
+    """
+    parser, handler = create_parser(StreamingContentHandler(types))
+    with open(filename, 'r') as f:
+        chunks = iter_jmi_log(f, modulename)
+        for node in _iterparse(parser, handler, chunks, accept_errors):
+            yield node
+
 def extract_jmi_log(destfilename, filename, modulename = 'Model'):
     """
     Extract the XML contents of a JMI log and write as a new file destfilename.
@@ -198,7 +349,14 @@ def extract_jmi_log(destfilename, filename, modulename = 'Model'):
             filter_jmi_log(destfile.write, sourcefile, modulename)
 
 def filter_jmi_log(write, sourcefile, modulename = 'Model'):
-    write('<?xml version="1.0" encoding="UTF-8"?>\n<JMILog category="info">\n')
+    for text in iter_jmi_log(sourcefile, modulename):
+        write(text)
+
+def iter_jmi_log(sourcefile, modulename = 'Model'):
+    """
+    Yield the XML contents of the JMI log in sourcefile, line by line.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<JMILog category="info">\n'
 
     pre_re = r'FMIL: module = ' + modulename + r', log level = ([0-9]+): \[([^]]+)\]\[FMU status:([^]]+)\] '
     pre_pattern = re.compile(pre_re)
@@ -207,6 +365,6 @@ def filter_jmi_log(write, sourcefile, modulename = 'Model'):
         m = pre_pattern.match(line)
         if m is not None:
             # log_level, category, fmu_status = m.groups()
-            write(line[m.end():])
+            yield line[m.end():]
 
-    write('</JMILog>\n')
+    yield '</JMILog>\n'
@@ -18,136 +18,588 @@
 Utility functions for extracting and filtering FMU logs
 """
 
-def get_structured_fmu_log(log_file):
-    
-    f = open(log_file)
-
-    l = f.readline()
-
-    d = []
-
-    jacs = {}
-    jacs_updated = {}
-    jac_parsing_in_progress = False
-
-    scalings = {}
-    scalings_updated = {}
-
-    while l != '':
-        #print l
-
-        if l.find('[NLE_JAC]')>=0:
-            ll = l.split(';')
-            if not jac_parsing_in_progress:
-                jacs[int(ll[1])] = []
-                jacs_updated[int(ll[1])] = True
-                jac_parsing_in_progress = True
-            jacs[int(ll[1])].append([])
-            for v in ll[5:-1]:
-                jacs[int(ll[1])][-1].append(float(v))
-
-        if l.find('[NLE_JAC]')==-1:
-            jac_parsing_in_progress = False
-
-        if l.find('[NLE_SCALING]')>=0 and l.find('Updating')>=0:
-            ll = l.split(';')
-            scalings[int(ll[1])] = []
-            scalings_updated[int(ll[1])] = True
-            for v in ll[5:-1]:
-                scalings[int(ll[1])].append(float(v))
-
-        if l.find('[NLE_ITERS]')>=0:
-            # Detect a solve has started
-            if l.find('Model equations evaluation invoked at time:')>=0:
-                s = {}
-                ll = l.split(';')
-                s['time'] = float(ll[-1])
-                s['block_solves'] = [] 
+import re
+import cPickle
 
-            if l.find('Newton solver invoked')>=0:
-                bl = {}
-                bl['names'] = []
-                bl['iterations'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    bl['names'].append(ll[i])
-                bl['block_index'] = int(ll[1])
-                bl['initial_residual_scaling'] = scalings[int(ll[1])]
-                bl['initial_residual_scaling_updated'] = scalings_updated[int(ll[1])]
-                if scalings_updated[int(ll[1])]:
-                    scalings_updated[int(ll[1])] = False
-				
-            if l.find('Iteration')>=0:
-                iteration = {}
-                bl['iterations'].append(iteration)
-                iteration['iteration_variables'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    iteration['iteration_variables'].append(float(ll[i]))
-
-                if len(jacs)>0:
-                    iteration['jacobian'] = jacs[int(ll[1])]
-                    iteration['jacobian_updated'] = jacs_updated[int(ll[1])]
-                    if jacs_updated[int(ll[1])]:
-                        jacs_updated[int(ll[1])] = False
-
-                iteration['residual_scaling'] = scalings[int(ll[1])]
-                iteration['residual_scaling_updated'] = scalings_updated[int(ll[1])]
-                if scalings_updated[int(ll[1])]:
-                    scalings_updated[int(ll[1])] = False
-                    
-            if l.find('Residuals')>=0:
-                iteration['residuals'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    iteration['residuals'].append(float(ll[i]))
-                iteration['scaled_residual_norm'] = float(ll[3])
-                
-            if l.find('Limitation')>=0:
-                iteration['at_bound'] = []
-                l2 = l.split(';')
-                for i in range(5,len(l2)-1):
-                    iteration['at_bound'].append(tuple(l2[i].split()))
-                
-            if l.find('Max')>=0:
-                bl['max'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    bl['max'].append(float(ll[i]))
+import numpy as N
 
-            if l.find('Initial guess')>=0:
-                bl['initial_guess'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    bl['initial_guess'].append(float(ll[i]))
+# Tags of the log lines that are extracted
+_tag_pattern = re.compile(r'\[(NLE_JAC|NLE_SCALING|NLE_ITERS)\]')
 
-            if l.find('Variable nominal')>=0:
-                bl['variable_nominal'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    bl['variable_nominal'].append(float(ll[i]))
+# Messages of the [NLE_ITERS] lines, longest first so that no message is
+# shadowed by a prefix of it
+_iters_messages = ['Model equations evaluation invoked at time:',
+                   'Model equations evaluation finished',
+                   'Newton solver finished with exit flag',
+                   'Newton solver invoked', 'Newton solver finished',
+                   'Variable nominal', 'Initial guess', 'Iteration',
+                   'Residuals', 'Limitation', 'Max', 'Min']
+_iters_pattern = re.compile('|'.join([re.escape(m) for m in _iters_messages]))
 
-            if l.find('Min')>=0:
-                bl['min'] = []
-                ll = l.split(';')
-                for i in range(5,len(ll)-1):
-                    bl['min'].append(float(ll[i]))
+# Block vectors and the messages of the lines they are given on
+_block_vectors = [('max', 'Max'), ('initial_guess', 'Initial guess'),
+                  ('variable_nominal', 'Variable nominal'), ('min', 'Min')]
+
+def _values(ll):
+    """Convert the value fields of a split log line to a float array."""
+    return N.array(ll[5:-1], dtype=float)
+
+class _RaggedBuilder(object):
+
+    """
+    Collects arrays of varying length, which are stored as one
+    concatenated array together with the offset of each array.
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def append(self, values):
+        """Add an array and return its index."""
+        self.parts.append(values)
+        return len(self.parts) - 1
+
+    def build(self):
+        """Return the concatenated values and the offsets."""
+        offsets = N.zeros(len(self.parts) + 1, dtype=int)
+        offsets[1:] = N.cumsum([len(p) for p in self.parts])
+        if len(self.parts) > 0:
+            values = N.concatenate(self.parts)
+        else:
+            values = N.zeros(0)
+        return (values, offsets)
+
+class FMULogIndex(object):
+
+    """
+    Compact index of the nonlinear block solves in an FMU log.
+
+    The log is tokenized in a single pass. Every model equations
+    evaluation (solve) is given its time, and every finished Newton solve
+    of a block (block solve) its block index, the solve it belongs to and
+    the offset of its iterations. Iteration variables, residuals,
+    scalings and Jacobians are kept in concatenated NumPy arrays, and a
+    Jacobian or scaling that is reused by several iterations is only
+    stored once.
+
+    Block solves are found by block and time window with
+    find_block_solves and extracted with get_block_solve. The index is
+    stored with save and restored with FMULogIndex.load.
+    """
+
+    def __init__(self, log_file=None):
+        """
+        Create the index of an FMU log.
+
+        Parameters::
+
+            log_file --
+                Name of the FMU log file. If None, an empty index is
+                created.
+                Default: None
+        """
+        self.solve_times = N.zeros(0)
+        self.solve_offsets = N.zeros(1, dtype=int)
+        self.block_ids = N.zeros(0, dtype=int)
+        self.block_solves = N.zeros(0, dtype=int)
+        self.block_times = N.zeros(0)
+        self.block_offsets = N.zeros(1, dtype=int)
+        self.block_names = N.zeros(0, dtype=int)
+        self.block_exit_flags = N.zeros(0, dtype=int)
+        self.block_scalings = N.zeros(0, dtype=int)
+        self.block_scalings_updated = N.zeros(0, dtype=bool)
+        self.block_vectors = dict((key, (N.zeros(0), N.zeros(1, dtype=int)))
+                                  for (key, _) in _block_vectors)
+        self.iteration_variables = (N.zeros(0), N.zeros(1, dtype=int))
+        self.residuals = (N.zeros(0), N.zeros(1, dtype=int))
+        self.scaled_residual_norms = N.zeros(0)
+        self.iteration_has_residuals = N.zeros(0, dtype=bool)
+        self.iteration_jacobians = N.zeros(0, dtype=int)
+        self.iteration_jacobians_updated = N.zeros(0, dtype=bool)
+        self.iteration_scalings = N.zeros(0, dtype=int)
+        self.iteration_scalings_updated = N.zeros(0, dtype=bool)
+        self.at_bound = {}
+        self.jacobians = (N.zeros(0), N.zeros(1, dtype=int))
+        self.jacobian_rows = N.zeros(0, dtype=int)
+        self.scalings = (N.zeros(0), N.zeros(1, dtype=int))
+        self.names = []
+        self.exit_flags = []
+        if log_file is not None:
+            self._build(log_file)
+
+    def _build(self, log_file):
+        """Tokenize the log and build the index arrays."""
+        solve_times = []
+        solve_offsets = [0]
+        block_ids = []
+        block_solves = []
+        block_offsets = [0]
+        block_names = []
+        block_exit_flags = []
+        block_scalings = []
+        block_scalings_updated = []
+        block_vectors = dict((key, _RaggedBuilder())
+                             for (key, _) in _block_vectors)
+        iteration_variables = _RaggedBuilder()
+        residuals = _RaggedBuilder()
+        scaled_residual_norms = []
+        iteration_has_residuals = []
+        iteration_jacobians = []
+        iteration_jacobians_updated = []
+        iteration_scalings = []
+        iteration_scalings_updated = []
+        at_bound = {}
+        jacobians = _RaggedBuilder()
+        jacobian_rows = []
+        scalings = _RaggedBuilder()
+        names = {}
+        exit_flags = {}
+
+        # Current Jacobian and scaling of each block
+        jacs = {}
+        jacs_updated = {}
+        scals = {}
+        scals_updated = {}
 
-            if l.find('Newton solver finished with exit flag')>=0:
+        # Rows of the Jacobian being parsed
+        jac_block = None
+        jac_rows = []
+
+        # Solve and block solve in progress, added when finished
+        solve = None
+        block = None
+        iteration = None
+
+        f = open(log_file)
+        try:
+            for l in f:
+                match = _tag_pattern.search(l)
+                tag = None if match is None else match.group(1)
+
+                # A Jacobian ends at the first line that is not a row of it
+                if jac_block is not None and tag != 'NLE_JAC':
+                    jacs[jac_block] = jacobians.append(N.concatenate(jac_rows))
+                    jacobian_rows.append(len(jac_rows))
+                    jacs_updated[jac_block] = True
+                    jac_block = None
+                if tag is None:
+                    continue
                 ll = l.split(';')
-                bl['kinsol_exit_flag'] = ll[3]
 
+                if tag == 'NLE_JAC':
+                    if jac_block is None:
+                        jac_block = int(ll[1])
+                        jac_rows = []
+                    jac_rows.append(_values(ll))
+                    continue
+
+                if tag == 'NLE_SCALING':
+                    if 'Updating' in l:
+                        i = int(ll[1])
+                        scals[i] = scalings.append(_values(ll))
+                        scals_updated[i] = True
+                    continue
+
+                messages = set(_iters_pattern.findall(l))
+                if len(messages) == 0:
+                    continue
+
+                if 'Model equations evaluation invoked at time:' in messages:
+                    solve = {'time': float(ll[-1]), 'block_solves': []}
+
+                if 'Newton solver invoked' in messages:
+                    i = int(ll[1])
+                    block = {'block_index': i, 'names': tuple(ll[5:-1]),
+                             'iterations': [], 'vectors': {},
+                             'scaling': scals.get(i, -1),
+                             'scaling_updated': scals_updated.get(i, False),
+                             'exit_flag': None}
+                    scals_updated[i] = False
+
+                if 'Iteration' in messages:
+                    i = int(ll[1])
+                    iteration = {'variables': _values(ll),
+                                 'jacobian': jacs.get(i, -1),
+                                 'jacobian_updated': jacs_updated.get(i, False),
+                                 'scaling': scals.get(i, -1),
+                                 'scaling_updated': scals_updated.get(i, False),
+                                 'residuals': N.zeros(0), 'norm': N.nan,
+                                 'has_residuals': False,
+                                 'at_bound': None}
+                    jacs_updated[i] = False
+                    scals_updated[i] = False
+                    block['iterations'].append(iteration)
+
+                if 'Residuals' in messages:
+                    iteration['residuals'] = _values(ll)
+                    iteration['norm'] = float(ll[3])
+                    iteration['has_residuals'] = True
+
+                if 'Limitation' in messages:
+                    iteration['at_bound'] = [tuple(v.split())
+                                             for v in ll[5:-1]]
+
+                for (key, message) in _block_vectors:
+                    if message in messages:
+                        block['vectors'][key] = _values(ll)
+
+                if 'Newton solver finished with exit flag' in messages:
+                    block['exit_flag'] = ll[3]
+                    solve['block_solves'].append(block)
+                elif 'Newton solver finished' in messages:
+                    solve['block_solves'].append(block)
+
+                if 'Model equations evaluation finished' in messages:
+                    # Add the solve and its block solves to the index
+                    for bl in solve['block_solves']:
+                        block_ids.append(bl['block_index'])
+                        block_solves.append(len(solve_times))
+                        block_names.append(
+                            names.setdefault(bl['names'], len(names)))
+                        block_exit_flags.append(
+                            exit_flags.setdefault(bl['exit_flag'],
+                                                  len(exit_flags)))
+                        block_scalings.append(bl['scaling'])
+                        block_scalings_updated.append(bl['scaling_updated'])
+                        for (key, _) in _block_vectors:
+                            block_vectors[key].append(
+                                bl['vectors'].get(key, N.zeros(0)))
+                        for it in bl['iterations']:
+                            if it['at_bound'] is not None:
+                                at_bound[len(scaled_residual_norms)] = \
+                                    it['at_bound']
+                            iteration_variables.append(it['variables'])
+                            residuals.append(it['residuals'])
+                            scaled_residual_norms.append(it['norm'])
+                            iteration_has_residuals.append(
+                                it['has_residuals'])
+                            iteration_jacobians.append(it['jacobian'])
+                            iteration_jacobians_updated.append(
+                                it['jacobian_updated'])
+                            iteration_scalings.append(it['scaling'])
+                            iteration_scalings_updated.append(
+                                it['scaling_updated'])
+                        block_offsets.append(len(scaled_residual_norms))
+                    solve_times.append(solve['time'])
+                    solve_offsets.append(len(block_ids))
+            if jac_block is not None:
+                jacs[jac_block] = jacobians.append(N.concatenate(jac_rows))
+                jacobian_rows.append(len(jac_rows))
+        finally:
+            f.close()
+
+        self.solve_times = N.array(solve_times, dtype=float)
+        self.solve_offsets = N.array(solve_offsets, dtype=int)
+        self.block_ids = N.array(block_ids, dtype=int)
+        self.block_solves = N.array(block_solves, dtype=int)
+        self.block_times = self.solve_times[self.block_solves]
+        self.block_offsets = N.array(block_offsets, dtype=int)
+        self.block_names = N.array(block_names, dtype=int)
+        self.block_exit_flags = N.array(block_exit_flags, dtype=int)
+        self.block_scalings = N.array(block_scalings, dtype=int)
+        self.block_scalings_updated = N.array(block_scalings_updated,
+                                              dtype=bool)
+        self.block_vectors = dict((key, builder.build()) for
+                                  (key, builder) in block_vectors.iteritems())
+        self.iteration_variables = iteration_variables.build()
+        self.residuals = residuals.build()
+        self.scaled_residual_norms = N.array(scaled_residual_norms,
+                                             dtype=float)
+        self.iteration_has_residuals = N.array(iteration_has_residuals,
+                                               dtype=bool)
+        self.iteration_jacobians = N.array(iteration_jacobians, dtype=int)
+        self.iteration_jacobians_updated = N.array(
+            iteration_jacobians_updated, dtype=bool)
+        self.iteration_scalings = N.array(iteration_scalings, dtype=int)
+        self.iteration_scalings_updated = N.array(iteration_scalings_updated,
+                                                  dtype=bool)
+        self.at_bound = at_bound
+        self.jacobians = jacobians.build()
+        self.jacobian_rows = N.array(jacobian_rows, dtype=int)
+        self.scalings = scalings.build()
+        self.names = [None] * len(names)
+        for (key, i) in names.iteritems():
+            self.names[i] = list(key)
+        self.exit_flags = [None] * len(exit_flags)
+        for (key, i) in exit_flags.iteritems():
+            self.exit_flags[i] = key
+
+    @staticmethod
+    def _get_ragged(ragged, i):
+        (values, offsets) = ragged
+        return values[offsets[i]:offsets[i + 1]]
+
+    def get_number_of_solves(self):
+        """Return the number of model equations evaluations."""
+        return len(self.solve_times)
+
+    def get_number_of_block_solves(self):
+        """Return the number of block solves."""
+        return len(self.block_ids)
+
+    def get_jacobian(self, i):
+        """
+        Return a Jacobian as a two-dimensional array.
+
+        Parameters::
+
+            i --
+                Index of the Jacobian, as given by the iterations.
+
+        Returns::
+
+            The Jacobian.
+        """
+        return self._get_ragged(self.jacobians, i).reshape(
+            self.jacobian_rows[i], -1)
+
+    def get_scaling(self, i):
+        """
+        Return a residual scaling.
+
+        Parameters::
+
+            i --
+                Index of the scaling, as given by the block solves and
+                iterations.
+
+        Returns::
+
+            The scaling as a one-dimensional array.
+        """
+        return self._get_ragged(self.scalings, i)
+
+    def find_solves(self, t_start=None, t_stop=None):
+        """
+        Find the model equations evaluations in a time window.
+
+        Parameters::
+
+            t_start --
+                Start of the time window. If None, the window is not
+                bounded from below.
+                Default: None
+
+            t_stop --
+                End of the time window. If None, the window is not
+                bounded from above.
+                Default: None
+
+        Returns::
+
+            Array of the indices of the solves.
+        """
+        mask = N.ones(len(self.solve_times), dtype=bool)
+        if t_start is not None:
+            mask &= self.solve_times >= t_start
+        if t_stop is not None:
+            mask &= self.solve_times <= t_stop
+        return N.flatnonzero(mask)
+
+    def find_block_solves(self, block=None, t_start=None, t_stop=None):
+        """
+        Find the block solves of a block in a time window.
+
+        Parameters::
+
+            block --
+                Block index, or list of block indices. If None, the block
+                solves of all blocks are found.
+                Default: None
+
+            t_start --
+                Start of the time window. If None, the window is not
+                bounded from below.
+                Default: None
+
+            t_stop --
+                End of the time window. If None, the window is not
+                bounded from above.
+                Default: None
+
+        Returns::
+
+            Array of the indices of the block solves, in log order.
+        """
+        mask = N.ones(len(self.block_ids), dtype=bool)
+        if block is not None:
+            mask &= N.in1d(self.block_ids, N.atleast_1d(block))
+        if t_start is not None:
+            mask &= self.block_times >= t_start
+        if t_stop is not None:
+            mask &= self.block_times <= t_stop
+        return N.flatnonzero(mask)
+
+    def get_iteration(self, k):
+        """
+        Return an iteration in the format of get_structured_fmu_log.
+
+        Parameters::
+
+            k --
+                Index of the iteration.
+
+        Returns::
+
+            Dictionary with the iteration_variables, residuals and
+            scaled_residual_norm of the iteration, the jacobian and
+            residual_scaling used and whether they were updated, and
+            at_bound if variables were limited.
+        """
+        iteration = {}
+        iteration['iteration_variables'] = \
+            self._get_ragged(self.iteration_variables, k)
+        jac = self.iteration_jacobians[k]
+        if jac >= 0:
+            iteration['jacobian'] = self.get_jacobian(jac)
+            iteration['jacobian_updated'] = \
+                bool(self.iteration_jacobians_updated[k])
+        scaling = self.iteration_scalings[k]
+        iteration['residual_scaling'] = (self.get_scaling(scaling)
+                                         if scaling >= 0 else None)
+        iteration['residual_scaling_updated'] = \
+            bool(self.iteration_scalings_updated[k])
+        if self.iteration_has_residuals[k]:
+            iteration['residuals'] = self._get_ragged(self.residuals, k)
+            iteration['scaled_residual_norm'] = self.scaled_residual_norms[k]
+        if k in self.at_bound:
+            iteration['at_bound'] = self.at_bound[k]
+        return iteration
+
+    def get_block_solve(self, i):
+        """
+        Return a block solve in the format of get_structured_fmu_log.
+
+        Parameters::
+
+            i --
+                Index of the block solve.
+
+        Returns::
+
+            Dictionary with the block_index, names, time and iterations
+            of the block solve, its initial residual scaling and, when
+            given in the log, its kinsol_exit_flag and the max, min,
+            initial_guess and variable_nominal vectors.
+        """
+        bl = {}
+        bl['block_index'] = int(self.block_ids[i])
+        bl['names'] = self.names[self.block_names[i]]
+        bl['time'] = self.block_times[i]
+        scaling = self.block_scalings[i]
+        bl['initial_residual_scaling'] = (self.get_scaling(scaling)
+                                          if scaling >= 0 else None)
+        bl['initial_residual_scaling_updated'] = \
+            bool(self.block_scalings_updated[i])
+        for (key, _) in _block_vectors:
+            values = self._get_ragged(self.block_vectors[key], i)
+            if len(values) > 0:
+                bl[key] = values
+        exit_flag = self.exit_flags[self.block_exit_flags[i]]
+        if exit_flag is not None:
+            bl['kinsol_exit_flag'] = exit_flag
+        bl['iterations'] = [self.get_iteration(k) for k in
+                            xrange(self.block_offsets[i],
+                                   self.block_offsets[i + 1])]
+        return bl
+
+    def get_solve(self, i):
+        """
+        Return a model equations evaluation in the format of
+        get_structured_fmu_log.
+
+        Parameters::
+
+            i --
+                Index of the solve.
+
+        Returns::
+
+            Dictionary with the time and block_solves of the solve.
+        """
+        return {'time': self.solve_times[i],
+                'block_solves': [self.get_block_solve(j) for j in
+                                 xrange(self.solve_offsets[i],
+                                        self.solve_offsets[i + 1])]}
+
+    def get_structured_log(self, t_start=None, t_stop=None):
+        """
+        Return the solves in a time window in the format of
+        get_structured_fmu_log.
+
+        Parameters::
+
+            t_start --
+                Start of the time window. If None, the window is not
+                bounded from below.
+                Default: None
+
+            t_stop --
+                End of the time window. If None, the window is not
+                bounded from above.
+                Default: None
+
+        Returns::
+
+            List of solve dictionaries.
+        """
+        return [self.get_solve(i) for i in self.find_solves(t_start, t_stop)]
+
+    def save(self, file_name):
+        """
+        Save the index to a file.
+
+        Parameters::
+
+            file_name --
+                Name of the file.
+        """
+        f = open(file_name, 'wb')
+        try:
+            cPickle.dump(self.__dict__, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, file_name):
+        """
+        Load an index saved with save.
+
+        Parameters::
+
+            file_name --
+                Name of the file.
+
+        Returns::
+
+            The FMULogIndex.
+        """
+        index = cls()
+        f = open(file_name, 'rb')
+        try:
+            index.__dict__.update(cPickle.load(f))
+        finally:
+            f.close()
+        return index
+
+def get_structured_fmu_log(log_file):
+    """
+    Extract the nonlinear block solves of an FMU log.
+
+    The Jacobians, residuals, scalings and other vectors are given as
+    NumPy arrays. Use FMULogIndex directly to only extract some blocks
+    or time windows, or to save the parsed log.
 
-            if l.find('Newton solver finished')>=0:
-                s['block_solves'].append(bl)
+    Parameters::
 
-            # Detect a solve has ended
-            if l.find('Model equations evaluation finished')>=0:
-                d.append(s)
+        log_file --
+            Name of the FMU log file.
 
-        l = f.readline()
+    Returns::
 
-    return d
+        List with a dictionary for each model equations evaluation.
+    """
+    return FMULogIndex(log_file).get_structured_log()
        
 def FMU_write_log_to_file(log_file, tags=[], file_name='fmu_log.txt'):
     
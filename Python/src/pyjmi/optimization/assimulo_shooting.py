@@ -20,6 +20,8 @@ simulation package Assimulo.
 """
 
 
+import multiprocessing
+
 import numpy as N
 import pylab as P
 from scipy.optimize import slsqp
@@ -36,11 +38,38 @@ class Multiple_Shooting_Exception(Exception):
     """
     pass
 
+# The Multiple_Shooting object used by a worker process, which gets a copy of
+# it, including its simulator and model, when it is forked
+_shooting = None
+
+def _init_worker(shooting):
+    """
+    Set the Multiple_Shooting object of a worker process. Used as the Pool
+    initializer, so that workers that the Pool starts again later get it as
+    well.
+    """
+    global _shooting
+    _shooting = shooting
+
+def _integrate_segment_chunk(args):
+    """
+    Integrate a list of segments in a worker process. Help function to
+    Multiple_Shooting._evaluate.
+    """
+    (indices, u, y, sensitivities) = args
+    return [_shooting._integrate_segment(i, u[i], y[i], sensitivities)
+            for i in indices]
+
 class Multiple_Shooting(object):
     
-    def __init__(self, simulator, gridsize, initial_u):
+    def __init__(self, simulator, gridsize, initial_u, processes=None):
         """
         Initiates the shooting algorithm.
+
+        The segments are integrated concurrently in processes forked from the
+        current one, each with its own copy of the simulator and model.
+        processes is the number of processes, None means the number of CPUs
+        and 1 means that the segments are integrated in the current process.
         """
         #Set default parameters
         self.set_default_param()
@@ -59,6 +88,12 @@ class Multiple_Shooting(object):
         self.initial_u = initial_u
         self.initial_y = self.model.real_x.copy()
         
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = max(1, min(processes, gridsize))
+        self._pool = None
+        self._segment_cache = None
+        
         #Sets the verbosity, default=NORMAL
         self.verbosity = Multiple_Shooting.NORMAL
     
@@ -71,6 +106,7 @@ class Multiple_Shooting(object):
         self.optMethod = 'scipy_slsqp'
         self.ftol = 1e-6
         self.maxTime = 700
+        self.fdStep = 1e-5
     
     def check_initial_u(self):
         """
@@ -156,44 +192,166 @@ class Multiple_Shooting(object):
         
         return [u, y]
     
-    def f(self, p):
+    def _get_segment_times(self, i):
         """
-        This is our cost function to be optimized over.
+        Returns the start and final time of segment i.
         """
+        start_time = (self.final_time-self.start_time)/self.gridsize*i
+        final_time = (self.final_time-self.start_time)/self.gridsize*(i+1)
+        return (start_time, final_time)
+    
+    def _simulate_segment(self, i, u_i, y_i):
+        """
+        Integrates segment i from the state y_i with the input u_i. Returns
+        the final state, or the cost for the last segment.
+        """
+        (start_time, final_time) = self._get_segment_times(i)
+        if i < self.gridsize-1:
+            self.model.real_u = u_i
+            self.simulator.re_init(start_time, y_i)
+            try:
+                [t, y_sol] = self.simulator(final_time, 1)
+            except:
+                y_sol = [N.array([N.nan]*self.nbr_ys)]
+            return N.array(y_sol[-1], dtype=float).flatten()
         
-        [u, y] = self.split_p(p)
-        
-        if self.verbosity >= Multiple_Shooting.SCREAM:
-            print 'Calculating cost...'
-            print 'Input u:', u[-1]
-            print 'Input y: ', y[-1,:-1]
-        
-        start_time = (self.final_time-self.start_time)/self.gridsize*(self.gridsize-1)
-
         try:
-            self.model.real_u = u[-1]
-            self.simulator.re_init(start_time,y[-1]) #Re initiates the solver to the new values
+            self.model.real_u = u_i
+            self.simulator.re_init(start_time, y_i) #Re initiates the solver to the new values
             [ts, ys] = self.simulator(self.final_time,1) #Run the simulation to final time
             
-            self.model.real_u = u[-1]
+            self.model.real_u = u_i
             self.model.real_x = ys[-1]
             
             #Set values for calculation of the cost function
             self.model.set_real_x_p(ys[-1], 0)
             self.model.set_real_dx_p(self.model.real_dx, 0)
-            self.model.set_real_u_p(u[-1], 0)
+            self.model.set_real_u_p(u_i, 0)
             
             cost = self.model.opt_eval_J() #Evaluate the cost function
         except:
             cost = N.array(N.nan)
+        return N.array(cost, dtype=float).flatten()
+    
+    def _integrate_segment(self, i, u_i, y_i, sensitivities):
+        """
+        Integrates segment i, see _simulate_segment.
+        
+        If sensitivities is True, the Jacobian of the result with respect to
+        (u_i, y_i) is computed as well, by forward differences with the
+        relative step fdStep. The initial state of the first segment is
+        fixed, so no derivatives are computed with respect to it.
+        
+        Returns::
+        
+            (result, jacobian), where jacobian is None if sensitivities is
+            False.
+        """
+        result = self._simulate_segment(i, u_i, y_i)
+        if not sensitivities:
+            return (result, None)
+        
+        z = N.append(u_i, y_i).astype(float)
+        jac = N.zeros([len(result), len(z)])
+        nbr_z = self.nbr_us if i == 0 else len(z)
+        for j in range(nbr_z):
+            step = self.fdStep*max(abs(z[j]), 1.)
+            z_j = z.copy()
+            z_j[j] += step
+            result_j = self._simulate_segment(i, z_j[:self.nbr_us],
+                                              z_j[self.nbr_us:])
+            jac[:, j] = (result_j-result)/step
+        return (result, jac)
+    
+    def _get_pool(self):
+        """
+        Returns the pool of worker processes, which is created when first
+        needed.
+        """
+        if self._pool is None:
+            # The initializer arguments are inherited, not pickled, by the
+            # forked workers
+            self._pool = multiprocessing.Pool(self.processes, _init_worker,
+                                              (self,))
+        return self._pool
+    
+    def close_pool(self):
+        """
+        Terminates the worker processes. They are started again when needed.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+    
+    def _evaluate(self, p, sensitivities=False):
+        """
+        Integrates all segments for the parameter vector p, concurrently if
+        processes > 1. The results for the last p are kept, so that the cost,
+        the constraints and their derivatives share one integration of the
+        segments.
+        
+        Returns::
+        
+            A list of (result, jacobian) for the segments, see
+            _integrate_segment.
+        """
+        key = N.array(p, dtype=float).tostring()
+        if (self._segment_cache is not None and
+            self._segment_cache[0] == key and
+            (self._segment_cache[1] or not sensitivities)):
+            return self._segment_cache[2]
+        
+        [u, y] = self.split_p(p)
+        indices = range(self.gridsize)
+        if self.processes > 1:
+            # Contiguous chunks of segments, one per process
+            chunk_size = -(-self.gridsize // self.processes)
+            chunks = [(indices[i:i+chunk_size], u, y, sensitivities)
+                      for i in range(0, self.gridsize, chunk_size)]
+            results = sum(self._get_pool().map(_integrate_segment_chunk,
+                                               chunks), [])
+        else:
+            results = [self._integrate_segment(i, u[i], y[i], sensitivities)
+                       for i in indices]
+        
+        self._segment_cache = (key, sensitivities, results)
+        return results
+    
+    def f(self, p):
+        """
+        This is our cost function to be optimized over.
+        """
+        
+        [u, y] = self.split_p(p)
+        
+        if self.verbosity >= Multiple_Shooting.SCREAM:
+            print 'Calculating cost...'
+            print 'Input u:', u[-1]
+            print 'Input y: ', y[-1,:-1]
+        
+        cost = self._evaluate(p)[-1][0][0]
         
         if  self.verbosity >= Multiple_Shooting.WHISPER:
             print 'Evaluating cost:', cost
-        #if  self.verbosity >= Multiple_Shooting.SCREAM:
-        #    print 'Evaluating cost: (u, y) = ', u[-1], ys[-1]
 
         return cost
     
+    def df(self, p):
+        """
+        The gradient of the cost function.
+        """
+        jac = self._evaluate(p, True)[-1][1]
+        
+        grad = N.zeros(len(p))
+        nbr_u = self.nbr_us*self.gridsize
+        i = self.gridsize-1
+        grad[i*self.nbr_us:(i+1)*self.nbr_us] = jac[0, :self.nbr_us]
+        if i > 0:
+            grad[nbr_u+(i-1)*self.nbr_ys:nbr_u+i*self.nbr_ys] = \
+                jac[0, self.nbr_us:]
+        return grad
+    
     def h(self, p):
         """
         These are the equility constraints that arises from optimizing
@@ -206,22 +364,8 @@ class Multiple_Shooting(object):
             print 'Input u:', u
             print 'Input y: ', y
         
-        y_calc = N.array([])
-
-        for i in range(self.gridsize-1):
-            
-            start_time = (self.final_time-self.start_time)/self.gridsize*i
-            final_time = (self.final_time-self.start_time)/self.gridsize*(i+1)
-            
-            self.model.real_u = u[i]
-            self.simulator.re_init(start_time, y[i])
-            try:
-                [t, y_sol] = self.simulator(final_time, 1)
-            except:
-                y_sol = [N.array([N.nan]*self.nbr_ys)]
-                
-            y_calc = N.append(y_calc,y_sol[-1].flatten())
-            
+        results = self._evaluate(p)[:-1]
+        y_calc = N.array([result for (result, _) in results])
         y_calc = y_calc.reshape(self.gridsize-1,self.nbr_ys)
             
         cons = y[1:,:]-y_calc[:,:]
@@ -231,6 +375,26 @@ class Multiple_Shooting(object):
             print 'Equility constraints: ', cons.sum()
 
         return cons
+    
+    def dh(self, p):
+        """
+        The Jacobian of the equality constraints.
+        """
+        results = self._evaluate(p, True)[:-1]
+        
+        nbr_u = self.nbr_us*self.gridsize
+        jac = N.zeros([(self.gridsize-1)*self.nbr_ys, len(p)])
+        for (i, (_, jac_i)) in enumerate(results):
+            rows = slice(i*self.nbr_ys, (i+1)*self.nbr_ys)
+            # The constraints are y_(i+1) - F_i(u_i, y_i)
+            jac[rows, nbr_u+i*self.nbr_ys:nbr_u+(i+1)*self.nbr_ys] = \
+                N.eye(self.nbr_ys)
+            jac[rows, i*self.nbr_us:(i+1)*self.nbr_us] = \
+                -jac_i[:, :self.nbr_us]
+            if i > 0:
+                jac[rows, nbr_u+(i-1)*self.nbr_ys:nbr_u+i*self.nbr_ys] = \
+                    -jac_i[:, self.nbr_us:]
+        return jac
         
     def run(self, plot=True):
         """
@@ -258,15 +422,20 @@ class Multiple_Shooting(object):
 
         # Get OpenOPT handler
         p_solve = NLP(self.f,p0,lb = lbound, ub=ubound,maxFunEvals = self.maxFeval, maxIter = self.maxIter, ftol=self.ftol, maxTime=self.maxTime)
+        p_solve.df = self.df
         
         #If multiple shooting is preformed or single shooting
         if self.gridsize > 1:
             p_solve.h  = self.h
+            p_solve.dh = self.dh
         
         if plot:
             p_solve.plot = 1
 
-        self.opt = p_solve.solve(self.optMethod)        
+        try:
+            self.opt = p_solve.solve(self.optMethod)
+        finally:
+            self.close_pool()
         
         return self.opt
         
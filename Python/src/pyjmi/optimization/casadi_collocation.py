@@ -29,10 +29,20 @@ import copy
 import types
 import math
 import os
-from os import system, path
+import sys
+import threading
+import hashlib
+import tempfile
+import functools
+import multiprocessing
+from os import path
+from subprocess import Popen
 from operator import sub
 from collections import OrderedDict, Iterable
+import scipy.sparse
 from scipy.sparse import csc_matrix, csr_matrix
+from scipy.sparse.linalg import (splu, eigsh, onenormest, LinearOperator,
+                                 ArpackNoConvergence)
 
 try:
     import casadi
@@ -40,6 +50,11 @@ try:
 except ImportError:
     logging.warning('Could not find CasADi package, aborting.')
 import numpy as N
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
 from pyjmi.optimization.polynomial import *
 from pyjmi.common import xmlparser
@@ -65,7 +80,8 @@ except ImportError:
                              pymodelicaVariableNotFoundError)
 
 from pyjmi.common.algorithm_drivers import JMResultBase
-from pyjmi.common.io import ResultDymolaTextual
+from pyjmi.common.io import ResultDymolaTextual, ResultDymolaBinary, Trajectory
+from pyjmi.jmi_io import write_data_block, write_result_binary
 
 class CasadiCollocatorException(Exception):
     """
@@ -73,6 +89,54 @@ class CasadiCollocatorException(Exception):
     """
     pass
 
+def _get_peak_memory():
+    """
+    Returns the peak resident memory of the process in bytes, or None if it is
+    not available on this platform.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    else:
+        return peak * 1024
+
+# Protects the profiles of the collocators, which are also updated by the
+# threads that write result files asynchronously
+_profile_lock = threading.Lock()
+
+def _profiled(phase):
+    """
+    Decorator for collocator methods that records the CPU time, the number of
+    calls and the increase of the peak memory of the process in
+    self.profile[phase], see LocalDAECollocator.get_profile. Repeated calls
+    are accumulated.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            t0 = time.clock()
+            peak0 = _get_peak_memory()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                t = time.clock() - t0
+                peak = None if peak0 is None else _get_peak_memory() - peak0
+                with _profile_lock:
+                    try:
+                        profile = self.profile
+                    except AttributeError:
+                        profile = self.profile = OrderedDict()
+                    entry = profile.setdefault(
+                            phase, {'time': 0., 'calls': 0, 'peak_memory': None})
+                    entry['time'] += t
+                    entry['calls'] += 1
+                    if peak is not None:
+                        entry['peak_memory'] = (entry['peak_memory'] or 0) + peak
+        return wrapper
+    return decorator
+
 class CasadiCollocator(object):
 
     """
@@ -574,6 +638,7 @@ class CasadiCollocator(object):
         # Store the updated scaling factors
         self._par_vals[offset:offset + self.n_c] = scales
 
+    @_profiled('solve_nlp')
     def solve_nlp(self):
         """
         Calls the nonlinear programming solver.
@@ -623,6 +688,149 @@ class CasadiCollocator(object):
         sol_time = time.clock() - t0
         return sol_time
 
+    def prepare_sqp_step(self, active_tol=1e-6, hessian_reg=1e-8):
+        """
+        Linearize the NLP around the initial guess, as preparation for
+        sqp_step.
+
+        The Hessian of the Lagrangian is evaluated using the dual variables of
+        the last solution. The constraints and variable bounds that are active
+        at the initial guess, or have nonzero dual variables, are treated as
+        equality constraints in the step, and the KKT matrix of the resulting
+        equality constrained QP is factorized.
+
+        Parameters::
+
+            active_tol --
+                Tolerance used to determine the active constraints and
+                bounds.
+                Default: 1e-6
+
+            hessian_reg --
+                Regularization added to the diagonal of the Hessian.
+                Default: 1e-8
+        """
+        if self.order != "default":
+            raise CasadiCollocatorException(
+                "SQP steps are only supported for the default order.")
+        x = N.array(self.get_xx_init(), dtype=float).reshape(-1)
+        par_vals = self._get_par_vals()
+        lam_g = self._inv_scale_residuals(self.dual_opt['g'])
+        lam_x = self.dual_opt['x']
+        n = len(x)
+
+        # Constraint values, Jacobian and Lagrangian Hessian
+        nlp_fcn = self.solver_object.nlp()
+        nlp_fcn.setInput(x, casadi.NLP_SOLVER_X)
+        nlp_fcn.setInput(par_vals, casadi.NLP_SOLVER_P)
+        nlp_fcn.evaluate()
+        g = nlp_fcn.output(1).toArray().ravel()
+        J_fcn = self.solver_object.jacG()
+        J_fcn.setInput(x, casadi.NLP_SOLVER_X)
+        J_fcn.setInput(par_vals, casadi.NLP_SOLVER_P)
+        J_fcn.evaluate()
+        J = csr_matrix(J_fcn.output(0).toCsc_matrix())
+        H_fcn = self.solver_object.hessLag()
+        H_fcn.setInput(x, casadi.NLP_SOLVER_X)
+        H_fcn.setInput(par_vals, casadi.NLP_SOLVER_P)
+        H_fcn.setInput(1., 2)
+        H_fcn.setInput(lam_g, 3)
+        H_fcn.evaluate()
+        H = H_fcn.output(0).toCsc_matrix()
+
+        # Active constraints and bounds, with their target values
+        lbg = self._scale_residuals(self.gllb)
+        ubg = self._scale_residuals(self.glub)
+        lower = (g <= lbg + active_tol) | (lam_g < -active_tol)
+        upper = ((g >= ubg - active_tol) | (lam_g > active_tol)) & ~lower
+        rows = N.flatnonzero((lbg == ubg) | lower | upper)
+        g_target = N.where(lower | (lbg == ubg), lbg, ubg)[rows]
+        lbx = N.array(self.get_xx_lb(), dtype=float).reshape(-1)
+        ubx = N.array(self.get_xx_ub(), dtype=float).reshape(-1)
+        lower = (x <= lbx + active_tol) | (lam_x < -active_tol)
+        upper = ((x >= ubx - active_tol) | (lam_x > active_tol)) & ~lower
+        fixed = N.flatnonzero(lower | upper)
+        x_target = N.where(lower, lbx, ubx)[fixed]
+
+        # Factorize the KKT matrix of the equality constrained QP
+        E = csr_matrix((N.ones(len(fixed)), (N.arange(len(fixed)), fixed)),
+                       shape=(len(fixed), n))
+        A = scipy.sparse.vstack([J[rows, :], E])
+        KKT = scipy.sparse.bmat(
+            [[H + hessian_reg * scipy.sparse.identity(n), A.T],
+             [A, csr_matrix((A.shape[0], A.shape[0]))]], format='csc')
+        try:
+            lu = splu(KKT)
+        except RuntimeError:
+            raise CasadiCollocatorException(
+                "The KKT matrix of the SQP step is singular.")
+
+        self._sqp_data = {'x': x, 'rows': rows, 'g_target': g_target,
+                          'fixed': fixed, 'x_target': x_target, 'lu': lu,
+                          'lbx': lbx, 'ubx': ubx}
+
+    @_profiled('sqp_step')
+    def sqp_step(self):
+        """
+        Take one SQP step from the linearization made by prepare_sqp_step,
+        using the current parameter values. Only the objective gradient and
+        the constraint residuals are evaluated, and the step is computed from
+        the factorized KKT matrix. The step is projected on the variable
+        bounds.
+
+        The new primal and dual variables are stored as the solution, and
+        sqp_status is set to "SQP_Step_Computed", or to
+        "Invalid_SQP_Step" if the step is not finite, in which case the
+        solution is not changed.
+
+        Returns::
+
+            sol_time --
+                Duration (seconds) of the step.
+                Type: float
+        """
+        t0 = time.clock()
+        data = self._sqp_data
+        x = data['x']
+        par_vals = self._get_par_vals()
+        n = len(x)
+
+        nlp_fcn = self.solver_object.nlp()
+        nlp_fcn.setInput(x, casadi.NLP_SOLVER_X)
+        nlp_fcn.setInput(par_vals, casadi.NLP_SOLVER_P)
+        nlp_fcn.evaluate()
+        g = nlp_fcn.output(1).toArray().ravel()
+        grad_fcn = self.solver_object.gradF()
+        grad_fcn.setInput(x, casadi.NLP_SOLVER_X)
+        grad_fcn.setInput(par_vals, casadi.NLP_SOLVER_P)
+        grad_fcn.evaluate()
+        grad = grad_fcn.output(0).toArray().ravel()
+
+        residuals = N.hstack([g[data['rows']] - data['g_target'],
+                              x[data['fixed']] - data['x_target']])
+        sol = data['lu'].solve(N.hstack([-grad, -residuals]))
+        x_new = N.clip(x + sol[:n], data['lbx'], data['ubx'])
+        sol_time = time.clock() - t0
+
+        if not N.all(N.isfinite(sol)):
+            self.sqp_status = "Invalid_SQP_Step"
+            self.sqp_objective = N.nan
+            return sol_time
+        n_rows = len(data['rows'])
+        lam_g = N.zeros(len(g))
+        lam_g[data['rows']] = sol[n:n + n_rows]
+        lam_x = N.zeros(n)
+        lam_x[data['fixed']] = sol[n + n_rows:]
+        self.primal_opt = x_new
+        # The stored dual variables are unscaled, see solve_nlp
+        self.dual_opt = {'g': self._scale_residuals(lam_g), 'x': lam_x}
+        self.sqp_status = "SQP_Step_Computed"
+
+        nlp_fcn.setInput(x_new, casadi.NLP_SOLVER_X)
+        nlp_fcn.evaluate()
+        self.sqp_objective = nlp_fcn.output(0).getValue()
+        return sol_time
+
     def _calc_Lagrangian_Hessian(self):
         """
         Calculate the Hessian of the NLP Lagrangian.
@@ -688,6 +896,88 @@ def _create_trajectory_function(data):
         return TrajectoryLinearInterpolation(
             data[0], data[1].reshape([-1, 1]))
 
+def _interpolate_columns(abscissae, ordinates, t):
+    """
+    Linear interpolation of all columns of ordinates at the times t, with
+    constant extrapolation. Gives the same values as calling N.interp for each
+    column.
+
+    Parameters::
+
+        abscissae --
+            Nondecreasing array of length n.
+
+        ordinates --
+            Array of shape (n, m).
+
+        t --
+            The times to interpolate at.
+
+    Returns::
+
+        Array of shape (len(t), m).
+    """
+    abscissae = N.asarray(abscissae, dtype=float)
+    ordinates = N.asarray(ordinates, dtype=float)
+    t = N.asarray(t, dtype=float)
+    if len(abscissae) == 1:
+        return N.tile(ordinates[0], (len(t), 1))
+    j = N.searchsorted(abscissae, t, side='right') - 1
+    j = N.clip(j, 0, len(abscissae) - 2)
+    t_left = abscissae[j]
+    t_right = abscissae[j + 1]
+    dt = t_right - t_left
+    w = N.where(dt > 0, (t - t_left) / N.where(dt > 0, dt, 1.),
+                (t >= t_right).astype(float))
+    w = N.clip(w, 0., 1.)[:, N.newaxis]
+    return ordinates[j] + w * (ordinates[j + 1] - ordinates[j])
+
+def _estimate_condition_number(A):
+    """
+    Estimate the condition number of a sparse matrix without forming it as a
+    dense matrix. Small matrices are handled densely.
+
+    For square matrices, the 1-norm condition number is estimated using an LU
+    factorization. For rectangular matrices, the 2-norm condition number is
+    computed from the extreme eigenvalues of the smaller of A*A^T and A^T*A.
+
+    Parameters::
+
+        A --
+            The matrix, dense or sparse.
+
+    Returns::
+
+        The condition number estimate. inf if A is singular or rank
+        deficient and nan if the eigenvalue iterations do not converge.
+    """
+    A = csc_matrix(A)
+    (m, n) = A.shape
+    if max(m, n) <= 100:
+        return N.linalg.cond(A.toarray())
+    try:
+        if m == n:
+            lu = splu(A)
+            A_inv = LinearOperator((n, n), matvec=lu.solve,
+                                   rmatvec=lambda x: lu.solve(x, 'T'),
+                                   dtype=float)
+            return onenormest(A) * onenormest(A_inv)
+        if m < n:
+            B = csc_matrix(A * A.T)
+        else:
+            B = csc_matrix(A.T * A)
+        lam_max = eigsh(B, k=1, which='LM', return_eigenvectors=False)[0]
+        lam_min = eigsh(B, k=1, sigma=0, which='LM',
+                        return_eigenvectors=False)[0]
+    except ArpackNoConvergence:
+        return N.nan
+    except RuntimeError:
+        # Singular factorization
+        return N.inf
+    if lam_min <= 0:
+        return N.inf
+    return N.sqrt(lam_max / lam_min)
+
 class ExternalData(object):
 
     """
@@ -843,6 +1133,118 @@ class FreeElementLengthsData(object):
         self.Q = Q
         self.a = a
 
+class MeshRefinementData(object):
+
+    """
+    Data used to control adaptive mesh refinement.
+
+    After each solution, the collocation error of each element is estimated,
+    see LocalDAECollocator.get_element_errors. Elements with an estimated
+    error above the tolerance are split into elements of equal length, and
+    pairs of neighbouring elements with small estimated errors are merged.
+    The problem is then solved again on the new mesh, initialized with the
+    previous solution. This is repeated until the estimated errors of all
+    elements are below the tolerance.
+    """
+
+    def __init__(self, tol=1e-4, max_iter=5, max_split=4, merge_tol=1e-2,
+                 max_n_e=None):
+        """
+        Parameters::
+
+            tol --
+                Tolerance for the estimated error of each element, relative
+                to the magnitude of the states.
+
+                Type: float
+                Default: 1e-4
+
+            max_iter --
+                The maximum number of refinements of the mesh.
+
+                Type: int
+                Default: 5
+
+            max_split --
+                The maximum number of elements an element is split into in
+                each refinement.
+
+                Type: int
+                Default: 4
+
+            merge_tol --
+                Two neighbouring elements are merged if the estimated error
+                of the merged element is below merge_tol * tol.
+
+                Type: float
+                Default: 1e-2
+
+            max_n_e --
+                The maximum number of elements. The refinement stops if a new
+                mesh would have more elements. None means no limit.
+
+                Type: int or None
+                Default: None
+        """
+        self.tol = tol
+        self.max_iter = max_iter
+        self.max_split = max_split
+        self.merge_tol = merge_tol
+        self.max_n_e = max_n_e
+
+    def refine(self, h, errors, n_cp):
+        """
+        Compute a refined mesh.
+
+        Parameters::
+
+            h --
+                The normalized element lengths of the current mesh.
+
+                Type: ndarray with shape (n_e,)
+
+            errors --
+                The estimated errors of the elements of the current mesh.
+
+                Type: ndarray with shape (n_e,)
+
+            n_cp --
+                The number of collocation points in each element.
+
+                Type: int
+
+        Returns::
+
+            The normalized element lengths of the refined mesh, or None if
+            the errors are within the tolerance or the refined mesh would
+            have more than max_n_e elements.
+        """
+        if N.max(errors) <= self.tol:
+            return None
+
+        # The error of an element is proportional to h^order
+        order = n_cp + 1
+        new_h = []
+        i = 0
+        while i < len(h):
+            if errors[i] > self.tol:
+                n_split = N.ceil((errors[i] / self.tol) ** (1. / order))
+                n_split = int(max(2, min(self.max_split, n_split)))
+                new_h += n_split * [h[i] / n_split]
+                i += 1
+            elif (i + 1 < len(h) and errors[i + 1] <= self.tol and
+                  max(errors[i], errors[i + 1]) * 2 ** order <
+                  self.merge_tol * self.tol):
+                new_h.append(h[i] + h[i + 1])
+                i += 2
+            else:
+                new_h.append(h[i])
+                i += 1
+
+        if self.max_n_e is not None and len(new_h) > self.max_n_e:
+            return None
+        return N.array(new_h) / N.sum(new_h)
+
 class BlockingFactors(object):
 
     """
@@ -930,6 +1332,7 @@ class LocalDAECollocator(CasadiCollocator):
         self.__dict__.update(options)
         self.options = options # save the options for the result object
         self.times = {}
+        self.profile = OrderedDict()
         t0_init = time.clock()
 
         # Store OptimizationProblem object
@@ -977,6 +1380,9 @@ class LocalDAECollocator(CasadiCollocator):
             raise CasadiCollocatorException("Unknown discretization scheme %s."
                                             % self.discr)
         self.warm_start = False
+        self._result_info = {}
+        self._export_thread = None
+        self._export_error = None
         # Get to work
         self._create_nlp()
 
@@ -995,20 +1401,39 @@ class LocalDAECollocator(CasadiCollocator):
         t0 = time.clock()
         # todo: account for preprocessing time within solve_nlp separately?
         self.times['sol'] = self.solve_nlp()
-        self.result_file_name = self.export_result_dymola(self.result_file_name)
+        self.result_file_name = self.export_result_dymola(
+            self.result_file_name, format=self.result_file_format)
         self.times['post_processing'] = time.clock() - t0 - self.times['sol'] - self.extra_update
 
-    def get_result_object(self, include_init = True):
+    def get_result_object(self, include_init = True, result_data = None):
         """ 
         Load result data saved in e.g. solve_and_write_result and create a LocalDAECollocationAlgResult object.
 
+        Parameters::
+
+            include_init --
+                Whether to include the initialization time in the total time.
+                Default: True
+
+            result_data --
+                Result data to use instead of loading the result file, e.g. 
+                as returned by get_result_data.
+                Default: None
+
         Returns::
 
             The LocalDAECollocationAlgResult object.
         """
         t0 = time.clock()
-        resultfile = self.result_file_name
-        res = ResultDymolaTextual(resultfile)
+        if result_data is not None:
+            resultfile = None
+            res = result_data
+        else:
+            resultfile = self.result_file_name
+            if self.result_file_format == 'mat':
+                res = ResultDymolaBinary(resultfile)
+            else:
+                res = ResultDymolaTextual(resultfile)
 
         # Get optimized element lengths
         h_opt = self.get_h_opt()
@@ -1022,7 +1447,39 @@ class LocalDAECollocator(CasadiCollocator):
         # Create and return result object
         return LocalDAECollocationAlgResult(self.op, resultfile, self,
                                             res, self.options, self.times,
-                                            h_opt)
+                                            h_opt, self.get_profile())
+
+    def get_profile(self):
+        """
+        Get a report of the time and memory spent in the different phases of
+        creating, solving and post-processing the NLP.
+
+        Returns::
+
+            A dictionary with the keys 'phases' and 'nlp_solver'.
+
+            profile['phases'] is an OrderedDict with the phases in the order
+            they were first run, e.g. 'create_model_variable_structures',
+            'create_nlp_variables', 'define_l0_functions', 'call_functions',
+            'create_constraints_and_cost', 'compute_bounds_and_init',
+            'create_solver', 'solve_nlp', 'get_result' and 'export_result'.
+            Each phase is a dictionary with the keys 'time' (CPU time in
+            seconds), 'calls' (number of runs, which are accumulated) and
+            'peak_memory' (the increase of the peak resident memory of the
+            process in bytes, or None if not available on this platform).
+            Phases can be nested, e.g. define_l0_functions and call_functions
+            are part of create_constraints_and_cost.
+
+            profile['nlp_solver'] is a dictionary with the timers ('t_...')
+            and counters ('n_...') of the last run of the NLP solver, e.g.
+            't_eval_h' for the time spent evaluating the Hessian.
+        """
+        stats = self.solver_object.getStats()
+        nlp_solver = dict([(k, v) for (k, v) in stats.items()
+                           if k.startswith('t_') or k.startswith('n_')])
+        with _profile_lock:
+            phases = copy.deepcopy(self.profile)
+        return {'phases': phases, 'nlp_solver': nlp_solver}
 
     def _create_nlp(self):
         """
@@ -1039,6 +1496,7 @@ class LocalDAECollocator(CasadiCollocator):
         self._assemble_back_tracking_info()
         self._create_solver()
 
+    @_profiled('create_model_variable_structures')
     def _create_model_variable_structures(self):
         """
         Create model variable structures.
@@ -1257,6 +1715,8 @@ class LocalDAECollocator(CasadiCollocator):
         self.mterm = mterm
         self.lterm = lterm
         self.mvar_vectors = mvar_vectors
+        self._mvar_names = dict((vt, [var.getName() for var in mvar_vectors[vt]])
+                                for vt in mvar_vectors)
         self.n_var = n_var
         self.name_map = name_map
         self.elimination = elimination
@@ -1399,6 +1859,7 @@ class LocalDAECollocator(CasadiCollocator):
 
         return counter
 
+    @_profiled('create_nlp_variables')
     def _create_nlp_variables(self):
         """
         Create the NLP variables and store them in a nested dictionary.
@@ -2008,9 +2469,9 @@ class LocalDAECollocator(CasadiCollocator):
         """
         self.op.calculateValuesForDependentParameters()
         
-        pp_unvarying_vals = [self.op.get_attr(par, "_value")
-                             for par in self.mvar_vectors['p_fixed']]
-        pp_unvarying_vals = N.array(pp_unvarying_vals).reshape(-1)
+        pp_unvarying_vals = self.op.get_attr_array(
+                self.mvar_vectors['p_fixed'], "_value",
+                self._mvar_names['p_fixed'])
         self._par_vals[0:self.n_var['p_fixed']] = pp_unvarying_vals
         return pp_unvarying_vals
 
@@ -2359,55 +2820,129 @@ class LocalDAECollocator(CasadiCollocator):
 
     def _create_nominal_trajectories(self):
         """
-        Returns a dictionary that contains the trajectories. Must be called after time has 
-        been denormalized and self._denorm_t0_init etc have been set
+        Returns a dictionary that contains the nominal trajectories sampled at
+        the collocation points. Must be called after time has been
+        denormalized and self._denorm_t0_nom etc have been set
 
         Returns::
 
              nom_traj --
-                    dictionary with all trajectories
+                    dictionary with an array of shape
+                    (len(self._get_collocation_points()), self.n_var[vt]) for
+                    each variable type vt
                     Type dictionary
         """
-        # Create nominal trajectories
-        mvar_vectors = self.mvar_vectors
-        name_map = self.name_map
         nom_traj = {}
         if self.variable_scaling and self.nominal_traj is not None:
-            n = len(self.nominal_traj.get_data_matrix()[:, 0])
+            if self._normalize_min_time:
+                times = self._get_collocation_times(self._denorm_t0_nom,
+                                                    self._denorm_tf_nom)
+            else:
+                times = self._get_collocation_times()
             for vt in ["dx", 'x', 'unelim_u', 'w']:
-                nom_traj[vt] = {}
-                for var in mvar_vectors[vt]:
-                    data_matrix = N.empty([n, len(mvar_vectors[vt])])
-                    name = var.getName()
-                    (var_index, _) = name_map[name]
-                    try:
-                        data = self.nominal_traj.get_variable_data(name)
-                    except VariableNotFoundError:
-                        # It is possibly to treat missing variable trajectories
-                        # more efficiently, especially in the case of MX
-                        if self.options['verbosity'] >= 2:
-                            print("Warning: Could not find nominal trajectory " +
-                                  "for variable " + name + ". Using nominal " +
-                                  "attribute value instead.")
-                        self.nominal_traj_mode[name] = "attribute"
-                        abscissae = N.array([0])
-                        nom_val = self.op.get_attr(var, "nominal")
-                        constant_sf = N.abs(nom_val)
-                        ordinates = N.array([[constant_sf]])
-                    else:
-                        abscissae = N.asarray(data.t)
-                        ordinates = N.asarray(data.x)
-                        nonfinite_ind = N.nonzero(N.isfinite(ordinates) == 0.)[0]
-                        if len(nonfinite_ind) > 0:
-                            if self.options['verbosity'] >= 1:
-                                print("Warning: Nominal trajectory for variable " + name +
-                                      " contains nonfinite values. Using nominal attribute " +
-                                      "value for these instead.")
-                            ordinates[nonfinite_ind] = self.op.get_attr(var, "nominal")
-                        ordinates = ordinates.reshape([-1, 1])
-                    nom_traj[vt][var_index] = \
-                        TrajectoryLinearInterpolation(abscissae, ordinates)
+                (values, found) = self._sample_trajectories(
+                        self.nominal_traj, vt, times, "nominal")
+                for var in self.mvar_vectors[vt]:
+                    (var_index, _) = self.name_map[var.getName()]
+                    if not found[var_index]:
+                        self.nominal_traj_mode[var.getName()] = "attribute"
+                        values[:, var_index] = N.abs(values[:, var_index])
+                nom_traj[vt] = values
         return nom_traj
+
+    def _get_collocation_points(self):
+        """
+        Returns a list of all collocation points (i, k), ordered by element.
+        """
+        return [(i, k) for i in xrange(1, self.n_e + 1)
+                for k in self.time_points[i]]
+
+    def _get_collocation_times(self, t0=None, tf=None):
+        """
+        Returns an array with the times of the collocation points given by
+        _get_collocation_points. For minimum time problems, the normalized
+        times are mapped to the interval [t0, tf] if given.
+        """
+        times = N.array([self.time_points[i][k]
+                         for (i, k) in self._get_collocation_points()])
+        if t0 is not None:
+            times = t0 + (tf - t0) * times
+        return times
+
+    def _sample_trajectories(self, traj, vt, times, attr):
+        """
+        Sample the trajectories of all variables of type vt in a result.
+
+        Variables with trajectories on the same time grid are interpolated
+        together. Variables that are missing in the result, and nonfinite
+        values, are given the value of the attribute attr instead.
+
+        Parameters::
+
+            traj --
+                The result data, as given by ResultDymolaTextual etc.
+
+            vt --
+                The variable type.
+
+            times --
+                The times to sample at.
+
+            attr --
+                The attribute that gives the fallback value, "initialGuess"
+                or "nominal".
+
+        Returns::
+
+            values --
+                Array of shape (len(times), self.n_var[vt]), with the columns
+                ordered by variable index.
+
+            found --
+                Boolean array that is False for the variables that were not
+                found in traj.
+        """
+        kind = {"initialGuess": "initial", "nominal": "nominal"}[attr]
+        n_var = self.n_var[vt]
+        values = N.empty([len(times), n_var])
+        found = N.ones(n_var, dtype=bool)
+        groups = []
+        for var in self.mvar_vectors[vt]:
+            name = var.getName()
+            (var_index, _) = self.name_map[name]
+            try:
+                data = traj.get_variable_data(name)
+            except VariableNotFoundError:
+                if self.options['verbosity'] >= 2:
+                    print("Warning: Could not find %s trajectory " % kind +
+                          "for variable " + name + ". Using %s " % attr +
+                          "attribute value instead.")
+                values[:, var_index] = self.op.get_attr(var, attr)
+                found[var_index] = False
+                continue
+            abscissae = N.asarray(data.t)
+            ordinates = N.array(data.x, dtype=float).reshape(-1)
+            nonfinite_ind = N.nonzero(N.isfinite(ordinates) == 0.)[0]
+            if len(nonfinite_ind) > 0:
+                if self.options['verbosity'] >= 1:
+                    print("Warning: %s trajectory for variable " % kind.capitalize() +
+                          name + " contains nonfinite values. Using %s " % attr +
+                          "attribute value for these instead.")
+                ordinates[nonfinite_ind] = self.op.get_attr(var, attr)
+            for (group_abscissae, indices, columns) in groups:
+                if (len(group_abscissae) == len(abscissae) and
+                    N.array_equal(group_abscissae, abscissae)):
+                    break
+            else:
+                (group_abscissae, indices, columns) = (abscissae, [], [])
+                groups.append((group_abscissae, indices, columns))
+            indices.append(var_index)
+            columns.append(ordinates)
+
+        for (abscissae, indices, columns) in groups:
+            values[:, indices] = _interpolate_columns(
+                    abscissae, N.column_stack(columns), times)
+        return (values, found)
         
     def _create_variable_scaling_struct(self):
         var_sf_map = {}
@@ -2491,6 +3026,7 @@ class LocalDAECollocator(CasadiCollocator):
 
             # Create storage for scaling factors
             time_points = self.get_time_points()
+            points = self._get_collocation_points()
             is_variant = {}
             n_variant_var = 0
             n_invariant_var = 0
@@ -2528,22 +3064,13 @@ class LocalDAECollocator(CasadiCollocator):
                                           "due to that the original scaling was %s. " %mode + 
                                           "Doing %s scaling instead." %mode)
                     
-                    values = {}
+                    values = None
                     traj_min = N.inf
                     traj_max = -N.inf
                     if mode not in ["attribute"]: #Compute min/max from nominal trajectories
-                        for i in xrange(1, self.n_e + 1):
-                            values[i] = {}
-                            for k in time_points[i]:
-                                tp = time_points[i][k]
-                                if self._normalize_min_time:
-                                    tp = t0_nom + (tf_nom - t0_nom) * tp
-                                val = float(nom_traj[vt][var_index].eval(tp))
-                                values[i][k] = val
-                                if val < traj_min:
-                                    traj_min = val
-                                if val > traj_max:
-                                    traj_max = val
+                        values = nom_traj[vt][:, var_index]
+                        traj_min = values.min()
+                        traj_max = values.max()
                     if mode in ["attribute", "linear", "affine"]:
                         variant = False
                     elif mode == "time-variant":
@@ -2579,9 +3106,8 @@ class LocalDAECollocator(CasadiCollocator):
                         is_variant[name] = True
                         name_idx_sf_map[name] = n_variant_var
                         n_variant_var += 1
-                        for i in xrange(1, self.n_e + 1):
-                            for k in time_points[i]:
-                                variant_sf[i][k].append(N.abs(values[i][k]))
+                        for ((i, k), val) in zip(points, N.abs(values)):
+                            variant_sf[i][k].append(val)
                     else:
                         is_variant[name] = False
                         if mode == "attribute":
@@ -2792,6 +3318,7 @@ class LocalDAECollocator(CasadiCollocator):
         self._sample_external_input_trajectory(vk, var_index, name, interpolator)
 
 
+    @_profiled('define_l0_functions')
     def _define_l0_functions(self):
         """
         Defines all functions required for the DOP transcription
@@ -3150,6 +3677,7 @@ class LocalDAECollocator(CasadiCollocator):
             
         
 
+    @_profiled('define_l1_functions')
     def _define_l1_functions(self):
         """
         Defines checkpointed functions.
@@ -3598,6 +4126,7 @@ class LocalDAECollocator(CasadiCollocator):
         self.coll_l1_sf = coll_l1_sf
         return coll_l1_sf
     
+    @_profiled('call_functions')
     def _call_functions(self):
         """
         Call common functions for level 1 and level 0
@@ -4289,6 +4818,7 @@ class LocalDAECollocator(CasadiCollocator):
         d, e = self._get_affine_scaling(name, i, k)        
         return d*val + e
 
+    @_profiled('create_constraints_and_cost')
     def _create_constraints_and_cost(self):
         """
         Create the constraints and cost function.
@@ -4446,37 +4976,20 @@ class LocalDAECollocator(CasadiCollocator):
         Create interpolated initial trajectories.
         """
         if self.init_traj is not None:
-            n = len(self.init_traj.get_data_matrix()[:, 0])
-            self.init_traj_interp = traj = {}
+            if self._normalize_min_time:
+                times = self._get_collocation_times(self._denorm_t0_init,
+                                                    self._denorm_tf_init)
+            else:
+                times = self._get_collocation_times()
+            self._init_point_index = dict(
+                    (point, j) for (j, point) in
+                    enumerate(self._get_collocation_points()))
 
+            # Initial values at all collocation points, by variable type
+            self.init_traj_values = {}
             for vt in ["dx", "x", "w", "unelim_u"]:
-                for var in self.mvar_vectors[vt]:
-                    data_matrix = N.empty([n, len(self.mvar_vectors[vt])])
-                    name = var.getName()
-                    try:
-                        data = self.init_traj.get_variable_data(name)
-                    except VariableNotFoundError:
-                        if self.options['verbosity'] >= 2:
-                            print("Warning: Could not find initial " +
-                                  "trajectory for variable " + name +
-                                  ". Using initialGuess attribute value " +
-                                  "instead.")
-                        ordinates = N.array([[
-                            self.op.get_attr(var, "initialGuess")]])
-                        abscissae = N.array([0])
-                    else:
-                        abscissae = N.asarray(data.t)
-                        ordinates = N.asarray(data.x)
-                        nonfinite_ind = N.nonzero(N.isfinite(ordinates) == 0.)[0]
-                        if len(nonfinite_ind) > 0:
-                            if self.options['verbosity'] >= 1:
-                                print("Warning: Initial trajectory for variable " + name +
-                                      " contains nonfinite values. Using initialGuess attribute " +
-                                      "value for these instead.")
-                            ordinates[nonfinite_ind] = self.op.get_attr(var, "initialGuess")
-                        ordinates = ordinates.reshape([-1, 1])
-                    traj[var] = TrajectoryLinearInterpolation(
-                        abscissae, ordinates)
+                (self.init_traj_values[vt], _) = self._sample_trajectories(
+                        self.init_traj, vt, times, "initialGuess")
 
     def _eval_initial(self, var, i, k):
         """
@@ -4487,12 +5000,11 @@ class LocalDAECollocator(CasadiCollocator):
         if self.init_traj is None:
             return self.op.get_attr(var, "initialGuess")
         else:
-            time = self.time_points[i][k]
-            if self._normalize_min_time:
-                time = (self._denorm_t0_init +
-                        (self._denorm_tf_init - self._denorm_t0_init) * time)
-            return self.init_traj_interp[var].eval(time)
+            (var_index, vt) = self.name_map[var.getName()]
+            return self.init_traj_values[vt][self._init_point_index[(i, k)],
+                                             var_index]
 
+    @_profiled('compute_bounds_and_init')
     def _compute_bounds_and_init(self):
         """
         Compute bounds and intial guesses for NLP variables.
@@ -4510,101 +5022,74 @@ class LocalDAECollocator(CasadiCollocator):
         time_points = self.time_points
 
         # Handle free parameters
-        p_max = N.empty(self.n_var["p_opt"])
-        p_min = copy.deepcopy(p_max)
-        p_init = copy.deepcopy(p_max)
-        for var in mvar_vectors["p_opt"]:
-            name = var.getName()
-            (var_index, _) = name_map[name]
-            
-            (sf, _ ) = self._get_affine_scaling(name, -1, -1)
-            
-            p_min[var_index] = op.get_attr(var, "min") / sf
-            p_max[var_index] = op.get_attr(var, "max") / sf
-
-            # Handle initial guess
-            var_init = op.get_attr(var, "initialGuess")
-            if self.init_traj is not None:
-                name = var.getName()
+        names = self._mvar_names["p_opt"]
+        sf = N.array([self._get_affine_scaling(name, -1, -1)[0]
+                      for name in names], dtype=float)
+        p_min = op.get_attr_array(mvar_vectors["p_opt"], "min", names) / sf
+        p_max = op.get_attr_array(mvar_vectors["p_opt"], "max", names) / sf
+
+        # Handle initial guess
+        p_init = op.get_attr_array(mvar_vectors["p_opt"], "initialGuess", names)
+        if self.init_traj is not None:
+            for (var_index, name) in enumerate(names):
                 if name == "startTime":
-                    var_init = self._denorm_t0_init
+                    p_init[var_index] = self._denorm_t0_init
                 elif name == "finalTime":
-                    var_init = self._denorm_tf_init
+                    p_init[var_index] = self._denorm_tf_init
                 else:
                     try: 
                         data = self.init_traj.get_variable_data(name) 
                     except VariableNotFoundError: 
                         pass
                     else: 
-                        var_init = data.x[0] 
-            p_init[var_index] = var_init / sf
+                        p_init[var_index] = data.x[0] 
+        p_init /= sf
         xx_lb[self.var_indices['p_opt']] = p_min
         xx_ub[self.var_indices['p_opt']] = p_max
         xx_init[self.var_indices['p_opt']] = p_init
 
-        # Manipulate initial trajectories
-        if self.init_traj is not None:
-            n = len(self.init_traj.get_data_matrix()[:, 0])
-            traj = {}
-
-            for vt in ["dx", "x", "w", "unelim_u"]:
-                traj[vt] = {}
-                for var in mvar_vectors[vt]:
-                    name = var.getName()
-                    (var_index, _) = name_map[name]
-                    if name == "startTime":
-                        abscissae = N.array([0])
-                        ordinates = N.array([[self._denorm_t0_init]])
-                    elif name == "finalTime":
-                        abscissae = N.array([0])
-                        ordinates = N.array([[self._denorm_tf_init]])
-                    else:
-                        try:
-                            data = self.init_traj.get_variable_data(name)
-                        except VariableNotFoundError:
-                            if self.options['verbosity'] >= 2:
-                                print("Warning: Could not find initial " +
-                                      "trajectory for variable " + name +
-                                      ". Using initialGuess attribute value " +
-                                      "instead.")
-                            ordinates = N.array([[
-                                op.get_attr(var, "initialGuess")]])
-                            abscissae = N.array([0])
-                        else:
-                            abscissae = N.asarray(data.t)
-                            ordinates = N.asarray(data.x).reshape([-1, 1])
-                        traj[vt][var_index] = TrajectoryLinearInterpolation(
-                            abscissae, ordinates)
-
         # Denormalize time for minimum time problems
         if self._normalize_min_time:
             t0 = self._denorm_t0_init
             tf = self._denorm_tf_init
 
-        # Set bounds and initial guesses
+        # Set bounds and initial guesses, for all collocation points at once
+        points = self._get_collocation_points()
         for vt in ['dx', 'x', 'w', 'unelim_u']:
-            for var in mvar_vectors[vt]:
-                name = var.getName()
-                v_min = op.get_attr(var, "min")
-                v_max = op.get_attr(var, "max")
-                (var_idx, _) = name_map[name]
-                
-                for i in xrange(1, self.n_e + 1):
-                    for k in self.time_points[i].keys():
-                        
-                        #Get scaling factors
-                        d, e = self._get_affine_scaling(name, i, k)
-                        
-                        #Scale bounds and init
-                        v_init = self._eval_initial(var, i, k)
-                        if self._normalize_min_time and vt == "dx":
-                            if N.isfinite([v_min, v_max]).any():
-                                return NotImplementedError('State derivative bounds are not supported for problems ' +
-                                                           'with free time horizons.')
-                            v_init *= (tf - t0)
-                        xx_lb[self.var_indices[vt][i][k][var_idx]] = (v_min - e) / d
-                        xx_ub[self.var_indices[vt][i][k][var_idx]] = (v_max - e) / d
-                        xx_init[self.var_indices[vt][i][k][var_idx]] = (v_init - e) / d
+            n_var = self.n_var[vt]
+            if n_var == 0:
+                continue
+            names = self._mvar_names[vt]
+            v_min = op.get_attr_array(mvar_vectors[vt], "min", names)
+            v_max = op.get_attr_array(mvar_vectors[vt], "max", names)
+            if self.init_traj is None:
+                v_init = op.get_attr_array(mvar_vectors[vt], "initialGuess",
+                                           names)
+            else:
+                v_init = self.init_traj_values[vt]
+
+            #Get scaling factors
+            d = N.ones([len(points), n_var])
+            e = N.zeros([len(points), n_var])
+            if self.variable_scaling:
+                for (var_idx, name) in enumerate(names):
+                    if self._using_variant_variable_scaling(name):
+                        d[:, var_idx] = [self._get_affine_scaling(name, i, k)[0]
+                                         for (i, k) in points]
+                    else:
+                        (d[:, var_idx], e[:, var_idx]) = \
+                                self._get_affine_scaling(name, -1, -1)
+
+            #Scale bounds and init
+            if self._normalize_min_time and vt == "dx":
+                if N.isfinite(N.hstack([v_min, v_max])).any():
+                    raise NotImplementedError('State derivative bounds are not supported for problems ' +
+                                               'with free time horizons.')
+                v_init = v_init * (tf - t0)
+            inds = N.array([self.var_indices[vt][i][k] for (i, k) in points])
+            xx_lb[inds] = (v_min - e) / d
+            xx_ub[inds] = (v_max - e) / d
+            xx_init[inds] = (v_init - e) / d
 
         # Set bounds and initial guesses for continuity variables
         if not self.eliminate_cont_var:
@@ -4704,6 +5189,7 @@ class LocalDAECollocator(CasadiCollocator):
             self.xx_sources['i'][v_inds] = dest['i']
             self.xx_sources['k'][v_inds] = dest['k']
 
+    @_profiled('create_solver')
     def _create_solver(self):
         # Concatenate constraints
         constraints = casadi.vertcat([self.c_e, self.c_i])
@@ -4781,6 +5267,7 @@ class LocalDAECollocator(CasadiCollocator):
         else:
             return self.var_map['elim_u'][i][k]['all']
 
+    @_profiled('get_result')
     def get_result(self):
         # Set model info
         n_var = self.n_var
@@ -5154,8 +5641,92 @@ class LocalDAECollocator(CasadiCollocator):
         else:
             return None
 
+    def _get_unscaled_values(self, var_type, i, k):
+        """
+        Get the unscaled optimal values of all variables of a type at a
+        collocation point (i, k).
+        """
+        indices = self.var_indices[var_type][i][k]
+        values = N.array(self.primal_opt[indices], dtype=float).reshape(-1)
+        if self.variable_scaling:
+            for var in self.mvar_vectors[var_type]:
+                name = var.getName()
+                (ind, _) = self.name_map[name]
+                (d, e) = self._get_affine_scaling(name, i, k)
+                values[ind] = d * values[ind] + e
+        return values
+
+    def get_element_errors(self):
+        """
+        Estimate the collocation error of each element of the last solution.
+
+        The state derivatives are polynomials of degree n_cp - 1 in each
+        element, so their leading coefficients give the n_cp:th derivatives
+        of the states, which are constant in each element. The (n_cp + 1):th
+        derivatives are estimated by differences of these between
+        neighbouring elements, and the error of element i is estimated as
+
+            h_i^(n_cp + 1) * |x^(n_cp + 1)| / max(max|x|, 1),
+
+        where h_i is the element length and max|x| is the largest magnitude
+        of the state over the horizon. The largest estimate among the states
+        is used.
+
+        Returns::
+
+            errors --
+                The estimated errors of the elements.
+
+                Type: ndarray with shape (n_e,)
+        """
+        if self.hs == "free":
+            raise CasadiCollocatorException(
+                "Element errors can not be estimated for free element " +
+                "lengths.")
+        if self.eliminate_der_var:
+            raise CasadiCollocatorException(
+                "Element errors can not be estimated when the state " +
+                "derivatives are eliminated.")
+        n_x = self.n_var['x']
+        if n_x == 0:
+            return N.zeros(self.n_e)
+        n_cp = self.n_cp
+        h = self.horizon * N.array(self.h[1:], dtype=float)
+        tau = N.array(self.pol.p[1:n_cp + 1], dtype=float)
+
+        # n_cp:th derivatives of the states in each element
+        der = N.empty([self.n_e, n_x])
+        x_max = N.zeros(n_x)
+        for i in xrange(1, self.n_e + 1):
+            dx = N.array([self._get_unscaled_values('dx', i, k)
+                          for k in xrange(1, n_cp + 1)])
+            x = N.array([self._get_unscaled_values('x', i, k)
+                         for k in xrange(1, n_cp + 1)])
+            x_max = N.maximum(x_max, N.max(N.abs(x), axis=0))
+            coeffs = N.polyfit(tau, dx, n_cp - 1)[0]
+            der[i - 1, :] = (math.factorial(n_cp - 1) * coeffs /
+                             h[i - 1] ** (n_cp - 1))
+
+        # (n_cp + 1):th derivatives
+        if self.n_e == 1:
+            higher_der = N.abs(der) / h[:, N.newaxis]
+        else:
+            t_mid = self.element_times[1:self.n_e + 1] + h / 2.
+            diff = (N.abs(N.diff(der, axis=0)) /
+                    N.diff(t_mid)[:, N.newaxis])
+            higher_der = N.empty_like(der)
+            higher_der[0, :] = diff[0, :]
+            higher_der[-1, :] = diff[-1, :]
+            higher_der[1:-1, :] = N.maximum(diff[:-1, :], diff[1:, :])
+
+        errors = (h[:, N.newaxis] ** (n_cp + 1) * higher_der /
+                  N.maximum(x_max, 1.))
+        return N.max(errors, axis=1)
+
+    @_profiled('export_result')
     def export_result_dymola(self, file_name='', format='txt', 
-                             write_scaled_result=False, result=None):
+                             write_scaled_result=False, result=None,
+                             asynchronous=False):
         """
         Export an optimization or simulation result to file in Dymolas result file 
         format. The parameter values are read from the z vector of the model object 
@@ -5189,179 +5760,256 @@ class LocalDAECollocator(CasadiCollocator):
                 optimization/sample.
                 Default: None 
 
+            asynchronous --
+                If True, the file is written in a background thread and this
+                method returns as soon as the result has been collected. Call
+                wait_for_export to make sure that the file is complete.
+                Default: False
+
         Returns::
 
             used_file_name --
                 The actual file name used to write the result file.
                 Equals file_name unless file_name is empty.
-
-        Limitations::
-
-            Currently only textual format is supported.
         """
+        if format not in ('txt', 'mat'):
+            raise ValueError("Unknown result file format '%s', must be " \
+                             "either 'txt' or 'mat'." % format)
+
         if result is None:
-            (t,dx_opt,x_opt,u_opt,w_opt,p_fixed,p_opt, elim_vars) = self.get_result()
-            data = N.hstack((t,dx_opt,x_opt,u_opt,w_opt,elim_vars))
+            result = self.get_result()
+            include_eliminated = True
+        else:
+            include_eliminated = False
+        (t,dx_opt,x_opt,u_opt,w_opt,p_fixed,p_opt, elim_vars) = result
+        data = N.hstack((t,dx_opt,x_opt,u_opt,w_opt,elim_vars))
+
+        result_info = self._get_result_info(include_eliminated)
+        data_1 = self._get_result_parameter_values(p_opt, p_fixed)
+
+        if file_name == '':
+            file_name = self.op.getIdentifier() + '_result.' + format
+
+        # Files are written one at a time, in the order they were exported
+        self.wait_for_export()
+        if asynchronous:
+            self._export_thread = threading.Thread(
+                target=self._write_result_file_async,
+                args=(file_name, format, result_info, data_1, data))
+            self._export_thread.start()
         else:
-            (t,dx_opt,x_opt,u_opt,w_opt,p_fixed,p_opt, elim_vars) = result
-            data = N.hstack((t,dx_opt,x_opt,u_opt,w_opt,elim_vars))
+            self._write_result_file(file_name, format, result_info, data_1,
+                                    data)
 
-        if (format=='txt'):
-            op = self.op
-            name_map = self.name_map
-            mvar_vectors = self.mvar_vectors
-            variable_list = reduce(list.__add__,
-                                   [list(mvar_vectors[vt]) for
-                                    vt in ['p_opt', 'p_fixed',
-                                           'dx', 'x', 'u', 'w']])
-            if result is None:
-                for v in op.getEliminatedVariables():
-                    variable_list.append(v) 
-
-            # Map variable to aliases
-            alias_map = {}
-            for var in variable_list:
-                alias_map[var.getName()] = []
-            for alias_var in op.getAliases():
-                alias = alias_var.getModelVariable()
-                alias_map[alias.getName()].append(alias_var)
-
-            # Set up sections
-            # Put exactly one entry per variable in name_section etc
-            # - its length is used to determine num_vars
-            name_section = ['time\n']
-            description_section = ['Time in [s]\n']
-            data_info_section = ['0 1 0 -1 # time\n']
-
-            # Collect meta information
-            n_variant = 1
-            n_invariant = 1
-            max_name_length = len('Time')
-            max_desc_length = len('Time in [s]')
-            for var in variable_list:
-                # Name
-                name = var.getName()
-                name_section.append('%s\n' % name)
-                if len(name) > max_name_length:
-                    max_name_length = len(name)
+        return file_name
 
-                # Description
-                description = op.get_attr(var, "comment")
-                description_section.append('%s\n' % description)
-                if len(description) > max_desc_length:
-                    max_desc_length = len(description)
+    def wait_for_export(self):
+        """
+        Wait until the result file currently being written by 
+        export_result_dymola with asynchronous=True is complete.
 
-                # Data info
-                variability = var.getVariability()
-                if variability in [var.PARAMETER, var.CONSTANT]:
-                    n_invariant += 1
-                    data_info_section.append('1 %d 0 -1 # %s\n' %
-                                             (n_invariant, name))
-                else:
-                    n_variant += 1
-                    data_info_section.append('2 %d 0 -1 # %s\n' %
-                                             (n_variant, name))
-
-                # Handle alias variables
-                for alias_var in alias_map[var.getName()]:
-                    # Name
-                    name = alias_var.getName()
-                    name_section.append('%s\n' % name)
-                    if len(name) > max_name_length:
-                        max_name_length = len(name)
-
-                    # Description
-                    description = op.get_attr(alias_var, "comment")
-                    description_section.append('%s\n' % description)
-                    if len(description) > max_desc_length:
-                        max_desc_length = len(description)
-
-                    # Data info
-                    if alias_var.isNegated():
-                        neg = -1
-                    else:
-                        neg = 1
-                    if variability in [alias_var.PARAMETER, alias_var.CONSTANT]:
-                        data_info_section.append('1 %d 0 -1 # %s\n' %
-                                                 (neg*n_invariant, name))
-                    else:
-                        data_info_section.append('2 %d 0 -1 # %s\n' %
-                                                 (neg*n_variant, name))
+        Any exception raised while writing the file is raised here.
+        """
+        if self._export_thread is None:
+            return
+        self._export_thread.join()
+        self._export_thread = None
+        if self._export_error is not None:
+            (exc_type, exc_value, exc_tb) = self._export_error
+            self._export_error = None
+            raise exc_type, exc_value, exc_tb
 
-            # Collect parameter data (data_1)
-            data_1 = []
-            for par in mvar_vectors['p_opt']:
-                name = par.getName()
-                (ind, _) = name_map[name]
-                data_1.append(" %.14E" % p_opt[ind])
+    def get_result_data(self, result=None):
+        """
+        Get a result in the same form as it would be loaded from an exported
+        result file, without writing or reading any file.
 
-            for par_val in p_fixed:
-                data_1.append(" %.14E" % par_val)
+        Parameters::
 
-            # Open file
-            if file_name == '':
-                file_name = self.op.getIdentifier() + '_result.txt'
-            f = codecs.open(file_name, 'w', 'utf-8')
+            result --
+                A result as returned by get_result. If None, get_result is
+                called to get the result from the last optimization.
+                Default: None
 
-            # Write header
-            f.write('#1\n')
-            f.write('char Aclass(3,11)\n')
-            f.write('Atrajectory\n')
-            f.write('1.1\n')
-            f.write('\n')
+        Returns::
 
-            num_vars = len(name_section)
+            A ResultDymolaMemory object, which can be used as init_traj or to
+            create a LocalDAECollocationAlgResult.
+        """
+        if result is None:
+            result = self.get_result()
+        (t,dx_opt,x_opt,u_opt,w_opt,p_fixed,p_opt, elim_vars) = result
+        data = N.hstack((t,dx_opt,x_opt,u_opt,w_opt,elim_vars))
+        (name_section, description_section, data_info_section) = \
+                self._get_result_info(True)
+        data_1 = self._get_result_parameter_values(p_opt, p_fixed)
+        data_1 = N.array([[data[0,0]] + data_1, [data[-1,0]] + data_1])
+        return ResultDymolaMemory(name_section, description_section,
+                                  data_info_section, data_1, data)
 
-            # Write names
-            f.write('char name(%d,%d)\n' % (num_vars, max_name_length))
-            for name in name_section:
-                f.write(name)
-            f.write('\n')
+    def _get_result_info(self, include_eliminated):
+        """
+        Get the names, descriptions and data info (data set and column) of 
+        all variables in a result, including aliases.
 
-            # Write descriptions
-            f.write('char description(%d,%d)\n' % (num_vars, max_desc_length))
-            for description in description_section:
-                f.write(description)
-            f.write('\n')
+        The information only depends on the optimization problem and is hence 
+        only collected once.
+        """
+        if include_eliminated in self._result_info:
+            return self._result_info[include_eliminated]
 
-            # Write dataInfo
-            f.write('int dataInfo(%d,%d)\n' % (num_vars, 4))
-            for data_info in data_info_section:
-                f.write(data_info)
-            f.write('\n')
+        op = self.op
+        mvar_vectors = self.mvar_vectors
+        variable_list = reduce(list.__add__,
+                               [list(mvar_vectors[vt]) for
+                                vt in ['p_opt', 'p_fixed',
+                                       'dx', 'x', 'u', 'w']])
+        if include_eliminated:
+            for v in op.getEliminatedVariables():
+                variable_list.append(v) 
+
+        # Map variable to aliases
+        alias_map = {}
+        for var in variable_list:
+            alias_map[var.getName()] = []
+        for alias_var in op.getAliases():
+            alias = alias_var.getModelVariable()
+            alias_map[alias.getName()].append(alias_var)
+
+        # Set up sections
+        # Put exactly one entry per variable in name_section etc
+        # - its length is used to determine num_vars
+        name_section = ['time']
+        description_section = ['Time in [s]']
+        data_info_section = [(0, 1, 0, -1)]
+
+        # Collect meta information
+        n_variant = 1
+        n_invariant = 1
+        for var in variable_list:
+            name_section.append(var.getName())
+            description_section.append(op.get_attr(var, "comment"))
+
+            # Data info
+            variability = var.getVariability()
+            if variability in [var.PARAMETER, var.CONSTANT]:
+                n_invariant += 1
+                data_info_section.append((1, n_invariant, 0, -1))
+            else:
+                n_variant += 1
+                data_info_section.append((2, n_variant, 0, -1))
 
-            # Write data_1
-            n_parameters = (len(mvar_vectors['p_opt']) +
-                            len(mvar_vectors['p_fixed']))
-            f.write('float data_1(%d,%d)\n' % (2, n_parameters + 1))
-            par_val_str = ''
-            for par_val in data_1:
-                par_val_str += par_val
-            par_val_str += '\n'
-            f.write("%.14E" % data[0,0])
-            f.write(par_val_str)
-            f.write("%.14E" % data[-1,0])
-            f.write(par_val_str)
-            f.write('\n')
+            # Handle alias variables
+            for alias_var in alias_map[var.getName()]:
+                name_section.append(alias_var.getName())
+                description_section.append(
+                    op.get_attr(alias_var, "comment"))
 
-            # Write data_2
-            n_vars = len(data[0, :])
-            n_points = len(data[:, 0])
-            f.write('float data_2(%d,%d)\n' % (n_points, n_vars))
-            for i in range(n_points):
-                str_text = ''
-                for ref in range(n_vars):
-                    str_text = str_text + (" %.14E" % data[i, ref])
-                f.write(str_text + '\n')
+                # Data info
+                if alias_var.isNegated():
+                    neg = -1
+                else:
+                    neg = 1
+                if variability in [alias_var.PARAMETER, alias_var.CONSTANT]:
+                    data_info_section.append((1, neg*n_invariant, 0, -1))
+                else:
+                    data_info_section.append((2, neg*n_variant, 0, -1))
 
-            # Close file
-            f.write('\n')
-            f.close()
+        result_info = (name_section, description_section, data_info_section)
+        self._result_info[include_eliminated] = result_info
+        return result_info
 
-            return file_name
-        else:
-            raise NotImplementedError('Export on binary Dymola result files ' +
-                                      'not yet supported.')
+    def _get_result_parameter_values(self, p_opt, p_fixed):
+        """
+        Get the parameter values of a result (data_1), in the same order as 
+        the parameters in _get_result_info.
+        """
+        name_map = self.name_map
+        data_1 = []
+        for par in self.mvar_vectors['p_opt']:
+            (ind, _) = name_map[par.getName()]
+            data_1.append(p_opt[ind])
+        data_1.extend(p_fixed)
+        return data_1
+
+    def _write_result_file_async(self, *args):
+        """
+        Call _write_result_file and store any raised exception, so that it can
+        be raised by wait_for_export.
+        """
+        try:
+            self._write_result_file(*args)
+        except Exception:
+            self._export_error = sys.exc_info()
+
+    @_profiled('write_result_file')
+    def _write_result_file(self, file_name, format, result_info, data_1, data):
+        """
+        Write a result file, given the information collected by 
+        export_result_dymola.
+
+        Only numbers and strings are accessed, so that this method can be 
+        called from another thread.
+        """
+        (name_section, description_section, data_info_section) = result_info
+
+        if format == 'mat':
+            data_1 = N.vstack([[data[0,0]] + data_1, [data[-1,0]] + data_1])
+            write_result_binary(file_name, name_section, description_section,
+                                data_info_section, data_1, data)
+            return
+
+        # Open file
+        f = codecs.open(file_name, 'w', 'utf-8')
+
+        # Write header
+        f.write('#1\n')
+        f.write('char Aclass(3,11)\n')
+        f.write('Atrajectory\n')
+        f.write('1.1\n')
+        f.write('\n')
+
+        num_vars = len(name_section)
+
+        # Write names
+        max_name_length = max([len(name) for name in name_section])
+        f.write('char name(%d,%d)\n' % (num_vars, max_name_length))
+        f.write('\n'.join(name_section))
+        f.write('\n\n')
+
+        # Write descriptions
+        max_desc_length = max([len(description) for
+                               description in description_section])
+        f.write('char description(%d,%d)\n' % (num_vars, max_desc_length))
+        f.write('\n'.join(description_section))
+        f.write('\n\n')
+
+        # Write dataInfo
+        f.write('int dataInfo(%d,%d)\n' % (num_vars, 4))
+        for (data_info, name) in itertools.izip(data_info_section,
+                                                name_section):
+            f.write('%d %d %d %d # ' % data_info + name + '\n')
+        f.write('\n')
+
+        # Write data_1
+        f.write('float data_1(%d,%d)\n' % (2, len(data_1) + 1))
+        par_val_str = ''.join([" %.14E" % par_val for par_val in data_1])
+        par_val_str += '\n'
+        f.write("%.14E" % data[0,0])
+        f.write(par_val_str)
+        f.write("%.14E" % data[-1,0])
+        f.write(par_val_str)
+        f.write('\n')
+
+        # Write data_2
+        n_vars = len(data[0, :])
+        n_points = len(data[:, 0])
+        f.write('float data_2(%d,%d)\n' % (n_points, n_vars))
+        write_data_block(f, data)
+
+        # Close file
+        f.write('\n')
+        f.close()
 
     def get_opt_input(self):
         """
@@ -5542,6 +6190,11 @@ class LocalDAECollocator(CasadiCollocator):
             scaled_residuals --
                 If True, return the Jacobian for the equation scaled NLP.
 
+            dense --
+                If True, numerical values are returned as a dense ndarray,
+                otherwise as a scipy.sparse.csc_matrix.
+                Default: True
+
         Returns::
             
             matrix --
@@ -5565,7 +6218,7 @@ class LocalDAECollocator(CasadiCollocator):
         else: result = result.toCsc_matrix()
         return result
     
-    def get_H(self, point="fcn", scaled_residuals=False):
+    def get_H(self, point="fcn", scaled_residuals=False, dense=True):
         """
         Get the Hessian of the Lagrangian.
         
@@ -5589,6 +6242,11 @@ class LocalDAECollocator(CasadiCollocator):
             scaled_residuals --
                 If True, return the Hessian for the equation scaled NLP.
 
+            dense --
+                If True, numerical values are returned as a dense ndarray,
+                otherwise as a scipy.sparse.csc_matrix.
+                Default: True
+
         Returns::
             
             matrix --
@@ -5630,9 +6288,12 @@ class LocalDAECollocator(CasadiCollocator):
         else:
             raise ValueError("Unkonwn point value: " + repr(point))
         H_fcn.evaluate()
-        return H_fcn.output(0).toArray()
+        if dense:
+            return H_fcn.output(0).toArray()
+        else:
+            return H_fcn.output(0).toCsc_matrix()
 
-    def get_KKT(self, point="fcn", scaled_residuals=False):
+    def get_KKT(self, point="fcn", scaled_residuals=False, dense=True):
         """
         Get the KKT matrix.
 
@@ -5659,6 +6320,11 @@ class LocalDAECollocator(CasadiCollocator):
 
             scaled_residuals --
                 If True, return the KKT matrix for the equation scaled NLP.
+
+            dense --
+                If True, numerical values are returned as a dense ndarray,
+                otherwise as a scipy.sparse.csc_matrix.
+                Default: True
         
         Returns::
             
@@ -5675,7 +6341,7 @@ class LocalDAECollocator(CasadiCollocator):
             x = self.xx
             J = self.get_J("sym", scaled_residuals=scaled_residuals)
             [H, sigma, dual] = self.get_H("sym", scaled_residuals=scaled_residuals)
-            zeros = N.zeros([dual.numel(), dual.numel()])
+            zeros = casadi.MX(dual.numel(), dual.numel())
             KKT = casadi.blockcat([[H, J.T], [J, zeros]])
             if point == "sym":
                 return KKT
@@ -5691,11 +6357,11 @@ class LocalDAECollocator(CasadiCollocator):
             dual = self.get_opt_constraint_duals(scaled=scaled_residuals)
         else:
             raise ValueError("Unkonwn point value: " + repr(point))
-        sigma = self._compute_sigma(scaled_residuals=scaled_residuals)
-        J = self.get_J(point, scaled_residuals=scaled_residuals)
-        H = self.get_H(point, scaled_residuals=scaled_residuals)
-        zeros = N.zeros([len(dual), len(dual)])
-        KKT = N.bmat([[H, J.T], [J, zeros]])
+        J = self.get_J(point, scaled_residuals=scaled_residuals, dense=False)
+        H = self.get_H(point, scaled_residuals=scaled_residuals, dense=False)
+        KKT = scipy.sparse.bmat([[H, J.T], [J, None]], format='csc')
+        if dense:
+            KKT = KKT.toarray()
         return KKT
 
     def _compute_sigma(self, scaled_residuals=False):
@@ -5804,7 +6470,7 @@ class LocalDAECollocator(CasadiCollocator):
         
         return (inds, i, k)
 
-    def enable_codegen(self, name=None):
+    def enable_codegen(self, name=None, opt_level=3):
         """
         Enables use of generated C code for the collocator. Generates and
         compiles code for the NLP, gradient of f, Jacobian of g, and Hessian
@@ -5815,22 +6481,25 @@ class LocalDAECollocator(CasadiCollocator):
         Parameters::
         
             name --
-                A string that if it is not None, tries to load existing files
-                nlp_[name].so, grad_f_[name].so, jac_g_[name].so and
-                hess_lag_[name].so as ExternalFunction objects to be used
-                by the solver rather than generating new code. If any of the
-                files don't exist, new files are generated with the above
-                names.
+                A string used in the names of the generated files
+                nlp_[name], grad_f_[name], jac_g_[name] and hess_lag_[name].
+                Existing compiled files are reused if they were compiled
+                from identical code. If None, a hash of the generated code
+                is used instead of name.
                 Default: None
+
+            opt_level --
+                The gcc optimization level, e.g. 0, 2, 3 or 's'.
+                Default: 3
         """
-        enable_codegen(self, name)
+        enable_codegen(self, name, opt_level)
 
 
 def _add_help_fcns(filename):
     """
     Adds the functions \"sq\" and \"sign\" to a generated .c file if
     they don't already exist, since generateCode doesn't always generate
-    them. Help function to _to_external_function.
+    them. Help function to _generate_code.
     
     Parameters:
     
@@ -5859,49 +6528,187 @@ def _add_help_fcns(filename):
                     if add_sign:
                         outfile.write('\nd sign(d x) { return x<0 ? -1 : x>0 ? 1 : x;}\n')
 
-def _to_external_function(fcn, name, use_existing=False):
+def _get_library_extension():
+    if os.name == 'nt':
+        return '.dll'
+    else:
+        return '.so'
+
+def _hash_file(file_name):
+    """
+    Returns the SHA-1 hash of the contents of a file, or None if the file does
+    not exist.
+    """
+    try:
+        f = open(file_name, 'rb')
+    except IOError:
+        return None
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def _generate_code(fcn, file_name):
     """
     Generates C code for a Function object using its generateCode member
-    function, compiles the generated code, and returns it as an
-    ExternalFunction object. Help function to enable_codegen.
-    
+    function. Help function to _to_external_functions.
+
     Parameters::
-    
+
         fcn --
             The Function object for which to generate code.
-            
-        name --
-            A string containing the file name to be used for the
-            generated code, without file extension.
-            
-        use_existing --
-            A boolean that if it is set, doesn't generate new code and
-            just returns name.so (where name is the function parameter)
-            as an ExternalFunction object.
+
+        file_name --
+            The name of the .c file to generate, including file extension.
+
+    Returns::
+
+        The SHA-1 hash of the generated code.
+    """
+    fcn.generateCode(file_name)
+    _add_help_fcns(file_name)
+    return _hash_file(file_name)
+
+def _compile_sources(names, opt_level=3):
+    """
+    Compiles generated .c files to shared libraries, running one compiler
+    process per file concurrently. Help function to _to_external_functions.
+
+    Parameters::
+
+        names --
+            List of file names of the .c files, without file extension.
+
+        opt_level --
+            The gcc optimization level, e.g. 0, 2, 3 or 's'.
+            Default: 3
+
+    Returns::
+
+        List of booleans telling whether each compilation succeeded.
+    """
+    ext = _get_library_extension()
+    bitness_flag = '-m32' if struct.calcsize('P') == 4 else '-m64'
+    processes = []
+    for name in names:
+        print 'Compiling generated code for', name
+        try:
+            processes.append(Popen(['gcc', bitness_flag, '-fPIC', '-shared',
+                                    '-O%s' % opt_level, name + '.c',
+                                    '-o', name + ext]))
+        except OSError, e:
+            # gcc could not be started, e.g. because it is not installed
+            print 'Could not compile generated code for %s: %s' % (name, e)
+            processes.append(None)
+    return [process is not None and process.wait() == 0
+            for process in processes]
+
+def _to_external_functions(fcns, names, opt_level=3, hash_names=False):
+    """
+    Generates C code for Function objects, compiles the generated code
+    concurrently, and returns the compiled functions as ExternalFunction
+    objects. Help function to enable_codegen.
+
+    The generated code is kept next to the compiled libraries, and a library
+    is only recompiled if the newly generated code differs from the code that
+    it was compiled from.
+
+    Parameters::
+
+        fcns --
+            List of the Function objects for which to generate code.
+
+        names --
+            List of the file names to be used for the generated code,
+            without file extension.
+
+        opt_level --
+            The gcc optimization level, e.g. 0, 2, 3 or 's'.
+            Default: 3
+
+        hash_names --
+            If True, '_' followed by a hash of the generated code is appended
+            to each file name.
             Default: False
+
+    Returns::
+
+        List of ExternalFunction objects. Functions whose code could not be
+        compiled are returned uncompiled.
     """
-    if os.name == 'nt':
-        ext = '.dll'
-    else:
-        ext = '.so'
-    if not use_existing:
-        print 'Generating code for', name
-        fcn.generateCode(name + '.c')
-        _add_help_fcns(name + '.c')
-        bitness_flag = '-m32' if struct.calcsize('P') == 4 else '-m64'
-        exit_code = system('gcc ' + bitness_flag + ' -fPIC -shared -O3 ' + name + '.c -o ' + name + ext)
-        if exit_code != 0:
-            return fcn # fall back to uncompiled version
-    fcn_e = casadi.ExternalFunction('./' + name + ext)
-    return fcn_e
+    ext = _get_library_extension()
+    names = list(names)
+    to_compile = []
+    for (i, fcn) in enumerate(fcns):
+        # Generate the code to a temporary file to find out if the existing
+        # library is up to date
+        (fd, tmp_file) = tempfile.mkstemp(
+                suffix='.c', dir=path.dirname(path.abspath(names[i])))
+        os.close(fd)
+        code_hash = _generate_code(fcn, tmp_file)
+        if hash_names:
+            names[i] += '_' + code_hash[:16]
+        name = names[i]
+        if (_hash_file(name + '.c') == code_hash and
+            path.isfile(name + ext) and
+            path.getmtime(name + ext) >= path.getmtime(name + '.c')):
+            os.remove(tmp_file)
+        else:
+            if path.exists(name + '.c'):
+                os.remove(name + '.c')
+            os.rename(tmp_file, name + '.c')
+            to_compile.append(name)
+    compiled = dict(zip(to_compile, _compile_sources(to_compile, opt_level)))
+
+    ext_fcns = []
+    for (fcn, name) in zip(fcns, names):
+        if compiled.get(name, True):
+            ext_fcns.append(casadi.ExternalFunction(path.join('.', name + ext)))
+        else:
+            ext_fcns.append(fcn) # fall back to uncompiled version
+    return ext_fcns
+
+def _get_nlp_functions(solver):
+    """
+    Get the initialized NLP, gradient of f, Jacobian of g, and Hessian of the
+    Lagrangian of g Function objects of an initialized NlpSolver, in the order
+    of _NLP_FUNCTION_NAMES.
+    """
+    fcns = [solver.nlp(), solver.gradF(), solver.jacG(), solver.hessLag()]
+    for fcn in fcns:
+        fcn.init()
+    return fcns
+
+def _create_external_solver(old_solver, solver_name, fcns):
+    """
+    Create a new NlpSolver with the same options as old_solver that uses the
+    given NLP, gradient of f, Jacobian of g, and Hessian of the Lagrangian of
+    g Function objects, in the order of _NLP_FUNCTION_NAMES.
+    """
+    (nlp, grad_f, jac_g, hess_lag) = fcns
+    solver = casadi.NlpSolver(solver_name, nlp)
+
+    old_solver_options = old_solver.dictionary()
+    old_solver_options['expand'] = False
+    solver.setOption(old_solver_options)
+
+    solver.setOption('grad_f', grad_f)
+    solver.setOption('jac_g', jac_g)
+    solver.setOption('hess_lag', hess_lag)
+    return solver
     
-def enable_codegen(coll, name=None):
+def enable_codegen(coll, name=None, opt_level=3):
     """
     Enables use of generated C code for a collocator. Generates and compiles
     code for the NLP, gradient of f, Jacobian of g, and Hessian of the
     Lagrangian of g Function objects, and then replaces the solver
     object in the solver's collocator with a new one that makes use of
     the compiled functions as ExternalFunction objects.
+
+    The code is generated to the files nlp_[name].c, grad_f_[name].c,
+    jac_g_[name].c and hess_lag_[name].c and compiled concurrently. Existing
+    compiled files are reused if they were compiled from identical code and
+    are recompiled otherwise.
     
     Parameters::
     
@@ -5909,56 +6716,27 @@ def enable_codegen(coll, name=None):
             The LocalDAECollocator for which to enable use of generated code.
             
         name --
-            A string that if it is not None, tries to load existing files
-            nlp_[name].so, grad_f_[name].so, jac_g_[name].so and
-            hess_lag_[name].so as ExternalFunction objects to be used
-            by the solver rather than generating new code. If any of the
-            files don't exist, new files are generated with the above
-            names.
+            A string used in the names of the generated files. If None, a
+            hash of the generated code of each function is used instead, so
+            that identical functions share files.
             Default: None
+
+        opt_level --
+            The gcc optimization level, e.g. 0, 2, 3 or 's'. Lower levels
+            compile large functions much faster.
+            Default: 3
     """
-    if os.name == 'nt':
-        ext = '.dll'
-    else:
-        ext = '.so'
-    
     old_solver = coll.solver_object
     
-    nlp = old_solver.nlp()
-    nlp.init()
-    grad_f = old_solver.gradF()
-    grad_f.init()
-    jac_g = old_solver.jacG()
-    jac_g.init()
-    hess_lag = old_solver.hessLag()
-    hess_lag.init()
-    
-    existing = False
-    if name == None:
-        enable_codegen.times += 1
-        name = str(enable_codegen.times)
+    fcns = _get_nlp_functions(old_solver)
+    if name is None:
+        names = _NLP_FUNCTION_NAMES
     else:
-        if (path.isfile('nlp_'+name+ext) and
-            path.isfile('grad_f_'+name+ext) and
-            path.isfile('jac_g_'+name+ext) and
-            path.isfile('hess_lag_'+name+ext)):
-            existing = True
-    
-    nlp = _to_external_function(nlp, 'nlp_' + name, existing)
-    grad_f = _to_external_function(grad_f, 'grad_f_' + name, existing)
-    jac_g = _to_external_function(jac_g, 'jac_g_' + name, existing)
-    hess_lag = _to_external_function(hess_lag, 'hess_lag_' + name, existing)
-    
-    solver_cg = casadi.NlpSolver('ipopt', nlp)
-    
-    old_solver_options = old_solver.dictionary()
-    old_solver_options['expand'] = False
-    solver_cg.setOption(old_solver_options)
-    
-    solver_cg.setOption('grad_f', grad_f)
-    solver_cg.setOption('jac_g', jac_g)
-    solver_cg.setOption('hess_lag', hess_lag)
+        names = [fcn_name + '_' + name for fcn_name in _NLP_FUNCTION_NAMES]
+    fcns = _to_external_functions(fcns, names, opt_level,
+                                  hash_names=(name is None))
     
+    solver_cg = _create_external_solver(old_solver, 'ipopt', fcns)
     solver_cg.init()
     
     lbx = old_solver.getInput('lbx')
@@ -5976,8 +6754,9 @@ def enable_codegen(coll, name=None):
     solver_cg.setInput(p, 'p')
     
     coll.solver_object = solver_cg
-    
-enable_codegen.times = 0
+
+# File names of the compiled NLP functions
+_NLP_FUNCTION_NAMES = ['nlp', 'grad_f', 'jac_g', 'hess_lag']
 
 
 class MeasurementData(object):
@@ -5991,6 +6770,99 @@ class MeasurementData(object):
         raise DeprecationWarning('MeasurementData is obsolete. ' +
                                  'Use ExternalData instead.')
 
+class ResultDymolaMemory(object):
+
+    """
+    Result data kept in memory, with the same layout and lookup methods as 
+    the result data loaded from a Dymola result file.
+    """
+
+    def __init__(self, name, description, data_info, data_1, data_2):
+        """
+        Parameters::
+
+            name --
+                A list of variable names, starting with 'time'.
+
+            description --
+                A list of variable descriptions, in the same order as name.
+
+            data_info --
+                A list with one (data set, column, 0, -1) tuple per variable,
+                in the same order as name.
+
+            data_1 --
+                A two dimensional array with the start and final time in the
+                first column followed by the parameter values.
+
+            data_2 --
+                A two dimensional array with the time points in the first 
+                column followed by the trajectories.
+        """
+        self.name = name
+        self.description = description
+        self.dataInfo = N.array(data_info, dtype=int)
+        self.data = [N.asarray(data_1), N.asarray(data_2)]
+        self._name_index = dict((n, i) for (i, n) in enumerate(name))
+
+    def get_variable_index(self, name): 
+        """
+        Retrieve the index in the name vector of a given variable.
+        """
+        try:
+            return self._name_index[name]
+        except KeyError:
+            raise jmiVariableNotFoundError("Cannot find variable " +
+                                           name + " in data file.")
+
+    def get_variable_data(self, name):
+        """
+        Retrieve the data sequence for a variable with a given name.
+
+        Returns::
+
+            A Trajectory object containing the time vector and the data vector
+            of the variable.
+        """
+        if name == 'Time':
+            name = 'time'
+        var_ind = self.get_variable_index(name)
+        (data_mat, data_ind) = self.dataInfo[var_ind][:2]
+        if data_mat == 0:
+            # Time is stored in the first column of data_2
+            data_mat = 2
+        factor = -1 if data_ind < 0 else 1
+        data = self.data[data_mat - 1]
+        return Trajectory(data[:, 0], factor*data[:, abs(data_ind) - 1])
+
+    def is_variable(self, name):
+        """
+        Returns True if the given name corresponds to a time-varying variable.
+        """
+        return self.dataInfo[self.get_variable_index(name)][0] != 1
+
+    def is_negated(self, name):
+        """
+        Returns True if the given name corresponds to a negated result vector.
+        """
+        return self.dataInfo[self.get_variable_index(name)][1] < 0
+
+    def get_column(self, name):
+        """
+        Returns the column number in the data matrix where the values of the
+        variable are stored.
+        """
+        if not self.is_variable(name):
+            raise jmiVariableNotFoundError("Variable " + name + 
+                                           " is not a time-varying variable.")
+        return abs(self.dataInfo[self.get_variable_index(name)][1]) - 1
+
+    def get_data_matrix(self):
+        """
+        Returns the result matrix (data_2).
+        """
+        return self.data[1]
+
 class LocalDAECollocationAlgResult(JMResultBase):
     
     """
@@ -6017,6 +6889,13 @@ class LocalDAECollocationAlgResult(JMResultBase):
             times['tot'] is the sum of all the other times.
             
             Type: dict
+
+        profile --
+            A dictionary with the time and memory spent in the different
+            phases of the algorithm and the timers of the NLP solver, see
+            LocalDAECollocator.get_profile. Printed by print_profile.
+
+            Type: dict
         
         h_opt --
             An array with the normalized optimized element lengths.
@@ -6029,11 +6908,13 @@ class LocalDAECollocationAlgResult(JMResultBase):
     """
     
     def __init__(self, model=None, result_file_name=None, solver=None, 
-                 result_data=None, options=None, times=None, h_opt=None):
+                 result_data=None, options=None, times=None, h_opt=None,
+                 profile=None):
         super(LocalDAECollocationAlgResult, self).__init__(
                 model, result_file_name, solver, result_data, options)
         self.h_opt = h_opt
         self.times = times
+        self.profile = profile
         
         if solver is not None:
             # Save values from the solver since they might change in the solver.
@@ -6055,10 +6936,15 @@ class LocalDAECollocationAlgResult(JMResultBase):
 
         # Print condition numbers
         if options is not None and self.options['print_condition_numbers'] and self.options['verbosity'] >= 1:
-            J_init_cond = N.linalg.cond(solver.get_J("init"), scaled_residuals=self.op.equation_scaling)
-            J_opt_cond = N.linalg.cond(solver.get_J("opt"), scaled_residuals=self.op.equation_scaling)
-            KKT_init_cond = N.linalg.cond(solver.get_KKT("init"), scaled_residuals=self.op.equation_scaling)
-            KKT_opt_cond = N.linalg.cond(solver.get_KKT("opt"), scaled_residuals=self.op.equation_scaling)
+            scaled = solver.equation_scaling
+            J_init_cond = _estimate_condition_number(solver.get_J(
+                    "init", scaled_residuals=scaled, dense=False))
+            J_opt_cond = _estimate_condition_number(solver.get_J(
+                    "opt", scaled_residuals=scaled, dense=False))
+            KKT_init_cond = _estimate_condition_number(solver.get_KKT(
+                    "init", scaled_residuals=scaled, dense=False))
+            KKT_opt_cond = _estimate_condition_number(solver.get_KKT(
+                    "opt", scaled_residuals=scaled, dense=False))
             print("\nJacobian condition number at the initial guess: %.3g" %
                   J_init_cond)
             print("Jacobian condition number at the optimum: %.3g" %
@@ -6106,6 +6992,29 @@ class LocalDAECollocationAlgResult(JMResultBase):
         """
         return self.solver_statistics
 
+    def print_profile(self):
+        """
+        Print the time and memory spent in the different phases of the
+        algorithm and the timers of the NLP solver.
+        """
+        if self.profile is None:
+            raise RuntimeError("No profile is available for this result.")
+        print("%-35s %10s %6s %12s" % ("Phase", "Time [s]", "Calls",
+                                       "Memory [MB]"))
+        for (phase, entry) in self.profile['phases'].iteritems():
+            if entry['peak_memory'] is None:
+                memory = "-"
+            else:
+                memory = "%.1f" % (entry['peak_memory'] / 1024.**2)
+            print("%-35s %10.3f %6d %12s" % (phase, entry['time'],
+                                             entry['calls'], memory))
+        nlp_solver = self.profile['nlp_solver']
+        timers = sorted([k for k in nlp_solver.keys() if k.startswith('t_')])
+        if len(timers) > 0:
+            print("\nNLP solver")
+            for name in timers:
+                print("%-35s %10.3f" % (name, nlp_solver[name]))
+
     def get_solver(self):
         """
         Get the solver that was used to create this result.
@@ -6117,6 +7026,63 @@ class LocalDAECollocationAlgResult(JMResultBase):
         return self.solver.wrapper
 
 
+class ScenarioResult(object):
+
+    """
+    Compact result of one scenario solved by
+    OptimizationSolver.optimize_scenarios.
+
+    Attributes::
+
+        scenario --
+            The scenario, as given to optimize_scenarios.
+
+        return_status --
+            Return status from the nonlinear programming solver, or None if
+            the scenario failed.
+
+        nbr_iter --
+            Number of iterations.
+
+        objective --
+            Final value of the objective function.
+
+        sol_time --
+            Duration (seconds) of the call to the nonlinear programming
+            solver.
+
+        result_data --
+            A ResultDymolaMemory object with the trajectories, which can be
+            used as init_traj or to create a LocalDAECollocationAlgResult.
+            None if the scenario failed.
+
+        error --
+            None, or a description of the exception that made the scenario
+            fail.
+    """
+
+    def __init__(self, return_status=None, nbr_iter=None, objective=None,
+                 sol_time=None, result_data=None, error=None):
+        self.scenario = None
+        self.return_status = return_status
+        self.nbr_iter = nbr_iter
+        self.objective = objective
+        self.sol_time = sol_time
+        self.result_data = result_data
+        self.error = error
+
+# The OptimizationSolver used by the scenario worker processes, which inherit
+# it when they are forked
+_scenario_solver = None
+
+def _solve_scenario_chunk(args):
+    """
+    Solve a list of (index, scenario) in a worker process. Help function to
+    OptimizationSolver.optimize_scenarios.
+    """
+    (indexed_scenarios, warm_start) = args
+    return _scenario_solver._solve_scenarios(indexed_scenarios, warm_start)
+
 class OptimizationSolver(object):
     """
     Represents an initialized optimization problem that can be reoptimized with different settings.
@@ -6238,6 +7204,15 @@ class OptimizationSolver(object):
         
     def optimize(self):
         """Solve the optimization problem with the current settings, and return the result."""
+        self._prepare_optimize()
+        self.collocator.solve_and_write_result()
+       
+        return self.collocator.get_result_object(include_init=False)
+
+    def _prepare_optimize(self):
+        """
+        Update the collocator with the current settings before solving.
+        """
         t0 = time.clock()
         
         if self.init_traj_set or self.nominal_traj_updated:
@@ -6263,10 +7238,132 @@ class OptimizationSolver(object):
         # Add extra update times to update and reset
         self.collocator.times['update'] = time.clock() - t0 + self.extra_update # 'update' must be set before call to solve_and_write_result
         self.extra_update = 0
-        
-        self.collocator.solve_and_write_result()
-       
-        return self.collocator.get_result_object(include_init=False)
+
+    def optimize_scenarios(self, scenarios, processes=None, warm_start=True):
+        """
+        Solve the optimization problem for several scenarios with different
+        parameter values and external data, reusing the transcription.
+
+        The scenarios are split into one contiguous chunk per process. Within
+        a chunk, each scenario is warm started from the solution of the
+        previous one, so neighbouring scenarios should be similar. The worker
+        processes are forked from the current process. Where fork is not
+        available, or if processes is 1, the scenarios are solved in the
+        current process, and the parameter values and external data are
+        restored afterwards.
+
+        Parameters::
+
+            scenarios --
+                List of scenarios. Each scenario is a dictionary with the
+                optional keys 'parameters', a dictionary with parameter
+                values by name (see set), and 'external_data', a dictionary
+                with new external data by variable name (see
+                set_external_variable_data).
+
+            processes --
+                Number of worker processes. If None, the number of CPUs is
+                used.
+                Default: None
+
+            warm_start --
+                If True, warm start each scenario from the previous scenario
+                in the same chunk, if it was solved successfully.
+                Default: True
+
+        Returns::
+
+            A list with one ScenarioResult per scenario, in the same order as
+            scenarios.
+        """
+        global _scenario_solver
+        scenarios = list(scenarios)
+        n = len(scenarios)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = max(1, min(processes, n))
+        indexed_scenarios = list(enumerate(scenarios))
+
+        if processes == 1 or not hasattr(os, 'fork'):
+            # Save the parameter values and external data to restore them
+            par_names = set()
+            data_names = set()
+            for scenario in scenarios:
+                par_names.update(scenario.get('parameters', {}).keys())
+                data_names.update(scenario.get('external_data', {}).keys())
+            par_vals = dict([(name, self.get(name)) for name in par_names])
+            try:
+                results = self._solve_scenarios(indexed_scenarios, warm_start)
+            finally:
+                for (name, value) in par_vals.iteritems():
+                    self.set(name, value)
+                external_data = self.collocator.external_data
+                if external_data is None:
+                    data_names = []
+                for name in data_names:
+                    for source in (external_data.eliminated,
+                                   external_data.constr_quad_pen,
+                                   external_data.quad_pen):
+                        if name in source:
+                            self.set_external_variable_data(name,
+                                                            source[name])
+        else:
+            chunks = [(indexed_scenarios[i*n//processes:(i+1)*n//processes],
+                       warm_start) for i in xrange(processes)]
+            _scenario_solver = self
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = sum(pool.map(_solve_scenario_chunk, chunks), [])
+            finally:
+                pool.close()
+                pool.join()
+                _scenario_solver = None
+
+        scenario_results = [None] * n
+        for (index, result) in results:
+            result.scenario = scenarios[index]
+            scenario_results[index] = result
+        return scenario_results
+
+    def _solve_scenarios(self, indexed_scenarios, warm_start):
+        """
+        Solve a list of (index, scenario) in order, see optimize_scenarios.
+
+        Returns::
+
+            A list of (index, ScenarioResult).
+        """
+        collocator = self.collocator
+        old_warm_start = collocator.warm_start
+        warm = False
+        results = []
+        try:
+            for (index, scenario) in indexed_scenarios:
+                self.set_warm_start(warm)
+                try:
+                    for (name, value) in \
+                            scenario.get('parameters', {}).iteritems():
+                        self.set(name, value)
+                    for (name, data) in \
+                            scenario.get('external_data', {}).iteritems():
+                        self.set_external_variable_data(name, data)
+                    self._prepare_optimize()
+                    sol_time = collocator.solve_nlp()
+                    (return_status, nbr_iter, objective, _) = \
+                            collocator.get_solver_statistics()
+                    result = ScenarioResult(return_status, nbr_iter,
+                                            objective, sol_time,
+                                            collocator.get_result_data())
+                    warm = warm_start and return_status in [
+                            'Solve_Succeeded', 'Solved_To_Acceptable_Level']
+                except Exception, e:
+                    result = ScenarioResult(
+                            error="%s: %s" % (e.__class__.__name__, e))
+                    warm = False
+                results.append((index, result))
+        finally:
+            self.set_warm_start(old_warm_start)
+        return results
 
     def set_warm_start(self, warm_start):
         """
@@ -6949,9 +8046,10 @@ class OptimizationSolver(object):
                 'init' for the initial guess.
                 Default: 'opt'
         """
-        J = self.get_nlp_jacobian(point)
-        # J-J != 0 only at entries that are +-inf or nan
-        c_inds, xx_inds = N.nonzero(J-J)
+        J = self.get_nlp_jacobian(point).tocoo()
+        # Only the structural nonzeros can be nonfinite
+        nonfinite = ~N.isfinite(J.data)
+        c_inds, xx_inds = J.row[nonfinite], J.col[nonfinite]
         return self.get_model_jacobian_entries(c_inds, xx_inds)
 
     def print_jacobian_entries(self, entries):
@@ -6992,7 +8090,7 @@ class OptimizationSolver(object):
         print "---------------------------"
         self.print_jacobian_entries(self.find_nonfinite_jacobian_entries(point))
     
-    def enable_codegen(self, name):
+    def enable_codegen(self, name=None, opt_level=3):
         """
         Enables use of generated C code for the solver's collocator.
         Generates and compiles code for the NLP, gradient of f, Jacobian of g,
@@ -7003,12 +8101,15 @@ class OptimizationSolver(object):
         Parameters::
         
             name --
-                A string that if it is not None, tries to load existing files
-                nlp_[name].so, grad_f_[name].so, jac_g_[name].so and
-                hess_lag_[name].so as ExternalFunction objects to be used
-                by the solver rather than generating new code. If any of the
-                files don't exist, new files are generated with the above
-                names.
+                A string used in the names of the generated files
+                nlp_[name], grad_f_[name], jac_g_[name] and hess_lag_[name].
+                Existing compiled files are reused if they were compiled
+                from identical code. If None, a hash of the generated code
+                is used instead of name.
                 Default: None
+
+            opt_level --
+                The gcc optimization level, e.g. 0, 2, 3 or 's'.
+                Default: 3
         """
-        self.collocator.enable_codegen(name)
+        self.collocator.enable_codegen(name, opt_level)
@@ -32,7 +32,7 @@ import os
 import thread_feval as tf
 
 try:
-    from openopt import NLP
+    from openopt import NLP, GLP
 except ImportError:
     pass
     #print "Could not load OpenOpt package."
@@ -439,6 +439,11 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
     user provides the objective function (func) as a file name (of a file 
     containing the definition of the function) instead of a function.
     
+    The function evaluations can also be performed by a pool of persistent 
+    worker processes by providing a FevalPool (see thread_feval.py) as func. 
+    The function file is then only loaded once per worker, which avoids the 
+    process start-up and file I/O of each separate function evaluation.
+    
     NB: If the function is provided this way and an FMU is loaded inside the
         function, then the FMU file name must be preceded by "../" when
         using FMUModel(), like this: 
@@ -452,9 +457,10 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
     Parameters::
     
         func -- 
-            callable func(x) or string
+            callable func(x), string or FevalPool
             The objective function OR the name of a python file 
-            containing the definition of the objective function. In case 
+            containing the definition of the objective function OR a 
+            FevalPool evaluating the objective function. In case 
             of a file name, the objective function in the file must 
             have the same name as the file itself (without '.py').  
             
@@ -532,6 +538,8 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
             int
             The number of processor cores used. This is only needed if the 
             function evaluations should be performed in separate processes.
+            If func is a FevalPool, the number of workers in the pool is 
+            used by default.
             Default: None
             
         debug --
@@ -579,9 +587,14 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
             raise ValueError, 'xstart must be smaller than ub.'
     
     # Check that nbr of cores is provided if multithreading is to be used
-    if type(func).__name__ != 'function':
+    if isinstance(func, tf.FevalPool):
+        if nbr_cores is None:
+            nbr_cores = func.nbr_cores
+        feval = func.feval
+    elif type(func).__name__ != 'function':
         if nbr_cores is None:
             raise ValueError, 'The number of processor cores used must be provided.'
+        feval = lambda x: tf.feval(func,x,debug)
     
     # Convert xstart to float type array and flatten it so that 
     # len(xstart) can be used even if xstart is a scalar
@@ -635,7 +648,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
                 for j in range(l):
                     points.append(N.array([x_grid[i,j],y_grid[i,j]]))
             # Evaluate function in these points     
-            f_values = tf.feval(func,points,debug)
+            f_values = feval(points)
             for i in range(l):
                 z[i] = f_values[i*l:(i+1)*l]
     
@@ -704,7 +717,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
                 f_val[i] = func(X[i])
                 nbr_fevals += 1
         else:
-            f_val = tf.feval(func,X,debug)
+            f_val = feval(X)
             nbr_fevals += (n+1)
         
         # Order all vertices s.t f(x0) <= f(x1) <= ... <= f(xn)
@@ -801,7 +814,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
         else:
             if nbr_cores >= 4:
                 x_values = N.vstack([xr,xe,xc1,xc2])
-                f_values = tf.feval(func,x_values,debug)
+                f_values = feval(x_values)
                 fr = f_values[0]
                 fe = f_values[1]
                 fc1 = f_values[2]
@@ -809,21 +822,21 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
                 nbr_fevals += 4
             elif nbr_cores == 3:
                 x_values = N.vstack([xr,xe,xc1])
-                f_values = tf.feval(func,x_values,debug)
+                f_values = feval(x_values)
                 fr = f_values[0]
                 fe = f_values[1]
                 fc1 = f_values[2]
                 nbr_fevals += 3
             elif nbr_cores == 2:
                 x_values = N.vstack([xr,xe])
-                f_values = tf.feval(func,x_values,debug)
+                f_values = feval(x_values)
                 fr = f_values[0]
                 fe = f_values[1]
                 nbr_fevals += 2
             elif nbr_cores == 1:
                 # This is completely unnecessary but we must compute the
                 # function value in a separate process to avoid memory problems
-                fr = tf.feval(func,xr,debug)
+                fr = feval(xr)
                 nbr_fevals += 1
         
         # Reflection
@@ -837,7 +850,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
         elif fr < f_val[0]:
             if type(func).__name__ != 'function':
                 if nbr_cores == 1:
-                    fe = tf.feval(func,xe,debug)
+                    fe = feval(xe)
                     nbr_fevals += 1
             if fe < fr:
                 X[n] = xe
@@ -856,7 +869,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
             if fr < f_val[n]:
                 if type(func).__name__ != 'function':
                     if nbr_cores == 1 or nbr_cores == 2:
-                        fc1 = tf.feval(func,xc1,debug)
+                        fc1 = feval(xc1)
                         nbr_fevals += 1
                 if fc1 <= fr:
                     X[n] = xc1
@@ -867,7 +880,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
             else:
                 if type(func).__name__ != 'function':
                     if nbr_cores == 1 or nbr_cores == 2 or nbr_cores == 3:
-                        fc2 = tf.feval(func,xc2,debug)
+                        fc2 = feval(xc2)
                         nbr_fevals += 1
                 if fc2 < f_val[n]:
                     X[n] = xc2
@@ -884,7 +897,7 @@ def nelme(func,xstart,lb=None,ub=None,h=0.3,plot_con=False,plot_sim=False,
     if type(func).__name__ == 'function':
             f_opt = func(x_opt)
     else:
-        f_opt = tf.feval(func,x_opt,debug)
+        f_opt = feval(x_opt)
     nbr_fevals += 1
     
     # Number of iterations
@@ -1253,8 +1266,10 @@ def de(f,lb,ub,plot=False,x_tol=1e-6,f_tol=1e-6,max_iters=1000,
     Parameters::
     
         f -- 
-            callable f(x)
-            The objective function to be minimized.
+            callable f(x) or FevalPool
+            The objective function to be minimized. If a FevalPool is 
+            given, each function evaluation is performed by one of its 
+            persistent worker processes.
         
         lb -- 
             ndarray or scalar
@@ -1323,6 +1338,9 @@ def de(f,lb,ub,plot=False,x_tol=1e-6,f_tol=1e-6,max_iters=1000,
     if N.any(lb >= ub):
         raise ValueError, 'Lower bound must be smaller than upper bound.'
     
+    if isinstance(f, tf.FevalPool):
+        f = f.feval
+    
     if plot:
         plt.figure()
     
@@ -1371,8 +1389,10 @@ def galileo(f,lb,ub,plot=False,x_tol=1e-6,f_tol=1e-6,max_iters=1000,
     Parameters::
     
         f -- 
-            callable f(x)
-            The objective function to be minimized.
+            callable f(x) or FevalPool
+            The objective function to be minimized. If a FevalPool is 
+            given, each function evaluation is performed by one of its 
+            persistent worker processes.
         
         lb -- 
             ndarray or scalar
@@ -1441,6 +1461,9 @@ def galileo(f,lb,ub,plot=False,x_tol=1e-6,f_tol=1e-6,max_iters=1000,
     if N.any(lb >= ub):
         raise ValueError, 'Lower bound must be smaller than upper bound.'
     
+    if isinstance(f, tf.FevalPool):
+        f = f.feval
+    
     if plot:
         plt.figure()
     
@@ -1506,6 +1529,12 @@ def fmin(func,xstart=None,lb=None,ub=None,alg=None,plot=False,plot_conv=False,
     function (func) as a file name (of a file containing the definition 
     of the function) instead of a function.
     
+    For all methods except the sequential barrier function method, the 
+    function evaluations can instead be performed by a pool of persistent 
+    worker processes by providing a FevalPool (see thread_feval.py) as 
+    func. The function file is then only loaded once per worker and, for 
+    the Nelder-Mead method, the points are evaluated in parallel batches.
+    
     NB: If the function is provided this way and an FMU is loaded inside the
         function, then the FMU file name must be preceded by "../" when
         using FMUModel(), like this: 
@@ -1519,12 +1548,15 @@ def fmin(func,xstart=None,lb=None,ub=None,alg=None,plot=False,plot_conv=False,
     Parameters::
     
         func --
-            callable func(x) or string
+            callable func(x), string or FevalPool
             The objective function OR the name of a python file 
-            containing the definition of the objective function. In case 
+            containing the definition of the objective function OR a 
+            FevalPool evaluating the objective function. In case 
             of a file name, the objective function in the file must 
             have the same name as the file itself (without ".py") and this
-            feature is only available when using the Nelder-Mead method.
+            feature is only available when using the Nelder-Mead method. 
+            A FevalPool can not be used with the sequential barrier 
+            function method.
         
         xstart --
             ndarray or scalar
@@ -1671,7 +1703,10 @@ def fmin(func,xstart=None,lb=None,ub=None,alg=None,plot=False,plot_conv=False,
         if xstart is None:
             raise ValueError, 'Methods 1 and 2 require a starting point.'
     
-    if type(func).__name__ != 'function':
+    if isinstance(func, tf.FevalPool):
+        if alg == 2:
+            raise ValueError, 'Method 2 can not be used with a FevalPool.'
+    elif type(func).__name__ != 'function':
         if alg != 1:
             raise ValueError, 'If other than the Nelder-Mead method is chosen, func must be of function type.'
     
@@ -16,7 +16,7 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from pyjmi.optimization.casadi_collocation import ExternalData
 
-import time, types
+import os, time, types, shutil, tempfile, itertools, multiprocessing
 import numpy as np
 import casadi
 
@@ -30,6 +30,8 @@ import modelicacasadi_wrapper as mc
 from scipy.stats import chi2
 
 from pyjmi.common.io import VariableNotFoundError as jmiVariableNotFoundError
+from pyjmi.common.io import ResultDymolaTextual, ResultDymolaBinary
+from pyjmi.common.algorithm_drivers import JMResultBase
 from pyjmi import transfer_optimization_problem
 
 #Check to see if pyfmi is installed so that we also catch the error generated
@@ -46,6 +48,17 @@ except ImportError:
     VariableNotFoundError = (jmiVariableNotFoundError,
                              pymodelicaVariableNotFoundError)
 
+# The GreyBox used by the search worker processes, which inherit it when
+# they are forked
+_greybox = None
+
+def _identify_candidate(args):
+    """
+    Identify a (index, free_parameters, parent) in a worker process. Help 
+    function to GreyBox.search.
+    """
+    (candidate, result_dir) = args
+    return _greybox._identify_candidates([candidate], result_dir)[0]
 
 class GreyBox(object):
 
@@ -116,6 +129,9 @@ class GreyBox(object):
         self.prefix = "GreyBox_"
         self.free_parameters = set()
         
+        # Successful identifications by frozenset of free parameters
+        self._identifications = {}
+        
         # if non-constant sample period for measurements
         if hs:
             diffTimePoints = np.diff(time)
@@ -307,6 +323,11 @@ class GreyBox(object):
         Sets the parameters to be free in the optimization and solves the optimization problem.
         If the solver fails to converge the cost returned will be Inf.
         
+        Successful identifications are memoized by their set of free 
+        parameters. Identifying with the same free parameters again returns 
+        the stored Identification object, until the options or a variable 
+        attribute are changed with set_options or set_variable_attribute.
+        
         Parameters::
             free_parameters --
                 A set of parameters that are to be free in this optimization.
@@ -315,21 +336,459 @@ class GreyBox(object):
             identification --
                 An Identification object with results from this optimization.
         """
-        self._set_free_parameters(free_parameters)
-        # print currently free parameters
+        free_parameters = frozenset(free_parameters)
+        if free_parameters in self._identifications:
+            return self._identifications[free_parameters]
+        
+        # print free parameters
         print ('Identifying with free parameters:')
-        print self.free_parameters
-        res = self.op.optimize(options=self.options)
+        print set(free_parameters)
+        identification = self._solve(free_parameters)
+        if identification.cost < np.inf:
+            self._identifications[free_parameters] = identification
+        return identification
+        
+    def _solve(self, free_parameters, parent=None, result_file_name=None):
+        """
+        Solves the optimization problem with the specified free parameters.
+        
+        Parameters::
+            free_parameters --
+                The parameters to be free in this optimization.
+            parent --
+                An Identification object to warm start from. Its result is 
+                used as initial guess, and its dual variables are mapped to 
+                the new set of free parameters. If None, the options are 
+                used as they are.
+            result_file_name --
+                The name of the result file. If None, the name in the 
+                options is used.
+                
+        Returns::
+            identification --
+                An Identification object with results from this optimization.
+        """
+        self._set_free_parameters(set(free_parameters))
+        options = dict(self.options)
+        if result_file_name is not None:
+            options['result_file_name'] = result_file_name
         
         # optimize
+        if parent is None or parent.result is None:
+            res = self.op.optimize(options=options)
+        else:
+            options['init_traj'] = parent.result
+            solver = self.op.prepare_optimization(options=options)
+            init_dual = self._map_dual(parent, solver.collocator)
+            if init_dual is not None:
+                solver.collocator.init_dual = init_dual
+                solver.set_solver_option('IPOPT', 'warm_start_init_point',
+                                         'yes')
+            res = solver.optimize()
+        
         returnStatus = res.solver.get_solver_statistics()[0]
         if (returnStatus == 'Solve_Succeeded') or (returnStatus=='Solved_To_Acceptable_Level'):
             cost = res.solver.get_solver_statistics()[2]
         else:
-            cost = Inf
+            cost = np.inf
         
         # return identification object
-        return Identification(self, frozenset(self.free_parameters), res, cost)
+        return Identification(self, frozenset(self.free_parameters), res, cost,
+                              res.dual_opt, self._get_dual_layout(res.solver))
+        
+    def _get_dual_layout(self, collocator):
+        """
+        Returns the NLP layout needed to map the dual variables of a solution 
+        to another set of free parameters.
+        
+        Parameters::
+            collocator --
+                The collocator of the solution.
+        
+        Returns::
+            layout --
+                A tuple with the number of NLP variables, the number of NLP 
+                constraints and a dict with the NLP variable index of each 
+                free parameter.
+        """
+        p_opt = collocator.get_var_indices()['p_opt']
+        positions = {}
+        for par in collocator.mvar_vectors['p_opt']:
+            name = par.getName()
+            positions[name] = p_opt[collocator.name_map[name][0]]
+        return (len(collocator.get_xx_lb()), len(collocator.gllb), positions)
+        
+    def _map_dual(self, parent, collocator):
+        """
+        Maps the dual variables of the parent solution to the NLP of 
+        collocator, which differs from the parent NLP only in the free 
+        parameters. The free parameters form a contiguous block of NLP 
+        variables, which is preceded and followed by the same variables in 
+        both NLPs. Bound duals of newly released parameters are set to zero.
+        
+        Parameters::
+            parent --
+                The Identification object to take the dual variables from.
+            collocator --
+                The collocator to map the dual variables to.
+        
+        Returns::
+            init_dual --
+                A dict with the dual variables, see the init_dual option, or 
+                None if the NLPs do not match.
+        """
+        if parent.dual_opt is None or parent.dual_layout is None:
+            return None
+        (n_xx, n_g, positions) = parent.dual_layout
+        (child_n_xx, child_n_g, child_positions) = \
+            self._get_dual_layout(collocator)
+        if (n_g != child_n_g or 
+            n_xx - len(positions) != child_n_xx - len(child_positions)):
+            return None
+        
+        lam_x = np.array(parent.dual_opt['x']).reshape(-1)
+        if len(child_positions) > 0:
+            start = min(child_positions.values())
+        elif len(positions) > 0:
+            start = min(positions.values())
+        else:
+            start = 0
+        rest = np.delete(lam_x, positions.values())
+        child_lam_x = np.concatenate([rest[:start], 
+                                      np.zeros(len(child_positions)), 
+                                      rest[start:]])
+        for (name, index) in child_positions.iteritems():
+            if name in positions:
+                child_lam_x[index] = lam_x[positions[name]]
+        return {'g': np.array(parent.dual_opt['g']).reshape(-1), 
+                'x': child_lam_x}
+        
+    def _identify_candidates(self, candidates, result_dir=None):
+        """
+        Identifies a list of candidate structures in order. Failed 
+        optimizations give the cost Inf.
+        
+        Parameters::
+            candidates --
+                A list of (index, free_parameters, parent), where parent is 
+                the frozenset of free parameters of a memoized 
+                Identification to warm start from, or None.
+            result_dir --
+                If not None, the results are written to this directory and 
+                returned as picklable records, see _import_identification.
+        
+        Returns::
+            results --
+                A list of (index, identification) or (index, record).
+        """
+        results = []
+        for (index, free_parameters, parent) in candidates:
+            print ('Identifying with free parameters:')
+            print set(free_parameters)
+            if result_dir is None:
+                result_file_name = None
+            else:
+                result_file_name = os.path.join(result_dir, 
+                    'candidate_%d_result.%s' % 
+                    (index, self.options.get('result_file_format', 'txt')))
+            try:
+                identification = self._solve(
+                    free_parameters, self._identifications.get(parent),
+                    result_file_name)
+            except Exception, e:
+                print("Identification failed: %s: %s" % 
+                      (e.__class__.__name__, e))
+                identification = Identification(
+                    self, frozenset(free_parameters), None, np.inf)
+                result_file_name = None
+            if result_dir is None:
+                results.append((index, identification))
+            else:
+                results.append((index, (identification.free_parameters, 
+                                        identification.cost, result_file_name, 
+                                        identification.dual_opt, 
+                                        identification.dual_layout)))
+        return results
+        
+    def _import_identification(self, record):
+        """
+        Creates an Identification object from a record returned by a worker 
+        process, loading the result from the result file.
+        
+        Parameters::
+            record --
+                A tuple with the free parameters, the cost, the result file 
+                name, the dual variables and the dual layout.
+                
+        Returns::
+            identification --
+                The Identification object.
+        """
+        (free_parameters, cost, result_file_name, dual_opt, dual_layout) = record
+        result = None
+        if result_file_name is not None:
+            if result_file_name.endswith('.mat'):
+                result_data = ResultDymolaBinary(result_file_name)
+            else:
+                result_data = ResultDymolaTextual(result_file_name)
+            result = JMResultBase(result_file_name=result_file_name, 
+                                  result_data=result_data)
+        return Identification(self, free_parameters, result, cost, dual_opt, 
+                              dual_layout)
+        
+    def _identify_all(self, candidates, processes):
+        """
+        Identifies candidate structures concurrently and memoizes the 
+        successful identifications. Structures that are already memoized are 
+        not identified again. The worker processes are forked from the 
+        current process. Where fork is not available, or if processes is 1, 
+        the structures are identified in the current process.
+        
+        Parameters::
+            candidates --
+                A list of (free_parameters, parent), where parent is the 
+                frozenset of free parameters of a memoized Identification to 
+                warm start from, or None.
+            processes --
+                The number of worker processes.
+                
+        Returns::
+            identifications --
+                A list of Identification objects in the same order as 
+                candidates.
+        """
+        global _greybox
+        todo = [(index, free_parameters, parent) for 
+                (index, (free_parameters, parent)) in enumerate(candidates) 
+                if free_parameters not in self._identifications]
+        processes = max(1, min(processes, len(todo)))
+        
+        if len(todo) == 0:
+            results = []
+        elif processes == 1 or not hasattr(os, 'fork'):
+            results = self._identify_candidates(todo)
+        else:
+            result_dir = tempfile.mkdtemp(prefix='greybox_')
+            _greybox = self
+            pool = multiprocessing.Pool(processes)
+            try:
+                records = pool.map(_identify_candidate, 
+                                   [(candidate, result_dir) for 
+                                    candidate in todo], 1)
+                results = [(index, self._import_identification(record)) for 
+                           (index, record) in records]
+            finally:
+                pool.close()
+                pool.join()
+                _greybox = None
+                shutil.rmtree(result_dir, ignore_errors=True)
+        
+        identifications = dict(results)
+        for identification in identifications.itervalues():
+            if identification.cost < np.inf:
+                self._identifications[identification.free_parameters] = \
+                    identification
+        return [identifications[index] if index in identifications else 
+                self._identifications[free_parameters] for 
+                (index, (free_parameters, _)) in enumerate(candidates)]
+        
+    def _get_best_superset(self, free_parameters):
+        """
+        Returns the memoized Identification with the highest cost whose free 
+        parameters are a proper superset of free_parameters, or None. The 
+        cost of every superset is a lower bound on the cost with 
+        free_parameters, and the highest cost is the tightest bound. The 
+        bound assumes that the identifications reach their global optima, 
+        which the local NLP solves do not guarantee.
+        """
+        best = None
+        for (free, identification) in self._identifications.iteritems():
+            if free > free_parameters and (best is None or 
+                                           identification.cost > best.cost):
+                best = identification
+        return best
+        
+    def search(self, candidates, base=None, method='forward', risk=0.05, 
+               processes=None, max_free=None):
+        """
+        Searches for the set of free parameters that best explains the 
+        measurements, by releasing candidate parameters on top of a null 
+        model.
+        
+        The structures evaluated in each step of the search are identified 
+        concurrently, each warm started from the solution and dual variables 
+        of a parent structure. All identifications are memoized, see 
+        identify. Before a structure is identified, its cost reduction is 
+        bounded by the highest cost of the memoized structures with more 
+        free parameters, and the structure is pruned if the bound gives a 
+        risk that is not below the risk threshold. The bound assumes that 
+        the identifications reach their global optima; since the NLP solves 
+        are local, a structure may be pruned although a better local 
+        optimum would not have been.
+        
+        Parameters::
+            candidates --
+                The names of the parameters that may be released.
+            base --
+                The Identification object of the null model. If None, the 
+                null model is identified with the currently free parameters.
+                Default: None
+            method --
+                The search method:
+                -- 'forward':
+                Forward stepwise selection. In each step every remaining 
+                candidate is released on top of the current model, warm 
+                started from it. The release with the lowest risk is 
+                accepted if its risk is below the threshold, otherwise the 
+                search stops.
+                -- 'exhaustive':
+                All sets of at most max_free candidates are released on top 
+                of the null model and compared against it. The sets are 
+                evaluated from the largest to the smallest, each warm 
+                started from its memoized superset with the highest cost, so 
+                that the larger sets bound the smaller ones. The set with 
+                the lowest risk below the threshold is selected.
+                Default: 'forward'
+            risk --
+                The risk threshold for accepting a structure.
+                Default: 0.05
+            processes --
+                The number of worker processes. If None, the number of CPUs 
+                is used.
+                Default: None
+            max_free --
+                The maximum number of candidates to release. If None, all 
+                candidates may be released.
+                Default: None
+                
+        Returns::
+            best --
+                The Identification object of the selected structure, which 
+                is base if no structure has a risk below the threshold.
+            results --
+                A list of dicts, one per evaluated or pruned structure in 
+                search order, containing the free parameters, the 
+                identification (None if pruned), the cost, cost reduction 
+                and risk compared to the model it was released on. For 
+                pruned structures the cost is None and the cost reduction 
+                and risk are the bounds used for pruning.
+        """
+        if method not in ['forward', 'exhaustive']:
+            raise ValueError("Unknown search method %s." % method)
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if base is None:
+            base = self.identify(self.free_parameters)
+        if not base.cost < np.inf:
+            raise ValueError("The null model could not be identified.")
+        self._identifications.setdefault(base.free_parameters, base)
+        
+        remaining = [par for par in candidates 
+                     if par not in base.free_parameters]
+        if max_free is None:
+            max_free = len(remaining)
+        results = []
+        
+        if method == 'forward':
+            best = base
+            for step in xrange(min(max_free, len(remaining))):
+                step_results = self._search_step(
+                    best, [best.free_parameters.union([par]) for 
+                           par in remaining], 1, best, risk, processes)
+                results.extend(step_results)
+                evaluated = [res for res in step_results if not res['pruned']]
+                if len(evaluated) == 0:
+                    break
+                step_best = min(evaluated, key=lambda res: res['risk'])
+                if not step_best['risk'] < risk:
+                    break
+                best = step_best['identification']
+                remaining = [par for par in remaining 
+                             if par not in best.free_parameters]
+        else:
+            best = base
+            best_risk = risk
+            for dof in xrange(min(max_free, len(remaining)), 0, -1):
+                structures = [base.free_parameters.union(subset) for 
+                              subset in itertools.combinations(remaining, dof)]
+                step_results = self._search_step(base, structures, dof, None,
+                                                 best_risk, processes, 
+                                                 strict=False)
+                results.extend(step_results)
+                for res in step_results:
+                    # Ties are won by the smaller sets, evaluated later
+                    if (not res['pruned'] and res['risk'] < risk and
+                        res['risk'] <= best_risk):
+                        best = res['identification']
+                        best_risk = res['risk']
+        
+        return (best, results)
+        
+    def _search_step(self, null, structures, dof, parent, risk, processes, 
+                     strict=True):
+        """
+        Identifies a list of structures concurrently and compares them 
+        against a null model, pruning the structures that cannot reach a 
+        risk below the threshold. Help function to search.
+        
+        Parameters::
+            null --
+                The Identification object of the null model.
+            structures --
+                A list of frozensets of free parameters.
+            dof --
+                The number of additional free parameters in each structure.
+            parent --
+                The Identification object to warm start from. If None, each 
+                structure is warm started from its best memoized superset, 
+                or from the null model.
+            risk --
+                The risk threshold.
+            processes --
+                The number of worker processes.
+            strict --
+                If False, structures that can reach a risk equal to the 
+                threshold are not pruned.
+                Default: True
+        
+        Returns::
+            results --
+                A list of result dicts, see search.
+        """
+        cases = len(structures)
+        results = []
+        candidates = []
+        for free_parameters in structures:
+            superset = self._get_best_superset(free_parameters)
+            res = {'free_parameters': free_parameters, 'identification': None,
+                   'cost': None, 'costred': None, 'risk': None, 
+                   'pruned': False}
+            if superset is not None:
+                # Bound the cost reduction by the cost of the superset
+                costred = null.cost - superset.cost
+                min_risk = null.calculate_risk(costred, dof, cases)
+                if min_risk > risk or (strict and min_risk == risk):
+                    res.update({'costred': costred, 'risk': min_risk, 
+                                'pruned': True})
+            if not res['pruned']:
+                if parent is not None:
+                    warm_start = parent
+                elif superset is not None:
+                    warm_start = superset
+                else:
+                    warm_start = null
+                candidates.append((free_parameters, 
+                                   warm_start.free_parameters))
+            results.append(res)
+        
+        identifications = self._identify_all(candidates, processes)
+        evaluated = [res for res in results if not res['pruned']]
+        for (res, identification) in zip(evaluated, identifications):
+            costred = null.cost - identification.cost
+            res.update({'identification': identification, 
+                        'cost': identification.cost, 'costred': costred, 
+                        'risk': null.calculate_risk(costred, dof, cases)})
+        return results
         
     def _set_free_parameters(self, parameters):
         """
@@ -383,10 +842,11 @@ class GreyBox(object):
         The one exception is if costType = 'sum', then 'n_c' may be changed.
         """     
         if option in ['n_e', 'n_c', 'external_data']:
-            if not (option == 'n_c' and costType == 'sum'):
+            if not (option == 'n_c' and self.costType == 'sum'):
                 print('You are not allowed to change this option')
         else:
             self.options[option] = value
+            self._identifications.clear()
 
     def set_variable_attribute(self, name, attribute, value):
         """
@@ -402,6 +862,7 @@ class GreyBox(object):
         """ 
         var = self.op.getVariable(name)
         var.setAttribute(attribute,value)
+        self._identifications.clear()
         
     def extract_parameter_values(self, result, parameters):
         """
@@ -466,7 +927,8 @@ class Identification(object):
     optionization and the total cost.
     """
 
-    def __init__(self, greybox, free_parameters, result, cost):
+    def __init__(self, greybox, free_parameters, result, cost, dual_opt=None, 
+                 dual_layout=None):
         """
         Creates an Identification object containing results from a greybox identification optimization.
 
@@ -479,12 +941,20 @@ class Identification(object):
                 The result object from the optimization.
             cost --
                 The cost from this optimization.
+            dual_opt --
+                The dual variables of the solution, used to warm start 
+                optimizations with other free parameters.
+            dual_layout --
+                The NLP layout of the dual variables, see 
+                GreyBox._get_dual_layout.
 
         """
         self.greybox = greybox
         self.free_parameters = free_parameters
         self.result = result
         self.cost = cost
+        self.dual_opt = dual_opt
+        self.dual_layout = dual_layout
         
     def release(self, parameters):
         """
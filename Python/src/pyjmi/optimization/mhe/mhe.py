@@ -16,6 +16,7 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import numpy as N
 from collections import Iterable, OrderedDict
+import casadi
 from casadi import MX
 from pyjmi.optimization.casadi_collocation import ExternalData
 from pyjmi.common.algorithm_drivers import OptionBase
@@ -177,6 +178,12 @@ class MHE(object):
         self._opts["IPOPT_options"] = self.MHE_opts['IPOPT_options']
         ###Dirty flag indicating change of the parameters
         self._dirty = False
+        #The persistent OptimizationSolver, created the first time the 
+        #horizon is full if the persistent_nlp option is set
+        self._solver = None
+        #Whether the op depends explicitly on time, computed when needed
+        self._time_dependent = None
+        self._prev_res = None
             
          
     def _create_alias_dict(self, x_0_guess):
@@ -1068,12 +1075,107 @@ class MHE(object):
         external_data = self._create_external_data(t_interval, 
                                                    y_interval, 
                                                    u_interval)
-        self._opts['external_data'] = external_data
-        res = self.op.optimize(options = self._opts)
+        if self.MHE_opts['persistent_nlp'] and n_e == self.horizon and \
+           not self._depends_on_time():
+            res = self._solve_persistent(external_data, startTime)
+        else:
+            self._opts['external_data'] = external_data
+            res = self.op.optimize(options = self._opts)
+        self._prev_res = res
         x_est_dict = self._append_results(res)
         self.next_time_index += 1
         return x_est_dict
           
+    def _solve_persistent(self, external_data, start_time):
+        """
+        Solves the MHE problem using an OptimizationSolver that is 
+        created once, the first time the horizon is full, and then 
+        reused. Since the number of elements is constant from then on 
+        only the parameters, the external data, the time horizon and 
+        the initial guess need to be updated between the samples.
+        
+        Parameters::
+            external_data --
+                The ExternalData object used to eliminate inputs in 
+                the optimization.
+            
+            start_time --
+                The start time of the current horizon.
+        
+        Returns::
+            res --
+                A result object from the solved optimization problem.
+        """
+        if self._solver is None:
+            self._opts['external_data'] = external_data
+            self._opts['mutable_external_data'] = True
+            self._solver = self.op.prepare_optimization(options = self._opts)
+        else:
+            self._shift_nlp_time(start_time)
+            for (name, data) in external_data.eliminated.items():
+                self._solver.set_external_variable_data(name, data)
+            #Use the previous estimate as primal initial guess and the 
+            #previous duals through the warm start
+            self._solver.set_init_traj(self._prev_res)
+            self._solver.set_warm_start(True)
+        return self._solver.optimize()
+    
+    def _depends_on_time(self):
+        """
+        Checks if the DAE, the initial equations, the constraints or the 
+        objective of the op depend explicitly on time. The collocation 
+        time points of such a problem are constants in the transcribed 
+        NLP, so it can not be reused for a shifted horizon.
+        
+        Returns::
+            True if the op depends explicitly on time.
+        """
+        if self._time_dependent is None:
+            op = self.op
+            exprs = [op.getDaeResidual(), op.getInitialResidual(), 
+                     op.getObjective(), op.getObjectiveIntegrand()]
+            exprs += [constr.getResidual() for constr in 
+                      list(op.getPathConstraints()) + 
+                      list(op.getPointConstraints())]
+            self._time_dependent = casadi.dependsOn(
+                                    casadi.vertcat(exprs), 
+                                    [op.getTimeVariable()])
+        return self._time_dependent
+    
+    def _shift_nlp_time(self, start_time):
+        """
+        Moves the time points of the persistent collocator so that the 
+        horizon starts at start_time. The length of the horizon is 
+        unchanged. Only the numeric time points are moved, which is 
+        why the persistent NLP is only used for problems that do not 
+        depend explicitly on time, see _depends_on_time.
+        
+        Parameters::
+            start_time --
+                The new start time of the horizon.
+        """
+        collocator = self._solver.collocator
+        shift = start_time - collocator.t0
+        if shift == 0.:
+            return
+        collocator.t0 += shift
+        collocator.tf += shift
+        collocator.time = collocator.time + shift
+        collocator.element_times = collocator.element_times + shift
+        for points in collocator.time_points.values():
+            for k in points.keys():
+                points[k] += shift
+    
+    def _reset_persistent_solver(self):
+        """
+        Discards the persistent OptimizationSolver. Needs to be called 
+        whenever the symbolic problem formulation of the op changes, 
+        e.g. when the objective is redefined. The solver is recreated 
+        at the next sample.
+        """
+        self._solver = None
+        self._time_dependent = None
+    
     def _append_new_data(self, u, y):
         """
         Appends the input for the next sample to the arrays that 
@@ -1333,6 +1435,7 @@ class MHE(object):
                                                    '_MHE_Qinv')
         #Set the objective
         self._set_objectives()
+        self._reset_persistent_solver()
         #Change the matrix in the EKF_object
         self.EKF_object.update_process_noise_covariance_matrix(
                                                        process_noise_cov)
@@ -1370,6 +1473,7 @@ class MHE(object):
                                                    '_MHE_Rinv')
         #Set the objective
         self._set_objectives()
+        self._reset_persistent_solver()
         #Change the matrix in the EKF_object
         self.EKF_object.update_measurement_noise_covariance_matrix(
                                                             measurement_cov)
@@ -1516,13 +1620,26 @@ class MHEOptions(OptionBase):
             IPOPT options for solution of NLP. See IPOPT's 
             documentation for available options.
             Default: Empty dictionary.
+            
+        persistent_nlp --
+            True: Once the horizon is full, the NLP is transcribed once 
+            and then reused for all the following samples. Only the 
+            parameters, the measurements and inputs, the arrival cost 
+            weights and the initial guess are updated between samples. 
+            The previous solution is used to warm start the solver.
+            Problems that depend explicitly on time are always 
+            transcribed anew, since the collocation time points are 
+            constants in the transcribed NLP.
+            False: The NLP is transcribed anew at every sample.
+            Default: False
     """
     def __init__(self, *args, **kw):
         _defaults = {'input_names':[],
                      'process_noise_cov':[],
                      'measurement_cov':[],
                      'P0_cov':[],
-                     'IPOPT_options':{}}
+                     'IPOPT_options':{},
+                     'persistent_nlp':False}
         super(MHEOptions, self).__init__(_defaults)
         self.update(*args, **kw)
 
@@ -14,7 +14,6 @@
 #
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from pyjmi.common.io import ResultDymolaTextual
 from pyjmi.jmi_algorithm_drivers import MPCAlgResult, LocalDAECollocationAlg, LocalDAECollocationAlgOptions
 from pyjmi.optimization.casadi_collocation import BlockingFactors
 import time, types
@@ -38,17 +37,70 @@ except ImportError:
                              pymodelicaVariableNotFoundError)
 
 
+class _ResultColumns(object):
+
+    """
+    A two dimensional array with a fixed number of columns, to which rows 
+    are appended. The storage is preallocated and its capacity is doubled 
+    when it is full, so that appending is amortized constant time per row.
+    """
+
+    def __init__(self, n_columns, capacity=1024):
+        """
+        Parameters::
+
+            n_columns --
+                The number of columns.
+
+            capacity --
+                The number of rows to preallocate storage for.
+                Default: 1024
+        """
+        self._data = N.empty([capacity, n_columns])
+        self.n_rows = 0
+
+    def append(self, rows):
+        """
+        Appends rows to the array.
+
+        Parameters::
+
+            rows --
+                A two dimensional array with n_columns columns.
+        """
+        n_new = len(rows)
+        if self.n_rows + n_new > len(self._data):
+            capacity = max(2*len(self._data), self.n_rows + n_new)
+            data = N.empty([capacity, self._data.shape[1]])
+            data[:self.n_rows] = self._data[:self.n_rows]
+            self._data = data
+        self._data[self.n_rows:self.n_rows+n_new] = rows
+        self.n_rows += n_new
+
+    def get_array(self):
+        """
+        Returns the rows appended so far as a two dimensional array (a view, 
+        not a copy).
+        """
+        return self._data[:self.n_rows]
+
 class MPC(object):
 
     """
     Creates an MPC-object which allows a dynamic optimization problem to be 
     updated with estimates of the states (through measurements).  
+
+    By default, each sample solves the NLP to convergence. For the
+    real-time iteration scheme, call prepare() after each sample. The next
+    sample then only takes one SQP step from the linearization made by
+    prepare(), which keeps the time between update_state() and the returned
+    inputs short and predictable.
     """
 
     def __init__(self, op, options, sample_period, horizon, 
                  initial_guess='shift', create_comp_result=True,
                  constr_viol_costs={}, warm_start_options={},
-                 noise_seed=None):
+                 noise_seed=None, sample_result_output='memory'):
         """
         Creates the NLP that corresponds to the op we want to solve with MPC.
 
@@ -73,7 +125,8 @@ class MPC(object):
                 'shift': Use the shift method to shift the NLP result vector 
                 from the last successful optimization one collocation element.  
                 'trajectory': Extract xx_init from the result reajectories of
-                the last successful optimization.
+                the last successful optimization, which are kept in memory.
+                (See sample_result_output.)
                 optimization.
                 from a result file.
                 'prev': Use the NLP result vector from the last successful 
@@ -101,6 +154,16 @@ class MPC(object):
                 The seed to use for adding noise when using the method
                 extract_states().
                 Default: None
+
+            sample_result_output --
+                Specifies how the result of each optimization is handed over
+                to the initial guess (initial_guess='trajectory') and to
+                get_results_this_sample().
+                'memory': The result is kept in memory only.
+                'file': The result is also written to a result file.
+                'async_file': The result is also written to a result file, in 
+                a background thread while the next sample is computed.
+                Default: 'memory'
         """
         self._create_clock()
         self.op = op
@@ -121,18 +184,11 @@ class MPC(object):
         self.initial_guess = initial_guess
         self.create_comp_result = create_comp_result
         self.warm_start_options = warm_start_options
+        if sample_result_output not in ['memory', 'file', 'async_file']:
+            raise ValueError("sample_result_output must be 'memory', " +\
+                             "'file' or 'async_file'.")
+        self.sample_result_output = sample_result_output
         
-        # Create complete result lists
-        if self.create_comp_result:
-            self.res= {}
-            self.res['t'] = []
-            self.res['dx'] = []
-            self.res['x'] = []
-            self.res['u'] = []
-            self.res['w'] = []
-            self.res['elim_vars'] = []
-
-			
         # Create array to storage eliminated variables
         self.eliminated_variables = op.getEliminatedVariables()
            
@@ -179,6 +235,16 @@ class MPC(object):
         # Transcribe the DOP to a nlp
         self._create_nlp_object()
 
+        # Create complete result arrays, one column per variable
+        if self.create_comp_result:
+            n_var = self.collocator.n_var
+            self.res = {}
+            self.res['t'] = _ResultColumns(1)
+            for n in ['dx', 'x', 'u', 'w']:
+                self.res[n] = _ResultColumns(n_var[n])
+            self.res['elim_vars'] = _ResultColumns(
+                                            len(self.eliminated_variables))
+
         self.collocator.result_file_name= self.result_file_name
         
         if self.options['solver'] == 'IPOPT':
@@ -189,6 +255,8 @@ class MPC(object):
             self.successful_optimization = ['OptimalSolution', 
                                             'LowPassFilterOptimal', 
                                             'AcceptableSolution']
+        self.successful_optimization.append('SQP_Step_Computed')
+        self._prepared = False
              
         # Save the initialization time
         self.times['init'] = time.clock() - self._startTime
@@ -205,6 +273,7 @@ class MPC(object):
         self.times['post_processing'] = 0
         self.times['tot'] = 0
         self.times['maxTime'] = 0
+        self.times['preparation'] = 0
 
     def _add_u0(self):
         """
@@ -507,34 +576,24 @@ class MPC(object):
 
     def _append_to_result_file(self, sim_res):
         """
-        Extracts the results in sim_res and appends it to the result lists.
+        Extracts the results in sim_res and appends it to the result arrays.
         """
-        var_type = ['dx', 'x', 'u', 'w']
         n_values = len(sim_res['time'])
-        
-        for k in range(n_values):
-            self.res['t'].append(sim_res['time'][k])
-        for k in range(n_values):
-            for n in var_type:   
-                n_var_type = self.collocator.n_var[n]
-                
-                if n_var_type == 0:
-                    self.res[n].append([])
-                    
-                for i in range(n_var_type):
-                    try:
-                        res_var = sim_res[self.collocator.mvar_vectors[n][i].\
-                                          getName()]
-                    except VariableNotFoundError:
-                        res_var = N.array([0]*n_values)
-                    self.res[n].append(res_var[k])
-                    
-        elims = N.zeros(len(self.eliminated_variables))
-        for k in range(n_values):
-            for i,var in enumerate (self.eliminated_variables):
-                elims[i] = sim_res[var.getName()][k]
-			
-            self.res['elim_vars'].append(elims)
+        self.res['t'].append(N.reshape(sim_res['time'], [-1, 1]))
+
+        for n in ['dx', 'x', 'u', 'w']:
+            values = N.zeros([n_values, self.collocator.n_var[n]])
+            for i, var in enumerate(self.collocator.mvar_vectors[n]):
+                try:
+                    values[:, i] = sim_res[var.getName()]
+                except VariableNotFoundError:
+                    pass
+            self.res[n].append(values)
+
+        elims = N.empty([n_values, len(self.eliminated_variables)])
+        for i, var in enumerate(self.eliminated_variables):
+            elims[:, i] = sim_res[var.getName()]
+        self.res['elim_vars'].append(elims)
        
     def _add_times(self):
         """
@@ -800,22 +859,32 @@ class MPC(object):
                                             du_bounds[key.split\
                                             ('_du_bounds')[0]])
                 
-    def sample(self):
+    def prepare(self):
         """
-        Updates parameter values, shifts the optimization horizon, 
-        redefines the initial guess of the primal variables (for all but the 
-        first sample) and solves the NLP. 
-        Warm start is initiated the second time sample is called.  
+        Preparation phase of the real-time iteration scheme, to be called
+        after sample() and before the next update_state().
+
+        Shifts the result of the last sample as the initial guess of the next
+        one, see _shift_xx, and linearizes the NLP around it using the dual
+        variables of the last sample. The next call to sample() then only
+        takes one SQP step, using the new initial states, instead of solving
+        the NLP to convergence.
         """
-        # Update parameter values
+        if self._sample_nbr == 0:
+            raise RuntimeError("prepare() can only be called after the " +\
+                               "first sample.")
+        t0 = time.clock()
+        self._shift_xx()
         self._recalculate_parameters()
-        
-        # Update timepoints
-        if self.startTime != self.collocator.time[0]:
-            coll_time = self.collocator.time+(self.startTime-self.collocator.time[0])
-            self.collocator.time = coll_time
-            
-            
+        self.collocator.prepare_sqp_step()
+        self._prepared = True
+        self.times['preparation'] += time.clock() - t0
+
+    def _solve_nlp(self):
+        """
+        Redefines the initial guess of the primal variables (for all but the 
+        first sample) and solves the NLP.
+        """
         # Set the next initial guesses for primal variables
         if self._init_traj_set_by_user:
                 self._set_inittraj()
@@ -834,7 +903,7 @@ class MPC(object):
                           "variables have not been specified for this sample.") 
        
         # Initiate the warm start 
-        if self._sample_nbr == 2:            
+        if self._sample_nbr > 1 and not self.collocator.warm_start:
             self.collocator.warm_start = True
             self._set_warm_start_options()
             self.collocator.solver_object.init()
@@ -846,8 +915,38 @@ class MPC(object):
         self.update_time = time.clock() - self._t0 - self.sol_time
         self.post_time = time.clock()
 
-        # Check return status and if optimization was successful
         self.status = self.collocator.solver_object.getStat('return_status')
+
+    def sample(self):
+        """
+        Updates parameter values, shifts the optimization horizon, 
+        redefines the initial guess of the primal variables (for all but the 
+        first sample) and solves the NLP. 
+        Warm start is initiated the second time the NLP is solved.  
+
+        If prepare() has been called since the last sample, only one SQP step
+        is taken from the prepared linearization instead.
+        """
+        # Update parameter values
+        self._recalculate_parameters()
+        
+        # Update timepoints
+        if self.startTime != self.collocator.time[0]:
+            coll_time = self.collocator.time+(self.startTime-self.collocator.time[0])
+            self.collocator.time = coll_time
+            
+        if self._prepared and not self._init_traj_set_by_user:
+            # Feedback phase of the real-time iteration
+            self._prepared = False
+            self.sol_time = self.collocator.sqp_step()
+            self.update_time = time.clock() - self._t0 - self.sol_time
+            self.post_time = time.clock()
+            self.status = self.collocator.sqp_status
+        else:
+            self._prepared = False
+            self._solve_nlp()
+
+        # Check return status and if optimization was successful
         if self.status in self.successful_optimization:
             self.found_solution = True
         else:
@@ -857,11 +956,7 @@ class MPC(object):
             self.result = self.collocator.get_result()
             self.consec_fails = 0
             if self.initial_guess == 'trajectory':
-                self.collocator.export_result_dymola(self.result_file_name)
-                self.collocator.times['init'] = self.update_time
-                self.collocator.times['sol'] = self.sol_time
-                self.collocator.times['post_processing']= time.clock()-self.post_time 
-                self._result_object = self.collocator.get_result_object()
+                self._result_object = self._create_result_object(self.result)
         else:
             if self._sample_nbr == 1:
                 raise RuntimeError("The solver was unable to find a "+\
@@ -874,7 +969,12 @@ class MPC(object):
                 #THROW SOMETHING CAUSE THIS AINT WORKING!
         
         self.t0_post = time.clock()
-        self.solver_stats.append(self.collocator.get_solver_statistics())
+        if self.status in ['SQP_Step_Computed', 'Invalid_SQP_Step']:
+            self.solver_stats.append((self.status, 1, 
+                                      self.collocator.sqp_objective,
+                                      self.sol_time))
+        else:
+            self.solver_stats.append(self.collocator.get_solver_statistics())
 
         self._init_traj_set_by_user = False
         self._add_times()
@@ -924,13 +1024,33 @@ class MPC(object):
         (a LocalDAECollocationAlgResult-object). 
         """
         if self.initial_guess != 'trajectory':
-             self.collocator.export_result_dymola(self.result_file_name)
-             self.collocator.times['init'] = self.update_time
-             self.collocator.times['sol'] = self.sol_time
-             self.collocator.times['post_processing']= time.clock()-self.post_time 
-             self._result_object = self.collocator.get_result_object()
+             self._result_object = self._create_result_object()
              
         return self._result_object
+
+    def _create_result_object(self, result=None):
+        """
+        Creates the result object for the last optimization from the result 
+        in memory. The result file is also written if sample_result_output 
+        is 'file' or 'async_file'.
+
+        Parameters::
+
+            result --
+                The result of the last optimization, as returned by 
+                collocator.get_result(). If None, it is retrieved from the 
+                collocator.
+                Default: None
+        """
+        if self.sample_result_output != 'memory':
+            asynchronous = (self.sample_result_output == 'async_file')
+            self.collocator.export_result_dymola(self.result_file_name,
+                                                 asynchronous=asynchronous)
+        result_data = self.collocator.get_result_data(result)
+        self.collocator.times['init'] = self.update_time
+        self.collocator.times['sol'] = self.sol_time
+        self.collocator.times['post_processing']= time.clock()-self.post_time 
+        return self.collocator.get_result_object(result_data=result_data)
         
     def get_complete_results(self):
         """
@@ -942,26 +1062,13 @@ class MPC(object):
             raise  ValueError("'get_complete_results()' only works if" +\
                                 "'create_comp_result' is True.")
         
-        # Convert the complete restults lists to arrays
-        self.res_t = N.array(self.res['t']).reshape([-1, 1])
-        self.res_dx = N.array(self.res['dx']).reshape\
-                                            ([-1, self.collocator.n_var['dx']])
-        self.res_x = N.array(self.res['x']).reshape\
-                                            ([-1, self.collocator.n_var['x']])
-        self.res_u = N.array(self.res['u']).reshape\
-                                            ([-1, self.collocator.n_var['u']])
-        if self.collocator.n_var['w'] >= 1:
-            self.res_w = N.array(self.res['w']).reshape\
-                                            ([-1, self.collocator.n_var['w']])
-        else:
-            self.res_w = N.array(self.res['w'])
-        res_p = N.array(0).reshape(-1)
-        
-        if len(self.eliminated_variables) == 0:
-            self.res_elim_vars = N.ones([len(self.res['t']),0])	
-        else:
-            self.res_elim_vars = N.array(self.res['elim_vars']).reshape\
-                                            ([-1, len(self.eliminated_variables)])                        
+        # Get the complete result arrays
+        self.res_t = self.res['t'].get_array()
+        self.res_dx = self.res['dx'].get_array()
+        self.res_x = self.res['x'].get_array()
+        self.res_u = self.res['u'].get_array()
+        self.res_w = self.res['w'].get_array()
+        self.res_elim_vars = self.res['elim_vars'].get_array()
         res_p = N.array(0).reshape(-1)
         
         res = (self.res_t, self.res_dx, self.res_x, self.res_u, 
@@ -970,7 +1077,7 @@ class MPC(object):
         self.collocator.export_result_dymola(self._mpc_result_file_name, 
                                                 result=res)
 
-        complete_res = ResultDymolaTextual(self._mpc_result_file_name)
+        complete_res = self.collocator.get_result_data(res)
 
         # Create and return result object
         self._result_object_complete = MPCAlgResult(self.op, 
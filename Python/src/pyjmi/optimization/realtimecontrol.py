@@ -387,7 +387,7 @@ class RealTimeMPCBase(RealTimeBase):
         
         self.solver = MPC(op, opt_opts, dt, horizon, constr_viol_costs = constr_viol_costs)  
             
-    def enable_codegen(self, name=None):
+    def enable_codegen(self, name=None, opt_level=3):
         """
         Enables use of generated C code for the MPC solver.
         
@@ -399,13 +399,18 @@ class RealTimeMPCBase(RealTimeBase):
         Parameters::
                 
             name --
-                A string that if it is not None, loads existing files
-                nlp_[name].so, grad_f_[name].so, jac_g_[name].so and
-                hess_lag_[name].so as ExternalFunction objects to be used
-                by the solver rather than generating new code.
+                A string used in the names of the generated files
+                nlp_[name], grad_f_[name], jac_g_[name] and hess_lag_[name].
+                Existing compiled files are reused if they were compiled
+                from identical code. If None, a hash of the generated code
+                is used instead of name.
                 Default: None
+
+            opt_level --
+                The gcc optimization level, e.g. 0, 2, 3 or 's'.
+                Default: 3
         """
-        self.solver.collocator.enable_codegen(name)
+        self.solver.collocator.enable_codegen(name, opt_level)
             
     def enable_integral_action(self, mu, M, error_names=None, u_e=None):
         """
@@ -15,6 +15,8 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import threading
+import multiprocessing
+import traceback
 import os
 import sys
 import numpy as N
@@ -111,3 +113,181 @@ def feval(func_file_name,x,debug):
 			fval[i] = eval(f_string)
 	
 	return fval
+
+
+def _load_function(func):
+    """
+    Get the objective function from a callable or from the name of a 
+    python file containing the definition of the function. The function 
+    in the file must have the same name as the file itself (without 
+    ".py").
+    """
+    if not isinstance(func, basestring):
+        return func
+    namespace = {'__name__': '__feval__', 
+                 '__file__': os.path.abspath(func)}
+    execfile(func, namespace)
+    if func.endswith(".py"):
+        func_name = func[:-3].split('/')[-1].split('\\')[-1]
+    else:
+        func_name = func.split('/')[-1].split('\\')[-1]
+    return namespace[func_name]
+
+def _feval_worker(conn, func, dir_name, debug):
+    """
+    Main loop of a worker process in a FevalPool. The function is loaded 
+    once and is then evaluated in the sub-directory dir_name for each 
+    batch of points received through conn, until None is received.
+    """
+    if debug:
+        sys.stdout = open('out_file_' + dir_name + '.txt', 'w', 0)
+        sys.stderr = open('err_file_' + dir_name + '.txt', 'w', 0)
+    load_error = None
+    try:
+        f = _load_function(func)
+    except Exception:
+        load_error = traceback.format_exc()
+    try:
+        os.mkdir(dir_name)
+    except OSError:
+        pass
+    os.chdir(dir_name)
+    
+    while True:
+        points = conn.recv()
+        if points is None:
+            break
+        if load_error is not None:
+            conn.send(('error', load_error))
+            continue
+        try:
+            conn.send(('ok', [float(f(x)) for x in points]))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+class FevalPool(object):
+    """
+    A pool of persistent worker processes used to evaluate a function in 
+    several points in parallel.
+    
+    Contrary to feval, which starts a new python process for each point, 
+    the function is loaded only once in each worker. Anything that is 
+    loaded when the function file is executed, e.g. an FMU, is hence kept 
+    between the evaluations. The points are distributed in batches over 
+    the workers and the function values are sent back over pipes.
+    
+    Each worker performs its evaluations in its own sub-directory, 
+    'dir_1', 'dir_2', etc., to the current working directory.
+    
+    A FevalPool can be given as the objective function to the solvers in 
+    dfo. It should be closed when it is no longer needed, preferably by 
+    using it in a with statement::
+    
+        >>> with FevalPool('cost.py', nbr_cores=4) as pool:
+        ...     res = dfo.fmin(pool, xstart=x0)
+    """
+    
+    def __init__(self, func, nbr_cores=None, debug=False):
+        """
+        Start the worker processes.
+        
+        Parameters::
+        
+            func --
+                callable func(x) or string
+                The function OR the name of a python file containing the 
+                definition of the function. In case of a file name, the 
+                function in the file must have the same name as the file 
+                itself (without ".py").
+                
+            nbr_cores --
+                int
+                The number of worker processes.
+                Default: The number of processor cores
+                
+            debug --
+                bool
+                Set to True to get separate error and output files for 
+                each worker process.
+                Default: False
+        """
+        if nbr_cores is None:
+            nbr_cores = multiprocessing.cpu_count()
+        self.func = func
+        self.nbr_cores = nbr_cores
+        self.debug = debug
+        self._workers = []
+        for i in range(nbr_cores):
+            (conn, child_conn) = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_feval_worker, 
+                args=(child_conn, func, 'dir_' + str(i+1), debug))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+    
+    def __call__(self, x):
+        return self.feval(x)
+    
+    def feval(self, x):
+        """
+        Evaluate the function in x. If x contains multiple points (rows) 
+        then the points are evaluated in parallel by the workers.
+        
+        Parameters::
+        
+            x --
+                ndarray (1 or 2 dimensions)
+                The point(s) in which to evaluate the function.
+                
+        Returns::
+        
+            fval --
+                float or ndarray (1 dimension)
+                The function value(s) in x.
+        """
+        if self._workers == []:
+            raise RuntimeError('The FevalPool has been closed.')
+        if N.ndim(x) == 1:
+            return self._feval_points(N.atleast_2d(x))[0]
+        return self._feval_points(N.asfarray(x))
+    
+    def _feval_points(self, points):
+        m = len(points)
+        fval = N.zeros(m)
+        # Send the points in contiguous batches, one batch per worker
+        batches = N.array_split(N.arange(m), min(m, self.nbr_cores))
+        for ((process, conn), inds) in zip(self._workers, batches):
+            conn.send(points[inds])
+        errors = []
+        for ((process, conn), inds) in zip(self._workers, batches):
+            (status, values) = conn.recv()
+            if status == 'ok':
+                fval[inds] = values
+            else:
+                errors.append(values)
+        if len(errors) > 0:
+            raise OSError('Something went wrong with the function ' + 
+                          'evaluation:\n' + errors[0])
+        return fval
+    
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        for (process, conn) in self._workers:
+            try:
+                conn.send(None)
+            except IOError:
+                pass
+            conn.close()
+        for (process, conn) in self._workers:
+            process.join()
+        self._workers = []
@@ -22,7 +22,7 @@ import scipy
 import casadi
 import modelicacasadi_wrapper as ci
 import itertools
-from collections import OrderedDict
+from collections import OrderedDict, deque
 from modelicacasadi_wrapper import Model
 from pyjmi.common.core import ModelBase
 from pyjmi.common.algorithm_drivers import OptionBase
@@ -576,6 +576,8 @@ class BipartiteGraph(object):
             raise ValueError("Equation system is structurally singular.")
         self.edges = edges
         self.matches = None
+        self.eq_match = None
+        self.var_match = None
         self.components = []
 
         # Create incidence matrix
@@ -586,6 +588,13 @@ class BipartiteGraph(object):
             col.append(edge.var.local_index)
         self.incidences = scipy.sparse.coo_matrix((np.ones(len(row)), (row, col)), shape=(self.n, self.n))
 
+        # Create adjacency lists, mapping the index of each equation to the indices of its variables
+        self._eq_index = dict((eq, i) for (i, eq) in enumerate(equations))
+        var_index = dict((vari, j) for (j, vari) in enumerate(variables))
+        self._eq_adj = [[] for i in xrange(self.n)]
+        for edge in edges:
+            self._eq_adj[self._eq_index[edge.eq]].append(var_index[edge.var])
+
     def _reset(self):
         """
         Resets visited attribute for equations and variables.
@@ -775,187 +784,168 @@ class BipartiteGraph(object):
 
     def maximum_match(self):
         """
-        Computes a new perfect matching.
+        Computes a new perfect matching using Hopcroft-Karp.
+
+        The matching is stored as the list self.matches of (equation, variable)
+        pairs, and as the index arrays self.eq_match and self.var_match, which
+        map the index of an equation (variable) to the index of its matched
+        variable (equation), or -1 if unmatched.
         """
-        self.matches = [] # Step 0
+        self.eq_match = [-1] * self.n # Step 0
+        self.var_match = [-1] * self.n
+        empty_eqs = [self.equations[i] for i in xrange(self.n) if not self._eq_adj[i]]
+        if empty_eqs:
+            raise RuntimeError("The following equations contain no variables: %s" % empty_eqs)
         i = 0
-        while True:
+        n_matched = 0
+        while n_matched < self.n:
             i += 1
-            paths = self._find_shortest_aug_paths(i) # Step 1
-            if paths == []:
-                return
-            for path in paths:
-                for edge in path:
-                    try:
-                        idx = self.matches.index(edge)
-                    except ValueError:
-                        self.matches.append(edge)
-                    else:
-                        del self.matches[idx]
+            n_paths = self._find_shortest_aug_paths(i) # Step 1
+            if n_paths == 0:
+                raise RuntimeError("Unable to find perfect matching")
+            n_matched += n_paths
+        self._update_matches()
 
-    def _remove_duplicates(self, l):
+    def _update_matches(self):
         """
-        Remove duplicate elements in iterable.
+        Create the list of matched (equation, variable) pairs from the index arrays.
         """
-        seen = set()
-        seen_add = seen.add
-        return [x for x in l if not (x in seen or seen_add(x))]
+        self.matches = [(self.equations[i], self.variables[j]) for (i, j) in enumerate(self.eq_match) if j >= 0]
 
     def _find_shortest_aug_paths(self, idx=2):
         """
         Step 1 of Hopcroft-Karp.
         
         Finds a maximal vertex-disjoint set of shortest augmenting paths
-        relative to self.matches.
+        relative to the current matching and augments the matching along them.
 
         Equations are boys and variables are girls.
-        """
-        options = self.options
-        
-        # Find unmatched equations and variables
-        matched_eqs = []
-        matched_varis = []
-        for (eq, vari) in self.matches:
-            matched_eqs.append(eq)
-            matched_varis.append(vari)
-        unmatched_eqs = [eq for eq in self.equations if eq not in matched_eqs]
-        unmatched_varis = [vari for vari in self.variables if vari not in matched_varis]
-        if unmatched_eqs == []:
-            return []
-
-        # Construct layers
-        L = [unmatched_eqs]
-        L_union = copy.copy(L[0])
-        E = []
-        i = 0
-        while set(L[-1]) & set(unmatched_varis) == set():
-            if i % 2 == 0:
-                E_i = [(edge.var, edge.eq) for edge in self.edges if ((edge.eq in L[i]) and (edge.var not in L_union) and ((edge.eq, edge.var) not in self.matches))]
-                if i == 0 and len(E_i) == 0:
-                    raise RuntimeError("The following equations contain no variables: %s" % L[0])
-                E.append(E_i)
-                L_i = self._remove_duplicates([vari for (vari, eq) in E_i])
-            else:
-                E_i = [(edge.eq, edge.var) for edge in self.edges if ((edge.var in L[i]) and (edge.eq not in L_union) and ((edge.eq, edge.var) in self.matches))]
-                E.append(E_i)
-                L_i = self._remove_duplicates([eq for (eq, vari) in E_i])
-            if len(E_i) == 0:
-                raise RuntimeError("Unable to find perfect matching")
-            i += 1
-            L_union += L_i
-            L_union = self._remove_duplicates(L_union)
-            L.append(L_i)
-        i_star = len(L) - 1 # = len(E)
 
-        # Only consider unmatched variables in final layer
-        E[i_star-1] = [(vari, eq) for (vari, eq) in E[i_star-1] if vari in unmatched_varis]
-        L[i_star] = [vari for vari in L[i_star] if vari in unmatched_varis]
+        Returns::
 
-        # Add source and sink
-        source = Equation('source', -1, -1, False, False)
-        sink = Variable('sink', -1, -1, False, False)
+            The number of augmenting paths found.
+        """
+        eq_adj = self._eq_adj
+        eq_match = self.eq_match
+        var_match = self.var_match
+
+        # Construct layers by breadth-first search from the unmatched equations.
+        # layer[i] is the layer of equation i, or -1 if it is not reached.
+        layer = [-1] * self.n
+        queue = deque()
+        for i in xrange(self.n):
+            if eq_match[i] < 0:
+                layer[i] = 0
+                queue.append(i)
+        free_layer = None
+        while queue:
+            i = queue.popleft()
+            if free_layer is not None and layer[i] >= free_layer:
+                continue
+            for j in eq_adj[i]:
+                k = var_match[j]
+                if k < 0:
+                    free_layer = layer[i]
+                elif layer[k] < 0:
+                    layer[k] = layer[i] + 1
+                    queue.append(k)
+        if free_layer is None:
+            return 0
 
         # Draw layers
-        if options['plots']:
-            plt.close(idx)
-            plt.figure(idx)
-
-            # Plot vertices
-            for i in xrange(i_star + 1):
-                if i % 2 == 0:
-                    for eq in L[i]:
-                        plt.plot(i, -eq.local_index, 'go', ms=12)
-                else:
-                    for vari in L[i]:
-                        plt.plot(i, -vari.local_index, 'ro', ms=12)
-
-            # Plot source
-            plt.plot(-1, -(self.n - 1) / 2., 'ko', ms=12)
-            for eq in L[0]:
-                plt.plot([-1, 0], [-(self.n - 1) / 2., -eq.local_index], 'k', ms=12)
-
-            # Plot sink
-            plt.plot(i_star + 1, -(self.n - 1) / 2., 'ko', ms=12)
-            for vari in L[i_star]:
-                plt.plot([i_star + 1, i_star], [-(self.n - 1) / 2., -vari.local_index], 'k', ms=12)
-
-            # Plot edges
-            for i in xrange(i_star):
-                for (u, v) in E[i]:
-                    if i % 2 == 0:
-                        color = 'r'
-                    else:
-                        color = 'g'
-                    plt.plot([i, i+1], [-v.local_index, -u.local_index], color=color, lw=1.5)
-            scale_axis()
-            plt.show()
-
-        # Compute vertex successors
-        successors = {}
-        for i in xrange(i_star):
-            for v in L[i+1]:
-                successors[v] = []
-            for (u, v) in E[i]:
-                successors[u].append(v)
-        successors[source] = L[i_star]
-        successors[sink] = []
-        for eq in L[0]:
-            successors[eq] = [sink]
-
-        # Find maximal set of paths from source to sink
-        stack = []
-        stack.append(source)
-        paths = []
-        self._reset()
-        while len(stack) > 0:
-            while len(successors[stack[-1]]) > 0:
-                first = successors[stack[-1]].pop()
-                if not first.visited:
-                    stack.append(first)
-                    if stack[-1] != sink:
-                        stack[-1].visited = True
-                    else:
-                        path = []
-                        del stack[0] # Remove source
-                        del stack[-1] # Remove sink
-                        for i in xrange(len(stack)-1):
-                            if i % 2 == 0:
-                                path.append((stack[i+1], stack[i]))
-                            else:
-                                path.append((stack[i], stack[i+1]))
-                        paths.append(path)
-                        stack = [source]
-            stack.pop()
-        return paths
+        if self.options['plots']:
+            self._draw_layers(idx, layer, free_layer)
+
+        # Find maximal set of vertex-disjoint paths by depth-first search along
+        # the layers, starting from each unmatched equation. next_edge holds
+        # the position of the next edge to try for each equation, so that each
+        # edge is traversed at most once.
+        next_edge = [0] * self.n
+        n_paths = 0
+        for root in xrange(self.n):
+            if eq_match[root] >= 0 or layer[root] != 0:
+                continue
+            stack = [root]
+            while stack:
+                i = stack[-1]
+                if next_edge[i] == len(eq_adj[i]):
+                    # Dead end
+                    layer[i] = -1
+                    stack.pop()
+                    continue
+                j = eq_adj[i][next_edge[i]]
+                next_edge[i] += 1
+                k = var_match[j]
+                if k < 0:
+                    # Augment along the path
+                    for i in stack:
+                        j = eq_adj[i][next_edge[i] - 1]
+                        eq_match[i] = j
+                        var_match[j] = i
+                    n_paths += 1
+                    break
+                elif layer[k] == layer[i] + 1:
+                    stack.append(k)
+        return n_paths
+
+    def _draw_layers(self, idx, layer, free_layer):
+        """
+        Draw the layered graph of Hopcroft-Karp.
+        """
+        plt.close(idx)
+        plt.figure(idx)
+        for (i, eq) in enumerate(self.equations):
+            if 0 <= layer[i] <= free_layer:
+                plt.plot(2 * layer[i], -eq.local_index, 'go', ms=12)
+                for j in self._eq_adj[i]:
+                    k = self.var_match[j]
+                    if k < 0 or layer[k] == layer[i] + 1:
+                        plt.plot(2 * layer[i] + 1, -self.variables[j].local_index, 'ro', ms=12)
+                        plt.plot([2 * layer[i], 2 * layer[i] + 1],
+                                 [-eq.local_index, -self.variables[j].local_index], 'r', lw=1.5)
+                        if k >= 0:
+                            plt.plot([2 * layer[i] + 1, 2 * layer[k]],
+                                     [-self.variables[j].local_index, -self.equations[k].local_index],
+                                     'g', lw=1.5)
+        scale_axis()
+        plt.show()
 
     def inherit_matching(self, matching):
         """
         Inherits the applicable subset of the provided matchings.
         """
-        block_names = [var.name for var in self.variables]
-        self.matches = [match for match in matching if match[1].name in block_names]
+        var_index = dict((vari.name, j) for (j, vari) in enumerate(self.variables))
+        self.eq_match = [-1] * self.n
+        self.var_match = [-1] * self.n
+        for (eq, vari) in matching:
+            if vari.name in var_index and eq in self._eq_index:
+                i = self._eq_index[eq]
+                j = var_index[vari.name]
+                self.eq_match[i] = j
+                self.var_match[j] = i
+        self._update_matches()
 
     def scc(self, global_index=0):
         """
         Computes strongly connected components using Tarjan's algorithm.
         """
-        vertices = [DigraphVertex(i, eq, vari) for (i, (eq, vari)) in enumerate(self.matches)]
+        vertices = [DigraphVertex(i, self.equations[i], self.variables[j])
+                    for (i, j) in enumerate(self.eq_match)]
 
-        # Create edges (without self-loops)
-        dig_edgs = []
-        for edge in self.edges:
-            if (edge.eq, edge.var) not in self.matches:
-            #~ if (edge.var, edge.eq) not in self.matches:
-                dig_edgs.append((edge.eq.dig_vertex, edge.var.dig_vertex))
-        self.dig_edgs = dig_edgs
+        # Create edges (without self-loops). Vertex i is equation i and its
+        # matched variable, so an edge from equation i to variable j
+        # corresponds to an edge from vertex i to vertex var_match[j].
+        self.successors = [[self.var_match[j] for j in self._eq_adj[i] if j != self.eq_match[i]]
+                           for i in xrange(self.n)]
 
         # Strong connect
         self.i = 0
         self.stack = []
+        self.on_stack = [False] * self.n
         self.components = []
         for v in vertices:
             if v.number is None:
-                self._strong_connect(v)
+                self._strong_connect(v, vertices)
 
         # Create new equation and variable indices
         i = 0
@@ -967,30 +957,51 @@ class BipartiteGraph(object):
                 vertex.variable.global_blt_index = global_index + i
                 i += 1
 
-    def _strong_connect(self, v):
+    def _strong_connect(self, v, vertices):
         """
         Finds a strong connection for v.
-        """
-        self.i += 1
-        v.number = self.i
-        v.lowlink = self.i
-        self.stack.append(v)
 
-        for (v1, w) in self.dig_edgs:
-            if v1 == v:
+        The depth-first search is iterative, using an explicit stack of
+        (vertex, position of next successor) pairs.
+        """
+        successors = self.successors
+        on_stack = self.on_stack
+        dfs_stack = [[v, 0]]
+        while dfs_stack:
+            frame = dfs_stack[-1]
+            v = frame[0]
+            if frame[1] == 0:
+                self.i += 1
+                v.number = self.i
+                v.lowlink = self.i
+                self.stack.append(v)
+                on_stack[v.index] = True
+
+            v_successors = successors[v.index]
+            while frame[1] < len(v_successors):
+                w = vertices[v_successors[frame[1]]]
+                frame[1] += 1
                 if w.number is None: # (v, w) is a tree arc
-                    self._strong_connect(w)
-                    v.lowlink = min(v.lowlink, w.lowlink)
+                    dfs_stack.append([w, 0])
+                    break
                 elif w.number < v.number: # (v, w) is a frond or cross-link
-                    if w in self.stack:
+                    if on_stack[w.index]:
                         v.lowlink = min(v.lowlink, w.number)
-
-        if v.lowlink == v.number: # v is the root of a component
-            # Start new strongly connected component
-            vertices = []
-            while self.stack and self.stack[-1].number >= v.number:
-                vertices.append(self.stack.pop())
-            self.components.append(Component(vertices, self.options, self.edges))
+            else:
+                # All successors visited
+                dfs_stack.pop()
+                if dfs_stack:
+                    parent = dfs_stack[-1][0]
+                    parent.lowlink = min(parent.lowlink, v.lowlink)
+
+                if v.lowlink == v.number: # v is the root of a component
+                    # Start new strongly connected component
+                    component_vertices = []
+                    while self.stack and self.stack[-1].number >= v.number:
+                        w = self.stack.pop()
+                        on_stack[w.index] = False
+                        component_vertices.append(w)
+                    self.components.append(Component(component_vertices, self.options, self.edges))
 
 def create_edges(equations, variables):
         """
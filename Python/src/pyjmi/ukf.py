@@ -27,6 +27,8 @@ import collections
 from pyfmi.fmi import FMUException
 from assimulo.solvers.sundials import CVodeError 
 import random
+import multiprocessing
+import os
 
 class UKF:
     """A class representing a Non-augmented Unscented Kalman Filter.
@@ -69,7 +71,7 @@ class UKF:
         fails -- Dict containing the number of failed sigma-point simulations at each time instance ({float:int})
     """
     
-    def __init__(self, model, x_0, measurements, h, options):
+    def __init__(self, model, x_0, measurements, h, options, pool=None):
         """Constructor
         
             Arguments:
@@ -78,11 +80,15 @@ class UKF:
             measurements -- A list of the measured states ([string])
 			h -- Sample interval (float)
 			options -- UKF options containing initial covariances and parameters (UKFOptions)
+            pool -- Optional pool of observer model instances used to simulate 
+                the sigma points in parallel. If None, the sigma points are 
+                simulated one at a time using model. (SigmaPointPool)
             
         """
        
         #Assign attributes        
         self.model = model
+        self.pool = pool
         self.options = options.copy()
         self.h = h
         self.currTime = 0.0
@@ -222,13 +228,11 @@ class UKF:
             print P
             raise
    
-        #Calculate sigma matrix
-        sigma = N.zeros((L, 2 * L + 1))
-        sigma[:,0] = x_a                      #First sigma point is the estimated augmented state vector
-        for i in range(1, L + 1):
-            sigma[:,i] = x_a + P_sqrt[:,(i-1)]
-        for i in range(L + 1, 2 * L + 1):
-            sigma[:,i] = x_a - P_sqrt[:,i - (L + 1)] 
+        #Calculate sigma matrix. The first sigma point is the estimated 
+        #augmented state vector, followed by the points x_a + P_sqrt[:,i] 
+        #and x_a - P_sqrt[:,i]
+        x_a = N.reshape(x_a, (-1,1))
+        sigma = N.hstack((x_a, x_a + P_sqrt, x_a - P_sqrt))
         return sigma
         
     def update(self,y):
@@ -331,101 +335,232 @@ class UKF:
             
         """
         
-        #Calculate sigma matrix and extract sigma points
-        L_meas = len(measurements)      
-     
-        #Produce prediction of state estimate and measurement
-        Xxp = N.zeros(sigma.shape)
-        Y = N.zeros([L_meas, sigma.shape[1]])
-        
-        #Simulate each sigma point h seconds
-        for i in range(0, sigma.shape[1]):
-        
-            #If sigma point simulation fails, try perturbing initial value and start again. Maximum 10 times,
-            #then use the result of the last simulated sigma point.
-            retry = True
-            k = 1
-			
-            while retry:
-                retry = False
-                #Reset the observer model
-                model.reset()
-            
-                #Set the initial states as the current sigma point
-                for j, state in enumerate(x):
-                    #If the sigma point has previously failed, try perturbing the state values
-                    if k > 1:
+        #Names of the variables to extract from the simulation results
+        L = len(x)
+        names = [state.get_name() for state in x] + \
+                [meas.get_name() for meas in measurements]
+        nominals = N.array([state.get_nominal_value() for state in x] + 
+                           [meas.get_nominal_value() for meas in measurements])
+        known = [(name+'_0', value) for (name, value) in known_values.items()]
+        
+        #Simulate each sigma point h seconds. If sigma point simulations 
+        #fail, try perturbing their initial values and simulate them again. 
+        #Maximum 10 times, then use the result of the closest preceding 
+        #successfully simulated sigma point.
+        n_sigma = sigma.shape[1]
+        results = [None] * n_sigma
+        pending = range(n_sigma)
+        k = 1
+        while len(pending) > 0:
+            points = []
+            for i in pending:
+                #If the sigma point has previously failed, try perturbing the state values
+                if k > 1:
+                    for j in range(L):
                         dist = N.abs(sigma[j,0] - sigma[j,i])                #Distance in this coordinate to mean point
                         sigma[j,i] = sigma[j,i] + random.gauss(0, k*1e-3*dist) #Perturb with 0.1% of distance as std. Increase times k after each iteration.
-                    model.set(state.get_name()+'_0', sigma[j,i]*state.get_nominal_value())
-                    
-                #Set known values
-                for known in known_values:
-                    model.set(known+'_0', known_values[known])
-                    
-                #Simulate and extract result
-                opt = model.simulate_options()
-                opt['CVode_options']['atol'] = 1e-8
-                opt['CVode_options']['rtol'] = 1e-6
-                print 'Simulating sigma-point '+str(i+1)+' out of '+str(sigma.shape[1])+' :'
-                try:
-                    result = model.simulate(start_time = currTime, final_time = currTime + h, options = opt, input = u)
-                except (CVodeError, ValueError, FMUException) as e:
-                    print e
-                    retry = True
+                points.append([(state.get_name()+'_0', 
+                                sigma[j,i]*state.get_nominal_value()) 
+                               for (j, state) in enumerate(x)] + known)
+            
+            if self.pool is None:
+                sim_res = []
+                for (i, start_values) in zip(pending, points):
+                    print 'Simulating sigma-point '+str(i+1)+' out of '+str(n_sigma)+' :'
+                    sim_res.append(_simulate_sigma_point(model, start_values, 
+                                                         currTime, h, u, names))
+            else:
+                print 'Simulating '+str(len(points))+' sigma-points in parallel'
+                sim_res = self.pool.simulate(points, currTime, h, u, names)
+            
+            failed = []
+            for (i, res) in zip(pending, sim_res):
+                if isinstance(res, basestring):
+                    print res
                     print 'Failed sigma point simulation'
                     if k == 1:
                         if currTime in self.fails.keys():
                             self.fails[currTime] = self.fails[currTime] + 1
                         else:
                             self.fails[currTime] = 1
-                    if k == 10:
-                        print 'Simulation failed 10 times, will use result from last sigma point instead'
-                        break
-                k = k + 1
-			
-            #Assign result to matrix, and add process noise. Initialize anew so that all variables are updated
-            for k, state in enumerate(x):
-                Xxp[k,i] = result[state.get_name()][-1]/state.get_nominal_value()             
-     
-            #Assign measurements and add measurement noise
-            for k, meas in enumerate(measurements):
-                Y[k,i] = result[meas.get_name()][-1]/meas.get_nominal_value()
-        
-        #Compute predictions and covariances
-        xp = N.multiply(Wm, Xxp[:])                         #Multiply each point with corresponding weight
-        yp = N.multiply(Wm, Y[:])
-        xp = xp.sum(axis = 1)                               #Produce the weighted sum
-        yp = yp.sum(axis = 1) 
-        xp = N.reshape(xp, (-1,1))                          #Make them 2-D column vectors
-        yp = N.reshape(yp, (-1,1))
-        
-        Pxx = N.zeros((Xxp.shape[0],Xxp.shape[0]))          #State covariance
-        Pyy = N.zeros((Y.shape[0],Y.shape[0]))              #Measurement covariance
-        Pxy = N.zeros((Xxp.shape[0],Y.shape[0]))            #Cross-covariance
-        
-        for i in range(0,Xxp.shape[1]):
-            x_dev = N.reshape(Xxp[:,i],(-1,1)) - xp
-            y_dev = N.reshape(Y[:,i], (-1,1))- yp     
-            Pxx = Pxx + self.Wc[i] * N.outer(x_dev, x_dev)
-            Pyy = Pyy + self.Wc[i] * N.outer(y_dev, y_dev)
-            Pxy = Pxy + self.Wc[i] * N.outer(x_dev,y_dev)
-        
-        Pxx = Pxx + P_v
-        Pyy = Pyy + P_n
+                    failed.append(i)
+                else:
+                    results[i] = res
+            
+            if k == 10 and len(failed) > 0:
+                print 'Simulation failed 10 times, will use result from last sigma point instead'
+                succeeded = [i for i in range(n_sigma) if results[i] is not None]
+                if len(succeeded) == 0:
+                    raise CVodeError('All sigma point simulations failed.')
+                for i in failed:
+                    preceding = [m for m in succeeded if m < i]
+                    results[i] = results[preceding[-1] if preceding else succeeded[0]]
+                failed = []
+            pending = failed
+            k = k + 1
+        
+        #Scaled final values, one column per sigma point
+        Z = N.array(results).T / N.reshape(nominals, (-1,1))
+        Xxp = Z[:L,:]
+        Y = Z[L:,:]
+        
+        #Compute predictions as the weighted means of the sigma points
+        xp = N.reshape(Xxp.dot(Wm), (-1,1))
+        yp = N.reshape(Y.dot(Wm), (-1,1))
+        
+        #Compute the covariances as weighted products of the deviations
+        X_dev = Xxp - xp
+        Y_dev = Y - yp
+        X_dev_w = X_dev * Wc
+        Pxx = X_dev_w.dot(X_dev.T) + P_v           #State covariance
+        Pyy = (Y_dev * Wc).dot(Y_dev.T) + P_n      #Measurement covariance
+        Pxy = X_dev_w.dot(Y_dev.T)                 #Cross-covariance
      
-        #Calculate Kalman filter gain
-        if Pyy.shape[0] == 1 or Pyy.shape[1] == 1:
-            invPyy = 1 / Pyy    
-        else:
-            invPyy = N.linalg.solve(Pyy,N.eye(Pyy.shape[0]))
-        
-        K = Pxy.dot(invPyy)
+        #Calculate Kalman filter gain, K = Pxy*inv(Pyy) where Pyy is symmetric
+        K = N.linalg.solve(Pyy, Pxy.T).T
         
         #Calculate state covariance
         P = Pxx - K.dot(Pyy.dot(K.T))
         return [xp, yp, K, P]
         
+def _simulate_sigma_point(model, start_values, currTime, h, u, names):
+    """Simulates the observer model h seconds from one sigma point.
+    
+        Arguments:
+        model -- Observer model (FMUModel)
+        start_values -- Initial values to set in the model ([(string, float)])
+        currTime -- Current time instant (float)
+        h -- Sample interval in seconds (float)
+        u -- Input trajectory to the process model (([string], numpy.array))
+        names -- Variables whose final values are returned ([string])
+        
+        Returns:
+        values -- The final values of the variables in names (numpy.array), 
+            or the error message (string) if the simulation failed.
+    
+    """
+    try:
+        #Reset the observer model and set the initial values
+        model.reset()
+        for (name, value) in start_values:
+            model.set(name, value)
+        
+        #Simulate and extract result
+        opt = model.simulate_options()
+        opt['CVode_options']['atol'] = 1e-8
+        opt['CVode_options']['rtol'] = 1e-6
+        result = model.simulate(start_time = currTime, final_time = currTime + h, options = opt, input = u)
+    except (CVodeError, ValueError, FMUException) as e:
+        return str(e)
+    return N.array([result[name][-1] for name in names])
+
+def _sigma_point_worker(conn, fmu, log_file_name):
+    """Main loop of a worker process in a SigmaPointPool. Loads its own 
+    instance of the observer model and simulates the batches of sigma 
+    points received through conn, until None is received.
+    
+    """
+    from pyfmi import load_fmu
+    model = load_fmu(fmu, log_file_name = log_file_name)
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        (points, currTime, h, u, names) = job
+        conn.send([_simulate_sigma_point(model, start_values, currTime, h, u, names) 
+                   for start_values in points])
+    conn.close()
+
+class SigmaPointPool:
+    """A pool of worker processes, each with its own independently 
+    instantiated copy of the observer model, used by the UKF to simulate 
+    the sigma points in parallel.
+    
+    The sigma points are distributed in contiguous batches over the 
+    workers. Since each worker has its own model instance, parameter 
+    values set in the observer model given to the UKF are not seen by 
+    the workers. Inputs must be given as trajectories, not as functions.
+    
+    The pool should be closed when it is no longer needed, e.g. by using 
+    it in a with statement.
+    
+    Attributes:
+        fmu -- File name of the FMU of the observer model (string)
+        nbr_workers -- Number of worker processes (int)
+    """
+    
+    def __init__(self, fmu, nbr_workers=None):
+        """Constructor, starts the worker processes
+        
+            Arguments:
+            fmu -- File name of the FMU of the observer model (string)
+            nbr_workers -- Number of worker processes. Default is the 
+                number of processor cores (int)
+            
+        """
+        if nbr_workers is None:
+            nbr_workers = multiprocessing.cpu_count()
+        self.fmu = fmu
+        self.nbr_workers = nbr_workers
+        self._workers = []
+        log_base = os.path.splitext(os.path.basename(fmu))[0]
+        for i in range(nbr_workers):
+            (conn, child_conn) = multiprocessing.Pipe()
+            log_file_name = log_base + '_sigma_worker_' + str(i+1) + '_log.txt'
+            process = multiprocessing.Process(target = _sigma_point_worker, 
+                args = (child_conn, fmu, log_file_name))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((process, conn))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        
+    def simulate(self, points, currTime, h, u, names):
+        """Simulates the observer model h seconds from each of the given 
+        initial values, in parallel.
+        
+            Arguments:
+            points -- Initial values to set in the model, one list per 
+                sigma point ([[(string, float)]])
+            currTime -- Current time instant (float)
+            h -- Sample interval in seconds (float)
+            u -- Input trajectory to the process model (([string], numpy.array))
+            names -- Variables whose final values are returned ([string])
+            
+            Returns:
+            results -- For each sigma point, the final values of the 
+                variables in names (numpy.array) or the error message 
+                (string) if the simulation failed. ([numpy.array or string])
+        
+        """
+        if self._workers == []:
+            raise RuntimeError('The SigmaPointPool has been closed.')
+        batches = N.array_split(N.arange(len(points)), 
+                                min(len(points), self.nbr_workers))
+        for ((process, conn), inds) in zip(self._workers, batches):
+            conn.send(([points[i] for i in inds], currTime, h, u, names))
+        results = []
+        for ((process, conn), inds) in zip(self._workers, batches):
+            results.extend(conn.recv())
+        return results
+    
+    def close(self):
+        """Stops the worker processes"""
+        for (process, conn) in self._workers:
+            try:
+                conn.send(None)
+            except IOError:
+                pass
+            conn.close()
+        for (process, conn) in self._workers:
+            process.join()
+        self._workers = []
+
 class UKFOptions(OptionBase):
     """Class containing covariance matrices and weight parameters for the UKF.
     The covariance matrices are considered diagonal, with the variance of each
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2014 Modelon AB
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module containing an on-disk cache for compiled FMUs and FMUXs, keyed on the
+contents of the model files and the compilation arguments.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import cPickle as pickle
+
+import pymodelica as pym
+
+"""Default cache directory, used unless JMODELICA_COMPILATION_CACHE is set."""
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.jmodelica.org',
+                                 'compilation_cache')
+"""Default maximum total size of the cached units in bytes."""
+DEFAULT_MAX_SIZE = 2*1024**3
+
+_RESULT_FILE = 'result.pkl'
+
+class CompilationCache(object):
+    """
+    An on-disk cache of compilation results.
+
+    Each entry is stored in a directory named after a hash of the compilation
+    inputs:
+
+        - the class name, compiler, target, FMI version, platform and compiler
+          options,
+        - the contents of all files in file_name (libraries given as
+          directories are hashed file by file),
+        - the file names, sizes and modification times of the libraries in
+          MODELICAPATH and of the compiler jar files,
+        - the JModelica.org version.
+
+    When the total size of the cache exceeds max_size, the least recently used
+    entries are removed.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        Create a compilation cache.
+
+        Parameters::
+
+            cache_dir --
+                The directory in which the cache is stored. Is created if it
+                does not exist. If None, the environment variable
+                JMODELICA_COMPILATION_CACHE is used if set, otherwise
+                DEFAULT_CACHE_DIR.
+                Default: None
+
+            max_size --
+                The maximum total size in bytes of the cached units.
+                Default: DEFAULT_MAX_SIZE (2 GB)
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get('JMODELICA_COMPILATION_CACHE',
+                                       DEFAULT_CACHE_DIR)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def get_key(self, class_name, file_name, compiler, target, version,
+                platform, compiler_options, compile_to):
+        """
+        Compute the cache key of a compilation, see compile_fmu for a
+        description of the parameters.
+
+        Returns::
+
+            The key as a hexadecimal string.
+        """
+        from compiler import _which_compiler
+
+        h = hashlib.sha1()
+        h.update(repr((pym.__version__, class_name,
+                       _which_compiler(file_name, compiler), target,
+                       str(version), platform,
+                       sorted(compiler_options.items()))))
+
+        # A compile_to file name renames the unit
+        if os.path.isdir(compile_to):
+            h.update('\0dir')
+        else:
+            h.update('\0' + os.path.basename(compile_to))
+
+        for path in file_name:
+            h.update('\0' + os.path.basename(path))
+            _hash_path(h, path, contents=True)
+
+        for path in pym.environ['MODELICAPATH'].split(os.pathsep) + \
+                pym.environ['COMPILER_JARS'].split(os.pathsep):
+            h.update('\0' + path)
+            _hash_path(h, path, contents=False)
+
+        return h.hexdigest()
+
+    def fetch(self, key, compile_to):
+        """
+        Copy a cached unit to compile_to.
+
+        Parameters::
+
+            key --
+                The cache key, as given by get_key.
+
+            compile_to --
+                The target file or directory, see compile_fmu.
+
+        Returns::
+
+            A CompilerResult for the copied unit, or None if there is no
+            entry for key.
+        """
+        from compiler import CompilerResult
+
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            f = open(os.path.join(entry, _RESULT_FILE), 'rb')
+            try:
+                (unit_name, warnings) = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if os.path.isdir(compile_to):
+            unit = os.path.join(compile_to, unit_name)
+        else:
+            unit = compile_to
+            unit_dir = os.path.dirname(unit)
+            if unit_dir and not os.path.isdir(unit_dir):
+                os.makedirs(unit_dir)
+        try:
+            shutil.copyfile(os.path.join(entry, unit_name), unit)
+        except IOError:
+            # The entry was removed after the result was read
+            return None
+
+        # Mark the entry as recently used
+        os.utime(entry, None)
+        return CompilerResult(unit, warnings)
+
+    def store(self, key, result):
+        """
+        Store a compilation result in the cache. Results without a unit
+        file are not stored.
+
+        Parameters::
+
+            key --
+                The cache key, as given by get_key.
+
+            result --
+                The CompilerResult returned by the compilation.
+        """
+        if not os.path.isfile(result):
+            return
+
+        # Write the entry to a temporary directory and move it in place, so
+        # that concurrent compilations never see incomplete entries
+        tmp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            unit_name = os.path.basename(result)
+            shutil.copyfile(result, os.path.join(tmp_entry, unit_name))
+            f = open(os.path.join(tmp_entry, _RESULT_FILE), 'wb')
+            try:
+                pickle.dump((unit_name, result.get_warnings()), f,
+                            pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp_entry, os.path.join(self.cache_dir, key))
+        except OSError:
+            # Stored by a concurrent compilation
+            pass
+        finally:
+            if os.path.exists(tmp_entry):
+                shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self._evict()
+
+    def remove(self, key):
+        """
+        Remove the entry for key from the cache, if it exists.
+        """
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def clear(self):
+        """
+        Remove all entries from the cache.
+        """
+        for key in self._get_keys():
+            self.remove(key)
+
+    def get_size(self):
+        """
+        Returns the total size in bytes of the cached entries.
+        """
+        return sum([size for (_, size, _) in self._get_entries()])
+
+    def _get_keys(self):
+        return [name for name in os.listdir(self.cache_dir)
+                if not name.startswith('.')]
+
+    def _get_entries(self):
+        """
+        Returns a list of (key, size, last use time) for all entries.
+        """
+        entries = []
+        for key in self._get_keys():
+            entry = os.path.join(self.cache_dir, key)
+            try:
+                size = sum([os.path.getsize(os.path.join(entry, name))
+                            for name in os.listdir(entry)])
+                entries.append((key, size, os.path.getmtime(entry)))
+            except OSError:
+                # Removed concurrently
+                pass
+        return entries
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_size.
+        """
+        entries = self._get_entries()
+        size = sum([entry_size for (_, entry_size, _) in entries])
+        for (key, entry_size, _) in sorted(entries, key=lambda e: e[2]):
+            if size <= self.max_size:
+                break
+            self.remove(key)
+            size -= entry_size
+
+def _hash_path(h, path, contents):
+    """
+    Update the hash h with a file or all files in a directory. If contents is
+    True, the file contents are hashed, otherwise only the file sizes and
+    modification times.
+    """
+    if os.path.isfile(path):
+        _hash_file(h, path, contents)
+    elif os.path.isdir(path):
+        for (dir_path, dir_names, file_names) in os.walk(path):
+            dir_names.sort()
+            for name in sorted(file_names):
+                file_path = os.path.join(dir_path, name)
+                h.update('\0' + os.path.relpath(file_path, path))
+                _hash_file(h, file_path, contents)
+    else:
+        h.update('\0missing')
+
+def _hash_file(h, path, contents):
+    if contents:
+        f = open(path, 'rb')
+        try:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                h.update(block)
+        finally:
+            f.close()
+    else:
+        stat = os.stat(path)
+        h.update('\0%d:%r' % (stat.st_size, stat.st_mtime))
@@ -26,9 +26,13 @@ import sys
 import platform as plt
 import logging
 from subprocess import Popen, PIPE
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from compiler_logging import CompilerLogHandler
 from compiler_exceptions import JError
 from compiler_exceptions import IllegalCompilerArgumentError
+from compilation_cache import CompilationCache
+from compiler_server import get_compiler_server
 
 import pymodelica as pym
 from pymodelica.common import xmlparser
@@ -37,7 +41,8 @@ from pymodelica.common.core import get_unit_name, list_to_string
 
 def compile_fmu(class_name, file_name=[], compiler='auto', target='me', version='2.0', 
                 platform='auto', compiler_options={}, compile_to='.', 
-                compiler_log_level='warning', separate_process=True, jvm_args=''):
+                compiler_log_level='warning', separate_process=True, jvm_args='',
+                cache=False, compiler_server=False):
     """ 
     Compile a Modelica model to an FMU.
     
@@ -127,7 +132,23 @@ def compile_fmu(class_name, file_name=[], compiler='auto', target='me', version=
             String of arguments to be passed to the JVM when compiling in a 
             separate process.
             Default: Empty string
-            
+
+        cache --
+            Reuse the result of an earlier compilation with identical model
+            files, compiler options and arguments. If True, the default
+            CompilationCache is used, see pymodelica.compilation_cache. A
+            CompilationCache instance may also be given, e.g. to use another
+            cache directory or size limit. Call clear() on the cache to
+            invalidate it.
+            Default: False
+
+        compiler_server --
+            Run the compilation in a long-lived compiler process instead of
+            starting a new one, see pymodelica.compiler_server. The server is
+            started on first use, one for each combination of compiler, JVM
+            arguments and working directory. Only used if separate_process is
+            True.
+            Default: False
             
     Returns::
     
@@ -143,11 +164,11 @@ def compile_fmu(class_name, file_name=[], compiler='auto', target='me', version=
         raise IllegalCompilerArgumentError("Unknown target '" + target + "'. Use 'me', 'cs' or 'me+cs' to compile an FMU.")
     return _compile_unit(class_name, file_name, compiler, target, version,
                 platform, compiler_options, compile_to, compiler_log_level,
-                separate_process, jvm_args)       
+                separate_process, jvm_args, cache, compiler_server)       
 
 def compile_fmux(class_name, file_name=[], compiler='auto', compiler_options={}, 
                  compile_to='.', compiler_log_level='warning', separate_process=True,
-                 jvm_args=''):
+                 jvm_args='', cache=False, compiler_server=False):
     """ 
     Compile a Modelica model to an FMUX.
     
@@ -208,6 +229,23 @@ def compile_fmux(class_name, file_name=[], compiler='auto', compiler_options={},
             String of arguments to be passed to the JVM when compiling in a 
             separate process.
             Default: Empty string
+
+        cache --
+            Reuse the result of an earlier compilation with identical model
+            files, compiler options and arguments. If True, the default
+            CompilationCache is used, see pymodelica.compilation_cache. A
+            CompilationCache instance may also be given, e.g. to use another
+            cache directory or size limit. Call clear() on the cache to
+            invalidate it.
+            Default: False
+
+        compiler_server --
+            Run the compilation in a long-lived compiler process instead of
+            starting a new one, see pymodelica.compiler_server. The server is
+            started on first use, one for each combination of compiler, JVM
+            arguments and working directory. Only used if separate_process is
+            True.
+            Default: False
             
     Returns::
     
@@ -217,11 +255,74 @@ def compile_fmux(class_name, file_name=[], compiler='auto', compiler_options={},
     """
     return _compile_unit(class_name, file_name, compiler, 'fmux', None, 'auto',
                 compiler_options, compile_to, compiler_log_level,
-                separate_process, jvm_args)
+                separate_process, jvm_args, cache, compiler_server)
+
+def compile_many(jobs, max_workers=None):
+    """
+    Compile several models concurrently. Each compilation is run in a separate 
+    process, the jobs are dispatched to them from a pool of threads.
+    
+    Parameters::
+    
+        jobs --
+            A list of compilation jobs. Each job is a dict with keyword 
+            arguments to compile_fmu, or to compile_fmux if the value of 
+            'target' is 'fmux'. The argument separate_process is always True.
+            Jobs compiling the same model should use different compile_to 
+            values.
+            
+        max_workers --
+            The maximum number of compilations that run at the same time.
+            Default: None (the number of CPUs)
+            
+    Returns::
+    
+        An iterator over (job_index, result) tuples, in the order that the 
+        jobs complete. The result is the CompilerResult of the job, or the 
+        exception it raised. A CompilerError contains the errors and warnings
+        of the compilation.
+    
+    Example::
+    
+        jobs = [{'class_name': 'M', 'file_name': 'M.mo', 
+                 'compiler_options': {'generate_ode_jacobian': g}, 
+                 'compile_to': 'M_%d.fmu' % i} 
+                for (i, g) in enumerate([False, True])]
+        for (i, result) in compile_many(jobs):
+            if isinstance(result, Exception):
+                print "Job %d failed: %s" % (i, result)
+    """
+    if max_workers is None:
+        max_workers = cpu_count()
+    pool = ThreadPool(max(1, min(max_workers, len(jobs))))
+    try:
+        for res in pool.imap_unordered(_compile_job, enumerate(jobs)):
+            yield res
+    finally:
+        pool.terminate()
+
+def _compile_job(indexed_job):
+    """
+    Helper function for compile_many, runs one job and returns the result or
+    the exception raised.
+    """
+    (index, job) = indexed_job
+    kwargs = dict(job)
+    kwargs['separate_process'] = True
+    # The options are modified by the compile functions and may be shared
+    kwargs['compiler_options'] = dict(kwargs.get('compiler_options', {}))
+    try:
+        if kwargs.get('target') == 'fmux':
+            del kwargs['target']
+            return (index, compile_fmux(**kwargs))
+        else:
+            return (index, compile_fmu(**kwargs))
+    except Exception, e:
+        return (index, e)
 
 def _compile_unit(class_name, file_name, compiler, target, version,
                 platform, compiler_options, compile_to, compiler_log_level,
-                separate_process, jvm_args):
+                separate_process, jvm_args, cache=False, compiler_server=False):
     """
     Helper function for compile_fmu and compile_fmux.
     """
@@ -234,6 +335,21 @@ def _compile_unit(class_name, file_name, compiler, target, version,
         
     if platform == 'auto':
         platform = _get_platform()
+    
+    if cache:
+        if not isinstance(cache, CompilationCache):
+            cache = CompilationCache()
+        key = cache.get_key(class_name, file_name, compiler, target, version,
+                            platform, compiler_options, compile_to)
+        result = cache.fetch(key, compile_to)
+        if result is None:
+            result = _compile_unit(class_name, file_name, compiler, target,
+                                   version, platform, compiler_options,
+                                   compile_to, compiler_log_level,
+                                   separate_process, jvm_args,
+                                   compiler_server=compiler_server)
+            cache.store(key, result)
+        return result
         
     if not separate_process:
         # get a compiler based on 'compiler' argument or files listed in file_name
@@ -252,11 +368,12 @@ def _compile_unit(class_name, file_name, compiler, target, version,
 
     else:
         return compile_separate_process(class_name, file_name, compiler, target, version, platform, 
-                                        compiler_options, compile_to, compiler_log_level, jvm_args)
+                                        compiler_options, compile_to, compiler_log_level, jvm_args,
+                                        compiler_server)
 
 def compile_separate_process(class_name, file_name=[], compiler='auto', target='me', version='1.0', 
                              platform='auto', compiler_options={}, compile_to='.', 
-                             compiler_log_level='warning', jvm_args=''):
+                             compiler_log_level='warning', jvm_args='', compiler_server=False):
     """
     Compile model in separate process.
     Requires environment variable SEPARATE_PROCESS_JVM to be set, otherwise defaults
@@ -321,24 +438,27 @@ def compile_separate_process(class_name, file_name=[], compiler='auto', target='
             separate process.
             Default: Empty string
         
+        compiler_server --
+            Run the compilation in a long-lived compiler process instead of
+            starting a new one, see pymodelica.compiler_server. The server is
+            started on first use, one for each combination of compiler, JVM
+            arguments and working directory.
+            Default: False
+        
     Returns::
         A CompilerResult object with the name of the generated unit (or 'None' if no unit was generated) 
         and a list of warnings given by the compiler.
     """
-    cmd = []
-    
-    cmd.append(_get_separate_JVM())
-    
-    cmd.append('-cp')
-    cmd.append(pym.environ['COMPILER_JARS'] + os.pathsep + os.path.join(pym.environ['BEAVER_PATH'],'beaver-rt.jar'))
-    
-    for jvm_arg in pym.environ['JVM_ARGS'].split() + jvm_args.split():
-        cmd.append(jvm_arg)
+    java = _get_separate_JVM()
+    class_path = pym.environ['COMPILER_JARS'] + os.pathsep + os.path.join(pym.environ['BEAVER_PATH'],'beaver-rt.jar')
+    jvm_args = pym.environ['JVM_ARGS'].split() + jvm_args.split()
         
     if _which_compiler(file_name, compiler) is 'MODELICA':
-        cmd.append(pym._modelica_class)
+        compiler_class = pym._modelica_class
     else: 
-        cmd.append(pym._optimica_class)
+        compiler_class = pym._optimica_class
+    
+    cmd = []
     
     cmd.append('-log=' + _gen_log_level(compiler_log_level))
     
@@ -362,6 +482,11 @@ def compile_separate_process(class_name, file_name=[], compiler='auto', target='
     
     cmd.append(class_name)
     
+    if compiler_server:
+        server = get_compiler_server(java, class_path, jvm_args, compiler_class)
+        return server.compile(cmd)
+    
+    cmd = [java, '-cp', class_path] + jvm_args + [compiler_class] + cmd
     process = Popen(cmd, stderr=PIPE)
     log = CompilerLogHandler()
     log.start(process.stderr);
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright (C) 2014 Modelon AB
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Module for compiling models in a long-lived compiler process, which avoids the
+JVM start-up and class loading that a new separate process pays for each
+compilation.
+"""
+
+import os
+import socket
+import atexit
+import threading
+from subprocess import Popen, PIPE
+
+from compiler_logging import CompilerLogHandler
+from compiler_exceptions import JError
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+class CompilerServer(object):
+    """
+    A compiler process that compiles one model at a time, given the same
+    command line arguments as the compiler executable. The process is started
+    in the current working directory, relative paths in the arguments are
+    resolved against it.
+    """
+
+    def __init__(self, java, class_path, jvm_args, compiler_class):
+        """
+        Start a compiler server.
+
+        Parameters::
+
+            java --
+                Path to the Java executable.
+
+            class_path --
+                The class path of the compiler.
+
+            jvm_args --
+                List of arguments to the JVM.
+
+            compiler_class --
+                The fully qualified name of the compiler class, e.g.
+                pymodelica._modelica_class.
+        """
+        package = compiler_class.rsplit('.', 1)[0]
+        cmd = [java, '-cp', class_path] + jvm_args + \
+              [package + '.ModelicaCompiler$CompilerServer', compiler_class]
+        self._process = Popen(cmd, stdin=PIPE, stdout=PIPE)
+        handshake = self._process.stdout.readline().split()
+        if len(handshake) != 2:
+            self._process.wait()
+            raise JError("Unable to start the compiler server, exit code %s."
+                         % self._process.returncode)
+        self._port = int(handshake[0])
+        self._token = handshake[1]
+        self._lock = threading.Lock()
+
+    def compile(self, args):
+        """
+        Compile a model.
+
+        Parameters::
+
+            args --
+                The compiler arguments, see compile_separate_process.
+
+        Returns::
+
+            A CompilerResult object with the name of the generated unit (or
+            'None' if no unit was generated) and a list of warnings given by
+            the compiler.
+        """
+        # The server compiles one model at a time, so there is nothing to
+        # gain from having several connections waiting
+        self._lock.acquire()
+        try:
+            connection = socket.create_connection(('127.0.0.1', self._port))
+            try:
+                request = '\n'.join([self._token] + args) + '\n\n'
+                connection.sendall(request.encode('utf-8'))
+                connection.shutdown(socket.SHUT_WR)
+                # The log is sent back until the compilation is done
+                log = CompilerLogHandler()
+                log.start(connection.makefile('rb'))
+                return log.end()
+            finally:
+                connection.close()
+        finally:
+            self._lock.release()
+
+    def is_alive(self):
+        """
+        Returns True if the server process is running.
+        """
+        return self._process.poll() is None
+
+    def shutdown(self):
+        """
+        Stop the server process. A compilation in progress is aborted.
+        """
+        if self.is_alive():
+            self._process.stdin.close()
+            self._process.wait()
+
+def get_compiler_server(java, class_path, jvm_args, compiler_class):
+    """
+    Get a running compiler server for the given JVM and compiler, and the
+    current working directory. A new server is started if needed. See
+    CompilerServer for a description of the parameters.
+    """
+    key = (java, class_path, tuple(jvm_args), compiler_class, os.getcwd())
+    _servers_lock.acquire()
+    try:
+        server = _servers.get(key)
+        if server is None or not server.is_alive():
+            server = CompilerServer(java, class_path, jvm_args, compiler_class)
+            _servers[key] = server
+        return server
+    finally:
+        _servers_lock.release()
+
+def shutdown_compiler_servers():
+    """
+    Stop all compiler servers started by this process. Servers that are
+    needed again are restarted.
+    """
+    _servers_lock.acquire()
+    try:
+        for server in _servers.values():
+            server.shutdown()
+        _servers.clear()
+    finally:
+        _servers_lock.release()
+
+atexit.register(shutdown_compiler_servers)
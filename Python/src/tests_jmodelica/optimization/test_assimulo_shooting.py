@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014 Modelon AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests the multiple shooting in assimulo_shooting. """
+
+import numpy as N
+
+from tests_jmodelica import testattr
+from pyjmi.optimization.assimulo_shooting import Multiple_Shooting
+
+class LinearModel(object):
+    """
+    Model with the states y1 and y2 and the input u, where
+    dy1/dt = -y1 + u, dy2/dt = y1**2 + u**2 and the cost is y2 + y1**2 at
+    the final time.
+    """
+
+    def __init__(self):
+        self.real_u = N.array([0.])
+        self.real_x = N.array([1., 0.])
+        self.real_dx = N.zeros(2)
+        self._x_p = None
+
+    def opt_interval_get_start_time(self):
+        return 0.
+
+    def opt_interval_get_final_time(self):
+        return 2.
+
+    def set_real_x_p(self, x, i):
+        self._x_p = N.array(x, dtype=float)
+
+    def set_real_dx_p(self, dx, i):
+        pass
+
+    def set_real_u_p(self, u, i):
+        pass
+
+    def opt_eval_J(self):
+        return self._x_p[1] + self._x_p[0]**2
+
+class Problem(object):
+    pass
+
+class LinearSimulator(object):
+    """
+    Simulator of LinearModel, using the analytic solution.
+    """
+
+    def __init__(self, model):
+        self._problem = Problem()
+        self._problem._model = model
+        self.nbr_calls = 0
+        self.reset()
+
+    def reset(self):
+        self.t = 0.
+        self.y = N.array([1., 0.])
+
+    def re_init(self, t, y):
+        self.t = t
+        self.y = N.array(y, dtype=float).flatten()
+
+    def __call__(self, final_time, ncp=0):
+        self.nbr_calls += 1
+        u = float(N.array(self._problem._model.real_u).flatten()[0])
+        T = final_time - self.t
+        a = self.y[0] - u
+        y1 = u + a*N.exp(-T)
+        y2 = (self.y[1] + 2.*u**2*T + 2.*u*a*(1. - N.exp(-T)) +
+              a**2*(1. - N.exp(-2.*T))/2.)
+        self.t = final_time
+        self.y = N.array([y1, y2])
+        return [N.array([final_time]), N.array([self.y])]
+
+def create_shooting(processes):
+    model = LinearModel()
+    return Multiple_Shooting(LinearSimulator(model), 3, [0.5],
+                             processes=processes)
+
+def central_differences(fcn, p, step=1e-6):
+    """Jacobian of fcn at p by central differences."""
+    columns = []
+    for j in range(len(p)):
+        p_plus = p.copy()
+        p_plus[j] += step
+        p_minus = p.copy()
+        p_minus[j] -= step
+        columns.append((N.atleast_1d(fcn(p_plus)) -
+                        N.atleast_1d(fcn(p_minus)))/(2.*step))
+    return N.array(columns).T
+
+class TestMultipleShooting:
+    """ Tests the cost, constraints and derivatives of Multiple_Shooting. """
+
+    def setUp(self):
+        shooting = create_shooting(1)
+        p0 = shooting.get_p0()
+        self.p = p0 + 0.1*N.sin(N.arange(1., len(p0) + 1.))
+
+    @testattr(stddist_base = True)
+    def test_derivatives(self):
+        """ Compare df and dh with differences of f and h. """
+        shooting = create_shooting(1)
+        p = self.p
+
+        N.testing.assert_allclose(shooting.df(p),
+                                  central_differences(shooting.f, p)[0],
+                                  rtol=1e-3, atol=1e-4)
+        N.testing.assert_allclose(shooting.dh(p),
+                                  central_differences(shooting.h, p),
+                                  rtol=1e-3, atol=1e-4)
+
+    @testattr(stddist_base = True)
+    def test_segment_cache(self):
+        """ Test that the segments are integrated once per point. """
+        shooting = create_shooting(1)
+        p = self.p
+
+        shooting.dh(p)
+        nbr_calls = shooting.simulator.nbr_calls
+        shooting.h(p)
+        shooting.f(p)
+        shooting.df(p)
+        assert shooting.simulator.nbr_calls == nbr_calls
+
+        # Without sensitivities, a new point needs one call per segment
+        shooting.f(p + 1e-3)
+        assert shooting.simulator.nbr_calls == nbr_calls + 3
+
+    @testattr(stddist_base = True)
+    def test_processes(self):
+        """ Test that concurrent integration gives identical results. """
+        p = self.p
+        results = []
+        for processes in [1, 2]:
+            shooting = create_shooting(processes)
+            try:
+                results.append((shooting.f(p), shooting.h(p),
+                                shooting.df(p), shooting.dh(p)))
+            finally:
+                shooting.close_pool()
+        for (serial, concurrent) in zip(*results):
+            N.testing.assert_array_equal(serial, concurrent)
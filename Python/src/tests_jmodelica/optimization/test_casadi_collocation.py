@@ -382,6 +382,53 @@ class TestLocalDAECollocator(object):
         N.testing.assert_allclose(xx_init[col.var_indices[vt][ind]], 300.,
                                   rtol=1e-4)
 
+    @testattr(casadi_base = True)
+    def test_interpolate_columns(self):
+        """Test batched sampling of trajectories against N.interp."""
+        from pyjmi.optimization.casadi_collocation import _interpolate_columns
+        abscissae = N.array([0., 1., 1., 2.5, 4., 4.])
+        ordinates = N.array([[0., 1., 5., 2., 3., 7.],
+                             [1., -1., 0., 0., 2., 2.]]).T
+        t = N.array([-1., 0., 0.5, 1., 1.2, 2.5, 3., 4., 5.])
+        values = _interpolate_columns(abscissae, ordinates, t)
+        for j in xrange(ordinates.shape[1]):
+            N.testing.assert_allclose(values[:, j],
+                                      N.interp(t, abscissae, ordinates[:, j]))
+        
+        # Constant trajectories
+        N.testing.assert_allclose(_interpolate_columns([0.], [[3., 4.]], t),
+                                  N.tile([3., 4.], (len(t), 1)))
+
+    @testattr(casadi_base = True)
+    def test_estimate_condition_number(self):
+        """Test sparse condition number estimates."""
+        import scipy.sparse
+        from pyjmi.optimization.casadi_collocation import \
+             _estimate_condition_number
+        n = 300
+        s = N.linspace(1., 1e3, n)
+        
+        # Square
+        A = scipy.sparse.diags([s], [0], format='csc')
+        N.testing.assert_allclose(_estimate_condition_number(A), 1e3)
+        
+        # Rectangular
+        J = scipy.sparse.hstack([A, scipy.sparse.csc_matrix((n, 10))])
+        N.testing.assert_allclose(_estimate_condition_number(J), 1e3,
+                                  rtol=1e-6)
+        N.testing.assert_allclose(_estimate_condition_number(J.T), 1e3,
+                                  rtol=1e-6)
+        
+        # Singular
+        A = A.tolil()
+        A[0, 0] = 0.
+        assert _estimate_condition_number(A) == N.inf
+        
+        # Small matrices are handled densely
+        B = N.array([[1., 2.], [3., 4.]])
+        N.testing.assert_allclose(_estimate_condition_number(B),
+                                  N.linalg.cond(B))
+
     @testattr(casadi_base = True)
     def test_init_dual(self):
         """Test initializing dual variables."""
@@ -899,6 +946,40 @@ class TestLocalDAECollocator(object):
         res = lagrange_op.optimize(self.algorithm, opts)
         assert_results(res, cost_ref, u_norm_ref, u_norm_rtol=5e-3)
         
+    @testattr(casadi_base = True)
+    def test_result_file_format(self):
+        """
+        Test that the binary and textual result files contain the same result.
+        """
+        op = self.cstr_lagrange_op
+        
+        # References values
+        cost_ref = 1.8576873858261e3
+        u_norm_ref = 3.050971000653911e2
+        
+        opts = self.optimize_options(op, self.algorithm)
+        opts['result_file_name'] = "CSTR_result_format.txt"
+        res_txt = op.optimize(self.algorithm, opts)
+        
+        opts['result_file_name'] = "CSTR_result_format.mat"
+        opts['result_file_format'] = "mat"
+        res_mat = op.optimize(self.algorithm, opts)
+        assert_results(res_mat, cost_ref, u_norm_ref, u_norm_rtol=5e-3)
+        nose.tools.assert_true(os.path.getsize("CSTR_result_format.mat") <
+                               os.path.getsize("CSTR_result_format.txt"))
+        
+        raw = loadmat("CSTR_result_format.mat", chars_as_strings=False)
+        nose.tools.assert_equal(raw['data_2'].shape[1], len(res_txt['time']))
+        for name in ['time', 'cstr.c', 'cstr.T', 'u', 'cstr.Tc', 'cstr.F0']:
+            N.testing.assert_allclose(res_mat[name], res_txt[name], 
+                                      rtol=1e-12)
+        
+        # The reader is chosen from the format, not the file extension
+        opts['result_file_name'] = "CSTR_result_format_mat.txt"
+        res_mat = op.optimize(self.algorithm, opts)
+        N.testing.assert_allclose(res_mat['cstr.T'], res_txt['cstr.T'], 
+                                  rtol=1e-12)
+        
     @testattr(casadi_base = True)
     def test_cstr_checkpoint(self):
         """
@@ -1610,6 +1691,42 @@ class TestLocalDAECollocator(object):
         res = op.optimize(self.algorithm, opts)
         assert_results(res, cost_ref, u_norm_ref, u_norm_rtol=3e-2)
 
+    @testattr(casadi_base = True)
+    def test_mesh_refinement(self):
+        """Test adaptive mesh refinement."""
+        op = self.vdp_bounds_lagrange_op
+        
+        # References values
+        cost_ref = 3.3821187315826737e0
+        
+        # Refine a coarse mesh
+        opts = self.optimize_options(op, self.algorithm)
+        opts['n_e'] = 5
+        opts['mesh_refinement'] = MeshRefinementData(tol=1e-4, max_iter=5)
+        res = op.optimize(self.algorithm, opts)
+        cost = float(res.solver.solver_object.output(casadi.NLP_SOLVER_F))
+        N.testing.assert_allclose(cost, cost_ref, 1e-3)
+        nose.tools.assert_true(res.solver.n_e > 5)
+        nose.tools.assert_almost_equal(N.sum(res.solver.h[1:]), 1.)
+        errors = res.solver.get_element_errors()
+        nose.tools.assert_equal(len(errors), res.solver.n_e)
+        
+        # Splitting and merging of elements
+        data = MeshRefinementData(tol=1e-4, max_split=4)
+        h = N.array([0.25, 0.25, 0.25, 0.25])
+        nose.tools.assert_true(data.refine(h, N.ones(4) * 1e-5, 3) is None)
+        h_new = data.refine(h, N.array([1e-2, 1e-10, 1e-10, 1e-3]), 3)
+        N.testing.assert_allclose(
+                h_new, [0.0625] * 4 + [0.5] + [0.125] * 2)
+        data.max_n_e = 5
+        nose.tools.assert_true(
+                data.refine(h, N.array([1e-2, 1e-10, 1e-10, 1e-3]), 3) is None)
+
+        # Incompatible options
+        opts['blocking_factors'] = [1] * opts['n_e']
+        nose.tools.assert_raises(NotImplementedError, op.optimize,
+                                 self.algorithm, opts)
+
     @testattr(casadi_base = True)
     def test_named_vars(self):
         """
@@ -2098,6 +2215,27 @@ class TestLocalDAECollocator(object):
         N.testing.assert_array_less([total_exec_time, -total_exec_time],
                                     [1., 0.])
 
+    @testattr(casadi_base = True)
+    def test_profile(self):
+        """
+        Test the profile of the algorithm phases.
+        """
+        op = self.vdp_bounds_mayer_op
+        
+        res = op.optimize()
+        phases = res.profile['phases']
+        for phase in ['create_model_variable_structures',
+                      'create_nlp_variables', 'define_l0_functions',
+                      'call_functions', 'create_constraints_and_cost',
+                      'compute_bounds_and_init', 'create_solver', 'solve_nlp',
+                      'get_result', 'export_result']:
+            assert phases[phase]['calls'] >= 1
+            assert phases[phase]['time'] >= 0.
+        assert (phases['create_constraints_and_cost']['time'] >=
+                phases['call_functions']['time'])
+        assert res.profile['nlp_solver']['t_mainloop'] > 0.
+        res.print_profile()
+
     @testattr(casadi_base = True)
     def test_input_interpolator(self):
         """
@@ -2164,6 +2302,14 @@ class TestLocalDAECollocator(object):
         KKT_opt_cond = N.linalg.cond(KKT_opt)
         N.testing.assert_allclose(KKT_opt_cond, 9.705e9, rtol=1e-2) #9.705e11 #1.18e10
 
+        # Sparse matrices
+        N.testing.assert_allclose(res.solver.get_J("opt", dense=False).toarray(),
+                                  J_opt)
+        N.testing.assert_allclose(res.solver.get_H("opt", dense=False).toarray(),
+                                  H_opt)
+        N.testing.assert_allclose(
+                res.solver.get_KKT("opt", dense=False).toarray(), KKT_opt)
+
         # Obtain symbolic matrices and matrix functions
         res.solver.get_J("sym")
         res.solver.get_J("fcn")
@@ -21,10 +21,13 @@ OptimizationSolver.
 """
 
 import os
+import shutil
+import tempfile
 import numpy as N
 from tests_jmodelica import testattr, get_files_path
 try:
     from pyjmi import transfer_optimization_problem
+    from pyjmi.optimization.casadi_collocation import _compile_sources
 except (NameError, ImportError):
     pass
 
@@ -80,3 +83,44 @@ def test_code_gen():
     # Check that all solvers gave the same result
     assert result_distance(res0, res1, var_names) < 1e-6
     assert result_distance(res0, res2, var_names) < 1e-6
+
+@testattr(casadi_base = True)
+def test_code_gen_stale():
+    var_names = ('x1', 'x2', 'u')
+    if os.name == 'nt':
+        ext = '.dll'
+    else:
+        ext = '.so'
+    
+    file_path = os.path.join(get_files_path(), 'Modelica', 'VDP.mop')
+    op = transfer_optimization_problem("VDP_pack.VDP_Opt2", file_path)
+    
+    opt_opts = op.optimize_options()
+    solver1 = op.prepare_optimization(options = opt_opts)
+    solver1.enable_codegen('test_stale', opt_level=0)
+    code = open('nlp_test_stale.c').read()
+    
+    # A different discretization with the same name must not reuse the code
+    opt_opts['n_e'] = 20
+    res0 = op.optimize(options = opt_opts)
+    solver2 = op.prepare_optimization(options = opt_opts)
+    solver2.enable_codegen('test_stale', opt_level=0)
+    assert open('nlp_test_stale.c').read() != code
+    assert (os.path.getmtime('nlp_test_stale' + ext) >=
+            os.path.getmtime('nlp_test_stale.c'))
+    
+    res2 = solver2.optimize()
+    assert result_distance(res0, res2, var_names) < 1e-6
+
+@testattr(casadi_base = True)
+def test_compile_without_gcc():
+    # A compiler that cannot be started is a failed compilation, so that the
+    # uncompiled functions are used
+    empty_dir = tempfile.mkdtemp()
+    old_path = os.environ.get('PATH', '')
+    os.environ['PATH'] = empty_dir
+    try:
+        assert _compile_sources(['nlp_test_no_gcc']) == [False]
+    finally:
+        os.environ['PATH'] = old_path
+        shutil.rmtree(empty_dir)
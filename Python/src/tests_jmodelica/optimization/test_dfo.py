@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014 Modelon AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests the function evaluations in separate processes used by dfo. """
+
+import os
+import shutil
+import tempfile
+
+import numpy as N
+
+from tests_jmodelica import testattr
+from pyjmi.optimization import dfo
+from pyjmi.optimization.thread_feval import FevalPool
+
+# Cost function file, which records the process id each time it is loaded
+cost_file = """
+import os
+_log = open(%r, 'a')
+_log.write('%%d\\n' %% os.getpid())
+_log.close()
+
+def quad(x):
+    return (x[0] - 1.)**2 + 2.*(x[1] + 0.5)**2 + 0.5*x[0]*x[1]
+"""
+
+class TestFevalPool:
+    """ Tests FevalPool and its use in dfo. """
+
+    def setUp(self):
+        self.curr_dir = os.getcwd()
+        self.tmp_dir = tempfile.mkdtemp()
+        os.chdir(self.tmp_dir)
+        self.log_file = os.path.join(self.tmp_dir, 'loads.txt')
+        f = open('quad.py', 'w')
+        f.write(cost_file % self.log_file)
+        f.close()
+        self.xstart = N.array([-1., 1.])
+
+    def tearDown(self):
+        os.chdir(self.curr_dir)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _get_loads(self):
+        f = open(self.log_file)
+        pids = [int(l) for l in f]
+        f.close()
+        return pids
+
+    @testattr(stddist_base = True)
+    def test_nelme_pool(self):
+        """ Test that nelme gives the same optimum with a FevalPool. """
+        (x_ref, f_ref, iters_ref, fevals_ref, _) = dfo.nelme(
+            'quad.py', self.xstart, disp=False, nbr_cores=2)
+        os.remove(self.log_file)
+
+        with FevalPool('quad.py', nbr_cores=2) as pool:
+            (x_opt, f_opt, iters, fevals, _) = dfo.nelme(
+                pool, self.xstart, disp=False)
+
+        N.testing.assert_allclose(x_opt, x_ref, 1e-12)
+        N.testing.assert_allclose(f_opt, f_ref, 1e-12)
+        assert iters == iters_ref
+        assert fevals == fevals_ref
+
+        # The function file is loaded exactly once in each of the workers
+        pids = self._get_loads()
+        assert len(pids) == 2
+        assert len(set(pids)) == 2
+
+    @testattr(stddist_base = True)
+    def test_fmin_pool(self):
+        """ Test fmin with the Nelder-Mead method and a FevalPool. """
+        with FevalPool('quad.py', nbr_cores=2) as pool:
+            # nelme stops at the first of the x and f tests, so f_tol
+            # determines the accuracy of x_opt
+            (x_opt, f_opt, _, _, _) = dfo.fmin(pool, xstart=self.xstart,
+                                               alg=1, f_tol=1e-12,
+                                               disp=False)
+
+            # Single and multiple point evaluations
+            N.testing.assert_allclose(pool(N.array([1., -0.5])), -0.25)
+            N.testing.assert_allclose(pool(N.array([[1., -0.5], [0., 0.]])),
+                                      [-0.25, 1.5])
+
+        # The analytic optimum solves the stationarity conditions
+        x_exact = N.linalg.solve([[2., 0.5], [0.5, 4.]], [2., -2.])
+        N.testing.assert_allclose(x_opt, x_exact, atol=1e-4)
+        assert len(self._get_loads()) == 2
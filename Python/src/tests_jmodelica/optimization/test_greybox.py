@@ -314,6 +314,53 @@ def test_compare():
     assert identification.calculate_risk(identification.get_cost()-idObj1.get_cost(),1,2) == result[0]['risk'] 
     
 
+@testattr(casadi_base = True)
+def test_search():
+    # Locate the model and file paths 
+    file_path = os.path.join(get_files_path(),'Modelica',"DrumBoiler.mo")
+    modelPath = "DrumBoiler"
+
+    # Load measurement data
+    RCdata = get_test_data()
+    measurements = RCdata['measurements'] 
+    time = RCdata['time'] 
+
+    # Extract control signal data from measurements
+    inputs={}
+    inputs['uc']= measurements.pop('uc')
+    inputs['fc']= measurements.pop('fc')
+
+    # Transfer model to Casadi interface
+    op = transfer_optimization_problem(modelPath, file_path, accept_model=True )
+    op_opts = op.optimize_options()
+
+    # Create greybox object
+    GB = GreyBox(op, op_opts, measurements, inputs, time)
+    
+    # Set some variable attributes
+    GB.set_variable_attribute(GB.get_noise_covariance_variable('E'), 'max', 100)
+    GB.set_variable_attribute(GB.get_noise_covariance_variable('P'), 'max', 100)
+    GB.set_variable_attribute('x10', 'initialGuess', 148)
+    GB.set_variable_attribute('x20', 'initialGuess', 27.5)
+    
+    # Optimize null model
+    nullModelFree = set(['GreyBox_r_E', 'GreyBox_r_P', 'x10', 'x20'])
+    identification = GB.identify(nullModelFree)
+    
+    # Search forward among 'TD' and 'A4' in two processes
+    (best, results) = GB.search(['TD', 'A4'], base=identification, processes=2)
+    
+    # assert the first step, which releases each candidate on the null model
+    N.testing.assert_allclose(results[0]['cost'], 5466.596970228651, 1e-3)
+    N.testing.assert_allclose(results[1]['cost'], 5630.90033894926, 1e-3)
+    assert results[0]['free_parameters'] == nullModelFree.union(['TD'])
+    assert not results[0]['pruned']
+    assert 'TD' in best.free_parameters
+    
+    # assert that the identifications are memoized
+    assert GB.identify(nullModelFree) is identification
+    assert GB.identify(nullModelFree.union(['TD'])) is results[0]['identification']
+
 @testattr(casadi_base = True)
 def test_risk_calculation():
 	
@@ -908,6 +908,55 @@ class TestMHE:
                 #Check that the estimation match the expected values
                 assert(N.abs(x_est_t[name] - res[name][k]) < small) == True
         
+    @testattr(casadi_base = True)
+    def VDP_persistent_nlp_test(self):
+        """
+        Test that reusing the NLP once the horizon is full gives the 
+        same estimates as transcribing it at every sample.
+        """
+        u = {'u': N.array([1., 1.1545085, 1.29389263, 1.4045085, 1.47552826, 
+                           1.5, 1.47552826, 1.4045085, 1.29389263, 1.1545085, 
+                           1.])}
+        y = {'x1': N.array([0.01598902, -0.30140151, -0.15680465, -0.13766548, 
+                            0.16180561, 0.27355275, 0.27159278, -0.23342386, 
+                            -0.07085041, 0.32829822, -0.20349616]),
+             'x2': N.array([1.15809849, 1.22068836, 0.49781333, 1.19490247, 
+                            0.6484263, 0.99125759, 1.13786648, 1.15703321, 
+                            1.5473424, 1.08268968, 1.09604879])}
+        nbr_of_points = 11
+        sample_time = 1.0/(nbr_of_points - 1)
+        horizon = 4
+        MHE_objects = []
+        for persistent in [False, True]:
+            op = transfer_optimization_problem(self.VDP_cpath, 
+                                               self.VDP_fpath, 
+                                               accept_model = True, 
+                                               compiler_options = \
+                                               {"state_initial_equations":True,
+                                                "propagate_derivatives":False})
+            MHE_opts = self.VDP_MHE_opts.copy()
+            MHE_opts['persistent_nlp'] = persistent
+            MHE_objects.append(MHE(op, sample_time, horizon, 
+                                   self.VDP_x_0_guess, self.VDP_dx_0, 
+                                   self.VDP_c_0, MHE_opts))
+        small = 1e-4
+        solver = None
+        for k in range(1, nbr_of_points):
+            y_in = [(name, y[name][k-1]) for name in y.keys()]
+            u_in = [(name, u[name][k-1]) for name in u.keys()]
+            x_est_ref = MHE_objects[0].step(u_in, y_in)
+            x_est = MHE_objects[1].step(u_in, y_in)
+            for name in x_est_ref.keys():
+                assert(N.abs(x_est[name] - x_est_ref[name]) < small) == True
+            #The NLP should only have been created once, when the 
+            #horizon became full
+            if k >= horizon:
+                if solver is None:
+                    solver = MHE_objects[1]._solver
+                assert MHE_objects[1]._solver is solver
+        assert solver is not None
+        assert not MHE_objects[1]._depends_on_time()
+        
     @testattr(casadi_base = True)
     def alg_test(self):
         """
@@ -22,7 +22,7 @@ try:
     from pyjmi import transfer_to_casadi_interface
     from pyjmi.optimization.casadi_collocation import *
     import casadi
-    from pyjmi.optimization.mpc import MPC
+    from pyjmi.optimization.mpc import MPC, _ResultColumns
     from pyjmi.optimization.casadi_collocation import BlockingFactors
 except (NameError, ImportError):
     pass
@@ -457,6 +457,89 @@ class TestMPCClass(object):
         N.testing.assert_equal(sample_period, result2['time'][0])
         N.testing.assert_equal(sample_period*(horizon+1), result2['time'][-1])
 
+    @testattr(casadi_base = True)
+    def test_sample_result_output(self):
+        """
+        Test that the trajectory initial guess gives the same result whether
+        the sample results are kept in memory or written to file.
+        """
+        op = transfer_to_casadi_interface("CSTR.CSTR_MPC", 
+                                        self.cstr_file_path,
+                            compiler_options={"state_initial_equations":True})
+        
+        # Set options collocation
+        n_e = 50
+        opt_opts = op.optimize_options()
+        opt_opts['n_e'] = n_e
+        opt_opts['IPOPT_options']['print_level'] = 0
+          
+        # Define some MPC-options
+        sample_period = 3
+        horizon = 50
+        cvc = {'T': 1e6}
+        
+        inputs = {}
+        for output in ['memory', 'async_file']:
+            op.set('_start_c', float(self.c_0_A))
+            op.set('_start_T', float(self.T_0_A))
+            op.set('startTime', 0.)
+            MPC_object = MPC(op, opt_opts, sample_period, horizon, 
+                             constr_viol_costs=cvc, noise_seed=7,
+                             initial_guess='trajectory',
+                             create_comp_result=False,
+                             sample_result_output=output)
+            inputs[output] = []
+            for k in range(3):
+                MPC_object.update_state()
+                inputs[output].append(MPC_object.sample()[1](0))
+            MPC_object.collocator.wait_for_export()
+        
+        N.testing.assert_allclose(inputs['memory'], inputs['async_file'],
+                                  rtol=1e-8)
+        res = ResultDymolaTextual(op.getIdentifier())
+        N.testing.assert_allclose(res.get_variable_data('time').x[0], 
+                                  2*sample_period)
+
+    @testattr(casadi_base = True)
+    def test_real_time_iteration(self):
+        """
+        Test that the real-time iteration scheme tracks the inputs given by
+        solving the NLP to convergence in each sample.
+        """
+        op = transfer_to_casadi_interface("CSTR.CSTR_MPC", 
+                                        self.cstr_file_path,
+                            compiler_options={"state_initial_equations":True})
+        
+        # Set options collocation
+        n_e = 50
+        opt_opts = op.optimize_options()
+        opt_opts['n_e'] = n_e
+        opt_opts['IPOPT_options']['print_level'] = 0
+          
+        # Define some MPC-options
+        sample_period = 3
+        horizon = 50
+        cvc = {'T': 1e6}
+        states = {'_start_c': float(self.c_0_A), '_start_T': float(self.T_0_A)}
+        
+        inputs = {}
+        for rti in [False, True]:
+            op.set('startTime', 0.)
+            MPC_object = MPC(op, opt_opts, sample_period, horizon, 
+                             constr_viol_costs=cvc, create_comp_result=False)
+            inputs[rti] = []
+            for k in range(4):
+                if rti and k > 0:
+                    MPC_object.prepare()
+                MPC_object.update_state(states)
+                inputs[rti].append(MPC_object.sample()[1](0))
+            if rti:
+                stats = MPC_object.get_solver_stats()[0]
+                nose.tools.assert_equal(stats[-1][0], 'SQP_Step_Computed')
+                nose.tools.assert_equal(stats[-1][1], 1)
+        
+        N.testing.assert_allclose(inputs[True], inputs[False], rtol=1e-2)
+
     #~ @testattr(casadi_base = True)
     #~ def test_set(self):
         #~ """
@@ -780,4 +863,20 @@ class TestMPCClass(object):
         N.testing.assert_array_almost_equal(complete_result['c'],complete_result_elim['c'])
         N.testing.assert_array_almost_equal(complete_result['T'],complete_result_elim['T'])
         N.testing.assert_array_almost_equal(complete_result['Tc'],complete_result_elim['Tc'])
+
+    @testattr(casadi_base = True)
+    def test_result_columns(self):
+        """
+        Test appending rows to the complete result arrays beyond their 
+        initial capacity.
+        """
+        columns = _ResultColumns(3, capacity=4)
+        rows = N.arange(30.).reshape([-1, 3])
+        for k in range(0, 10, 3):
+            columns.append(rows[k:k+3])
+        N.testing.assert_array_equal(columns.get_array(), rows)
+        
+        empty = _ResultColumns(0, capacity=4)
+        empty.append(N.zeros([7, 0]))
+        nose.tools.assert_equal(empty.get_array().shape, (7, 0))
           
@@ -13,6 +13,8 @@ from tests_jmodelica import testattr, get_files_path
 try:
     from pyjmi import transfer_optimization_problem
     from pyjmi.optimization.casadi_collocation import ExternalData
+    from pyjmi.optimization.casadi_collocation import \
+         LocalDAECollocationAlgResult
 except (NameError, ImportError):
     pass
 
@@ -88,6 +90,44 @@ def test_warm_start():
     # Warm starting from the right result should need very few iterations
     assert res2w2.get_solver_statistics()[1] < 4
 
+@testattr(casadi_base = True)
+def test_optimize_scenarios():
+    file_path = os.path.join(get_files_path(), 'Modelica', 'VDP.mop')
+    op = transfer_optimization_problem("VDP_pack.VDP_Opt2", file_path)
+
+    opts = op.optimize_options()
+    var_names = ('x1', 'x2', 'u')
+    p1_values = [1., 1.5, 2., 2.5]
+
+    refs = []
+    for p1 in p1_values:
+        op.set('p1', p1)
+        refs.append(op.optimize(options=opts))
+    op.set('p1', 1.)
+
+    solver = op.prepare_optimization(options=opts)
+    set_warm_start_options(solver, push = 1e-5)
+    scenarios = [{'parameters': {'p1': p1}} for p1 in p1_values]
+    for processes in [1, 2]:
+        results = solver.optimize_scenarios(scenarios, processes=processes)
+        assert len(results) == len(scenarios)
+        for (scenario, result, ref) in zip(scenarios, results, refs):
+            assert result.scenario is scenario
+            assert result.error is None
+            assert result.return_status == 'Solve_Succeeded'
+            res = LocalDAECollocationAlgResult(result_data=result.result_data)
+            assert res.final('p1') == scenario['parameters']['p1']
+            assert result_distance(ref, res, var_names) < 1e-6
+        # The parameter values are not changed
+        assert solver.get('p1') == 1.
+
+    # Failing scenarios are reported
+    data = N.vstack([[0, 20], [0, 1]])
+    results = solver.optimize_scenarios([{'external_data': {'x1': data}}],
+                                        processes=1)
+    assert results[0].result_data is None
+    assert results[0].error is not None
+
 @testattr(casadi_base = True)
 def test_set_init_traj():
     """Test that OptimizationSolver.set_init_traj works"""
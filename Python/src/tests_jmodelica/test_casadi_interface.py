@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014 Modelon AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests the casadi_interface module."""
+
+import os
+import nose
+
+import numpy as N
+
+from tests_jmodelica import testattr, get_files_path
+try:
+    from pyjmi import transfer_optimization_problem
+    from pyjmi.casadi_interface import _cholesky, _invert_lower, \
+         _design_criterion
+    import casadi
+except (NameError, ImportError):
+    pass
+
+path_to_mos = os.path.join(get_files_path(), 'Modelica')
+
+class TestSensitivities(object):
+
+    """
+    Tests pyjmi.casadi_interface.Model.augment_sensitivities.
+    """
+
+    def setUp(self):
+        """Transfer the test problem, which is modified by the tests."""
+        file_path = os.path.join(path_to_mos, 'SensitivityTests.mop')
+        self.op = transfer_optimization_problem('SensitivityTests.SensTest2',
+                                                file_path)
+
+    @testattr(casadi_base = True)
+    def test_added_variables_and_equations(self):
+        """Test the number and order of the sensitivity variables and equations."""
+        op = self.op
+        n_dae = op.getDaeResidual().numel()
+        n_init = op.getInitialResidual().numel()
+        op.augment_sensitivities(['p1', 'p2'])
+
+        # Variables are added for each parameter in turn
+        names = lambda kind: [var.getName() for var in op.getVariables(kind)
+                              if not var.isAlias()]
+        nose.tools.assert_equal(names(op.DIFFERENTIATED),
+                                ['x', 'dx/dp1', 'dx/dp2'])
+        nose.tools.assert_equal(names(op.DERIVATIVE),
+                                ['der(x)', 'der(dx/dp1)', 'der(dx/dp2)'])
+        nose.tools.assert_equal(names(op.REAL_ALGEBRAIC),
+                                ['w', 'dw/dp1', 'dw/dp2'])
+
+        # Equations are added for each parameter in turn, after the original
+        # equations and in their order
+        dae = op.getDaeResidual()
+        init = op.getInitialResidual()
+        nose.tools.assert_equal(dae.numel(), 3 * n_dae)
+        nose.tools.assert_equal(init.numel(), 3 * n_init)
+        model_vars = [op.getVariable(name).getVar() for name in
+                      ['x', 'der(x)', 'w']]
+        for (j, par) in enumerate(['p1', 'p2']):
+            sens_vars = [op.getVariable(name % par).getVar() for name in
+                         ['dx/d%s', 'der(dx/d%s)', 'dw/d%s']]
+            other_par = ['p1', 'p2'][1 - j]
+            other_sens_vars = [op.getVariable(name % other_par).getVar()
+                               for name in ['dx/d%s', 'der(dx/d%s)', 'dw/d%s']]
+            for (res, n) in [(dae, n_dae), (init, n_init)]:
+                for i in xrange(n):
+                    # The sensitivity of residual i depends on the
+                    # sensitivities of the variables that residual i depends on
+                    sens_res = res[(j + 1) * n + i]
+                    for (var, sens_var) in zip(model_vars, sens_vars):
+                        nose.tools.assert_equal(
+                            casadi.dependsOn(sens_res, [sens_var]),
+                            casadi.dependsOn(res[i], [var]))
+                    assert not casadi.dependsOn(sens_res, other_sens_vars)
+
+    @testattr(casadi_base = True)
+    def test_sensitivity_trajectories(self):
+        """Compare the sensitivities with the analytic sensitivities."""
+        op = self.op
+        op.augment_sensitivities(['p1', 'p2'])
+        opts = op.optimize_options()
+        opts['n_e'] = 20
+        res = op.optimize(options=opts)
+
+        # x = p2*exp(-p1*t) and w = x^2 + p1
+        (p1, p2) = (2.0, 0.5)
+        t = res['time']
+        x = p2 * N.exp(-p1 * t)
+        dx_dp1 = -t * x
+        dx_dp2 = x / p2
+        N.testing.assert_allclose(res['x'], x, rtol=1e-5, atol=1e-8)
+        N.testing.assert_allclose(res['dx/dp1'], dx_dp1, rtol=1e-5, atol=1e-8)
+        N.testing.assert_allclose(res['dx/dp2'], dx_dp2, rtol=1e-5, atol=1e-8)
+        N.testing.assert_allclose(res['dw/dp1'], 2 * x * dx_dp1 + 1,
+                                  rtol=1e-5, atol=1e-8)
+        N.testing.assert_allclose(res['dw/dp2'], 2 * x * dx_dp2,
+                                  rtol=1e-5, atol=1e-8)
+
+class TestOED(object):
+
+    """
+    Tests the design criteria of
+    pyjmi.casadi_interface.OptimizationProblem.setup_oed.
+    """
+
+    def setUp(self):
+        self.Fisher = N.array([[4., 1., 0.5],
+                               [1., 3., 0.2],
+                               [0.5, 0.2, 2.]])
+        self.Fisher_sym = casadi.MX.sym("F", 3, 3)
+
+    def evaluate(self, expr):
+        """Evaluate an expression of the symbolic Fisher matrix."""
+        f = casadi.MXFunction([self.Fisher_sym], [expr])
+        f.init()
+        f.setInput(self.Fisher)
+        f.evaluate()
+        return f.getOutput().toArray()
+
+    def to_matrix(self, L):
+        """Convert a lower triangular matrix given as rows to an MX matrix."""
+        n = len(L)
+        return casadi.vertcat([casadi.horzcat(row + (n - len(row)) * [casadi.MX(0.)])
+                               for row in L])
+
+    @testattr(casadi_base = True)
+    def test_cholesky(self):
+        """Test the symbolic Cholesky factorization and inverse."""
+        L = _cholesky(self.Fisher_sym, 3)
+        L_ref = N.linalg.cholesky(self.Fisher)
+        N.testing.assert_allclose(self.evaluate(self.to_matrix(L)), L_ref)
+        L_inv = _invert_lower(L, 3)
+        N.testing.assert_allclose(self.evaluate(self.to_matrix(L_inv)),
+                                  N.linalg.inv(L_ref), atol=1e-15)
+
+    @testattr(casadi_base = True)
+    def test_design_criteria(self):
+        """Compare the design criteria with NumPy."""
+        Fisher_inv = N.linalg.inv(self.Fisher)
+        criteria = {'A': N.trace(Fisher_inv),
+                    'D': -N.log(N.linalg.det(self.Fisher)),
+                    'E': N.trace(N.linalg.matrix_power(Fisher_inv, 8)) ** (1. / 8),
+                    'T': -N.trace(self.Fisher)}
+        for (design, criterion) in criteria.iteritems():
+            obj = _design_criterion(self.Fisher_sym, 3, design)
+            N.testing.assert_allclose(self.evaluate(obj), criterion, 1e-12)
+
+    @testattr(casadi_base = True)
+    def test_d_optimal_design(self):
+        """Test solving a D-optimal design problem."""
+        file_path = os.path.join(path_to_mos, 'SensitivityTests.mop')
+        outputs = ['y']
+        parameters = ['p1', 'p2']
+        sigma = [[1.]]
+        time_points = [0.5, 1.]
+
+        def fisher(res):
+            Q = N.array([N.interp(time_points, res['time'], res['dy/d%s' % par])
+                         for par in parameters]).T
+            return N.dot(Q.T, Q)
+
+        # The D criterion needs a positive definite Fisher matrix, so the
+        # T-optimal design is used as initial guess
+        ops = []
+        for design in ["T", "D"]:
+            op = transfer_optimization_problem('SensitivityTests.SensTest3',
+                                               file_path)
+            op.setup_oed(outputs, parameters, sigma, time_points, design)
+            ops.append(op)
+        opts = ops[0].optimize_options()
+        opts['n_e'] = 20
+        res_T = ops[0].optimize(options=opts)
+        opts['init_traj'] = res_T
+        res_D = ops[1].optimize(options=opts)
+
+        # The cost is the criterion of the solved sensitivities, and it is
+        # not larger than the criterion of the T-optimal design
+        cost = float(res_D.solver.solver_object.output(casadi.NLP_SOLVER_F))
+        N.testing.assert_allclose(cost, -N.log(N.linalg.det(fisher(res_D))),
+                                  1e-4)
+        assert cost <= -N.log(N.linalg.det(fisher(res_T))) + 1e-4
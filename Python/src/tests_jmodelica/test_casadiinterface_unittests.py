@@ -210,6 +210,63 @@ def test_DependentParameters():
     for name, value in zip(varnames, answers):
         assert model.get(name) == value
     assert numpy.array_equal(model.get(["a", "b", "c", "d", "e"]), answers)
+
+@testattr(casadi_base = True)
+def test_AttributeRevisions():
+    model = Model()
+    a = MX.sym("a")
+    b = MX.sym("b")
+    r1 = RealVariable(model, a, Variable.INTERNAL, Variable.PARAMETER)
+    r2 = RealVariable(model, b, Variable.INTERNAL, Variable.PARAMETER)
+    model.addVariable(r1)
+    model.addVariable(r2)
+
+    attr_rev = model.getAttributeRevision()
+    par_rev = model.getParameterRevision()
+    r1.setMin(MX(-1))
+    assert model.getAttributeRevision() > attr_rev
+    assert model.getParameterRevision() == par_rev
+
+    attr_rev = model.getAttributeRevision()
+    model.set("a", 2)
+    r2.setAttribute("bindingExpression", a*3)
+    assert model.getAttributeRevision() == attr_rev
+    assert model.getParameterRevision() > par_rev
+
+@testattr(casadi_base = True)
+def test_CachedAttributes():
+    from pyjmi.casadi_interface import Model as CachingModel
+    model = CachingModel()
+    a = MX.sym("a")
+    b = MX.sym("b")
+    x = MX.sym("x")
+    r1 = RealVariable(model, a, Variable.INTERNAL, Variable.PARAMETER)
+    r2 = RealVariable(model, b, Variable.INTERNAL, Variable.PARAMETER)
+    r3 = RealVariable(model, x, Variable.INTERNAL, Variable.CONTINUOUS)
+    model.addVariable(r1)
+    model.addVariable(r2)
+    model.addVariable(r3)
+    model.set("a", 2)
+    r2.setAttribute("bindingExpression", a*3)
+    r3.setMin(MX(-1))
+    r3.setMax(a)
+    model.calculateValuesForDependentParameters()
+
+    assert model.get_attr(r2, "_value") == 6
+    assert model.get_attr(r3, "min") == -1
+    assert model.get_attr(r3, "max") == 2
+    assert numpy.array_equal(model.get_attr_array([r1, r2], "_value"), [2, 6])
+
+    # Values that depend on parameters are updated
+    model.set("a", 4)
+    model.calculateValuesForDependentParameters()
+    assert model.get_attr(r2, "_value") == 12
+    assert model.get_attr(r3, "max") == 4
+    assert numpy.array_equal(model.get_attr_array([r1, r2], "_value"), [4, 12])
+
+    # Changed attributes are updated
+    r3.setMin(MX(-3))
+    assert model.get_attr(r3, "min") == -3
     
 @testattr(casadi_base = True)    
 def test_DependentParameters_old():
@@ -369,6 +369,96 @@ class Test_Compiler_functions:
                fmuname+" was not created."
         os.remove(fmuname)
 
+    @testattr(stddist_base = True)
+    def test_compile_fmu_compiler_server(self):
+        """
+        Test that it is possible to compile several FMUs with a compiler server.
+        """
+        from pymodelica.compiler_server import shutdown_compiler_servers
+        try:
+            for i in range(2):
+                fmuname = compile_fmu(Test_Compiler_functions.cpath_mc, 
+                                      Test_Compiler_functions.fpath_mc, 
+                                      compiler_server=True)
+                assert os.access(fmuname, os.F_OK) == True, \
+                       fmuname+" was not created."
+                os.remove(fmuname)
+            
+            # Errors are reported as with a separate process
+            path = os.path.join(get_files_path(), 'Modelica', 'CorruptCodeGenTests.mo')
+            nose.tools.assert_raises(pym.compiler_exceptions.CompilerError, 
+                                     pym.compile_fmu, 'CorruptCodeGenTests.CorruptTest1', 
+                                     path, compiler_server=True)
+        finally:
+            shutdown_compiler_servers()
+
+    @testattr(stddist_base = True)
+    def test_compile_many(self):
+        """
+        Test that it is possible to compile several models concurrently.
+        """
+        cl = Test_Compiler_functions.cpath_mc
+        path = Test_Compiler_functions.fpath_mc
+        corrupt_path = os.path.join(get_files_path(), 'Modelica', 'CorruptCodeGenTests.mo')
+        jobs = [{'class_name': cl, 'file_name': path, 'compile_to': 'Pendulum_1.fmu'},
+                {'class_name': cl, 'file_name': path, 'compile_to': 'Pendulum_2.fmu',
+                 'version': '1.0'},
+                {'class_name': cl, 'file_name': path, 'target': 'fmux'},
+                {'class_name': 'CorruptCodeGenTests.CorruptTest1', 'file_name': corrupt_path}]
+        results = dict(pym.compile_many(jobs, max_workers=2))
+        
+        assert sorted(results.keys()) == range(len(jobs))
+        for i in range(3):
+            assert os.access(results[i], os.F_OK) == True, \
+                   results[i]+" was not created."
+            os.remove(results[i])
+        assert results[0].endswith('Pendulum_1.fmu')
+        assert results[2].endswith('.fmux')
+        assert isinstance(results[3], pym.compiler_exceptions.CompilerError)
+
+    @testattr(stddist_base = True)
+    def test_compile_fmu_cache(self):
+        """
+        Test that compile_fmu reuses cached compilation results.
+        """
+        cache_dir = os.path.join(os.getcwd(), 'test_compilation_cache')
+        cache = pym.CompilationCache(cache_dir)
+        try:
+            cl = Test_Compiler_functions.cpath_mc
+            path = Test_Compiler_functions.fpath_mc
+            fmuname = compile_fmu(cl, path, cache=cache)
+            assert os.access(fmuname, os.F_OK) == True, \
+                   fmuname+" was not created."
+            assert cache.get_size() > 0
+            os.remove(fmuname)
+            
+            # Cached, the FMU is copied from the cache
+            key = cache.get_key(cl, [path], 'auto', 'me', '2.0', 
+                                pym.compiler._get_platform(), {}, '.')
+            assert cache.fetch(key, '.') is not None
+            os.remove(fmuname)
+            fmuname_cached = compile_fmu(cl, path, cache=cache)
+            assert os.path.basename(fmuname_cached) == os.path.basename(fmuname)
+            assert os.access(fmuname_cached, os.F_OK) == True
+            
+            # Other options give another key
+            key_opts = cache.get_key(cl, [path], 'auto', 'me', '2.0', 
+                                     pym.compiler._get_platform(), 
+                                     {'generate_ode_jacobian': True}, '.')
+            assert key_opts != key
+            
+            cache.max_size = 0
+            cache._evict()
+            assert cache.get_size() == 0
+            
+            cache.max_size = 1e9
+            compile_fmu(cl, path, cache=cache)
+            cache.clear()
+            assert cache.fetch(key, '.') is None
+            os.remove(fmuname)
+        finally:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
     @testattr(stddist_full = True)
     def test_compiler_error(self):
         """ Test that a CompilerError is raised if compilation errors are found in the model."""
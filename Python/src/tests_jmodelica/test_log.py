@@ -0,0 +1,101 @@
+#!/usr/bin/env python 
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014 Modelon AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests the JMI log parser. """
+
+import os
+import tempfile
+
+import numpy as N
+import nose
+
+from tests_jmodelica import testattr
+from pyjmi.log import parse_jmi_log, iterparse_jmi_log
+from pyjmi.log.parser import parse_vector, parse_matrix
+
+log_prefix = 'FMIL: module = Model, log level = 4: [INFO][FMU status:OK] '
+log_lines = [
+    '<EquationSolve>Model equations evaluation invoked at<value name="t">0.0</value>',
+    '<NewtonSolve>Newton solver invoked for <value name="block">"1"</value>',
+    '<vector name="ivs">1.5, -2.0e-3, 3</vector>',
+    '<matrix name="jacobian">1, 0; 0, 2</matrix>',
+    '</NewtonSolve>',
+    '<NewtonSolve><value name="block">"2"</value>',
+    '<vector name="iterations">1, 2, 3</vector></NewtonSolve>',
+    '</EquationSolve>',
+    '<EventInfo><value name="time">1.5</value></EventInfo>']
+
+class TestLogParser(object):
+    """
+    Tests pyjmi.log.parser.
+    """
+
+    def setUp(self):
+        (fd, self.log_file_name) = tempfile.mkstemp(suffix='.txt')
+        f = os.fdopen(fd, 'w')
+        for line in log_lines:
+            f.write(log_prefix + line + '\n')
+        f.write('FMIL: module = Other, log level = 4: [INFO][FMU status:OK] '
+                '<Ignored></Ignored>\n')
+        f.close()
+
+    def tearDown(self):
+        os.remove(self.log_file_name)
+
+    @testattr(stddist_base = True)
+    def test_leaf_parsing(self):
+        """Test parsing of vectors and matrices."""
+        ints = parse_vector("1, 2 ,3")
+        nose.tools.assert_true(ints.dtype.kind == 'i')
+        N.testing.assert_array_equal(ints, [1, 2, 3])
+        N.testing.assert_array_equal(parse_vector("1, -2.5e1"), [1., -25.])
+        N.testing.assert_array_equal(parse_vector("'a', 'b,c'"),
+                                     ["'a'", "'b,c'"])
+        N.testing.assert_array_equal(parse_vector("1, nan"), ['1', 'nan'])
+        matrix = parse_matrix("1, 2; 3.5, 4")
+        N.testing.assert_array_equal(matrix, [[1., 2.], [3.5, 4.]])
+        nose.tools.assert_equal(parse_matrix("").shape, (0, 0))
+
+    @testattr(stddist_base = True)
+    def test_parse_jmi_log(self):
+        """Test parsing a JMI log into a tree."""
+        log = parse_jmi_log(self.log_file_name)
+        solves = log.find('NewtonSolve')
+        nose.tools.assert_equal(len(solves), 2)
+        N.testing.assert_allclose(solves[0].ivs, [1.5, -2e-3, 3])
+        N.testing.assert_array_equal(solves[0].jacobian, [[1, 0], [0, 2]])
+        N.testing.assert_array_equal(solves[1].iterations, [1, 2, 3])
+        nose.tools.assert_equal(len(log.find('Ignored')), 0)
+
+    @testattr(stddist_base = True)
+    def test_iterparse_jmi_log(self):
+        """Test incremental parsing of a JMI log."""
+        nodes = list(iterparse_jmi_log(self.log_file_name))
+        nose.tools.assert_equal([node.type for node in nodes],
+                                ['EquationSolve', 'EventInfo'])
+        nose.tools.assert_equal(len(nodes[0].find('NewtonSolve')), 2)
+
+        solves = list(iterparse_jmi_log(self.log_file_name,
+                                        types='NewtonSolve'))
+        nose.tools.assert_equal([solve.block for solve in solves],
+                                ['1', '2'])
+        N.testing.assert_array_equal(solves[0].jacobian, [[1, 0], [0, 2]])
+
+        events = list(iterparse_jmi_log(self.log_file_name,
+                                        types=['EventInfo', 'Other']))
+        nose.tools.assert_equal(len(events), 1)
+        nose.tools.assert_equal(events[0].time, 1.5)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2014 Modelon AB
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+""" Tests the FMU log utilities. """
+
+import os
+import tempfile
+
+import numpy as N
+import nose
+
+from tests_jmodelica import testattr
+from pyjmi.logger_util import get_structured_fmu_log, FMULogIndex
+
+log_prefix = 'FMIL: module = Model, log level = 5: '
+log_lines = [
+    '[NLE_SCALING];1;Updating residual scaling;0;;1.0;2.0;',
+    '[NLE_SCALING];2;Updating residual scaling;0;;4.0;',
+    '[NLE_ITERS];0;Model equations evaluation invoked at time:;0;;0.0',
+    '[NLE_ITERS];1;Newton solver invoked;0;;x;y;',
+    '[NLE_ITERS];1;Variable nominal;0;;1.0;1.0;',
+    '[NLE_ITERS];1;Initial guess;0;;0.5;0.5;',
+    '[NLE_ITERS];1;Min;0;;-10.0;-10.0;',
+    '[NLE_ITERS];1;Max;0;;10.0;10.0;',
+    '[NLE_JAC];1;Jacobian;0;;1.0;2.0;',
+    '[NLE_JAC];1;Jacobian;0;;3.0;4.0;',
+    '[NLE_ITERS];1;Iteration;0;;0.5;0.5;',
+    '[NLE_ITERS];1;Residuals;0.25;;0.1;-0.2;',
+    '[NLE_ITERS];1;Iteration;0;;0.6;0.4;',
+    '[NLE_ITERS];1;Residuals;0.01;;0.01;0.0;',
+    '[NLE_ITERS];1;Newton solver finished with exit flag;0;;',
+    '[NLE_ITERS];0;Model equations evaluation finished;0;;',
+    '[NLE_ITERS];0;Model equations evaluation invoked at time:;0;;0.5',
+    '[NLE_ITERS];1;Newton solver invoked;0;;x;y;',
+    '[NLE_ITERS];1;Iteration;0;;0.6;0.4;',
+    '[NLE_ITERS];1;Residuals;0.001;;0.001;0.0;',
+    '[NLE_ITERS];1;Newton solver finished with exit flag;0;;',
+    '[NLE_ITERS];2;Newton solver invoked;0;;z;',
+    '[NLE_JAC];2;Jacobian;0;;5.0;',
+    '[NLE_ITERS];2;Iteration;0;;1.0;',
+    '[NLE_ITERS];2;Limitation;0;;z 1.0;',
+    '[NLE_ITERS];2;Residuals;0.5;;0.5;',
+    '[NLE_ITERS];2;Iteration;0;;0.9;',
+    '[NLE_ITERS];2;Residuals;0.0;;0.0;',
+    '[NLE_ITERS];2;Newton solver finished with exit flag;1;;',
+    '[NLE_ITERS];0;Model equations evaluation finished;0;;',
+    '[NLE_SCALING];2;Updating residual scaling;0;;2.0;',
+    '[NLE_ITERS];0;Model equations evaluation invoked at time:;0;;1.0',
+    '[NLE_ITERS];2;Newton solver invoked;0;;z;',
+    '[NLE_ITERS];2;Iteration;0;;0.9;',
+    '[NLE_ITERS];2;Residuals;0.0;;0.0;',
+    '[NLE_ITERS];2;Newton solver finished with exit flag;0;;',
+    '[NLE_ITERS];0;Model equations evaluation finished;0;;']
+
+# The log as given by get_structured_fmu_log before FMULogIndex, with the
+# time added to the block solves
+block_1 = {'block_index': 1, 'names': ['x', 'y'], 'time': 0.0,
+           'initial_residual_scaling': [1.0, 2.0],
+           'initial_residual_scaling_updated': True,
+           'variable_nominal': [1.0, 1.0], 'initial_guess': [0.5, 0.5],
+           'min': [-10.0, -10.0], 'max': [10.0, 10.0],
+           'kinsol_exit_flag': '0',
+           'iterations': [{'iteration_variables': [0.5, 0.5],
+                           'jacobian': [[1.0, 2.0], [3.0, 4.0]],
+                           'jacobian_updated': True,
+                           'residual_scaling': [1.0, 2.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.1, -0.2],
+                           'scaled_residual_norm': 0.25},
+                          {'iteration_variables': [0.6, 0.4],
+                           'jacobian': [[1.0, 2.0], [3.0, 4.0]],
+                           'jacobian_updated': False,
+                           'residual_scaling': [1.0, 2.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.01, 0.0],
+                           'scaled_residual_norm': 0.01}]}
+block_2 = {'block_index': 1, 'names': ['x', 'y'], 'time': 0.5,
+           'initial_residual_scaling': [1.0, 2.0],
+           'initial_residual_scaling_updated': False,
+           'kinsol_exit_flag': '0',
+           'iterations': [{'iteration_variables': [0.6, 0.4],
+                           'jacobian': [[1.0, 2.0], [3.0, 4.0]],
+                           'jacobian_updated': False,
+                           'residual_scaling': [1.0, 2.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.001, 0.0],
+                           'scaled_residual_norm': 0.001}]}
+block_3 = {'block_index': 2, 'names': ['z'], 'time': 0.5,
+           'initial_residual_scaling': [4.0],
+           'initial_residual_scaling_updated': True,
+           'kinsol_exit_flag': '1',
+           'iterations': [{'iteration_variables': [1.0],
+                           'jacobian': [[5.0]],
+                           'jacobian_updated': True,
+                           'residual_scaling': [4.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.5],
+                           'scaled_residual_norm': 0.5,
+                           'at_bound': [('z', '1.0')]},
+                          {'iteration_variables': [0.9],
+                           'jacobian': [[5.0]],
+                           'jacobian_updated': False,
+                           'residual_scaling': [4.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.0],
+                           'scaled_residual_norm': 0.0}]}
+block_4 = {'block_index': 2, 'names': ['z'], 'time': 1.0,
+           'initial_residual_scaling': [2.0],
+           'initial_residual_scaling_updated': True,
+           'kinsol_exit_flag': '0',
+           'iterations': [{'iteration_variables': [0.9],
+                           'jacobian': [[5.0]],
+                           'jacobian_updated': False,
+                           'residual_scaling': [2.0],
+                           'residual_scaling_updated': False,
+                           'residuals': [0.0],
+                           'scaled_residual_norm': 0.0}]}
+structured_log = [{'time': 0.0, 'block_solves': [block_1]},
+                  {'time': 0.5, 'block_solves': [block_2, block_3]},
+                  {'time': 1.0, 'block_solves': [block_4]}]
+
+def to_lists(value):
+    """Convert the NumPy arrays and scalars in a parsed log to lists."""
+    if isinstance(value, dict):
+        return dict((key, to_lists(v)) for (key, v) in value.iteritems())
+    if isinstance(value, list):
+        return [to_lists(v) for v in value]
+    if isinstance(value, N.ndarray):
+        return value.tolist()
+    if isinstance(value, N.generic):
+        return value.item()
+    return value
+
+class TestFMULogIndex(object):
+    """
+    Tests pyjmi.logger_util.
+    """
+
+    def setUp(self):
+        (fd, self.log_file_name) = tempfile.mkstemp(suffix='.txt')
+        f = os.fdopen(fd, 'w')
+        for line in log_lines:
+            f.write(log_prefix + line + '\n')
+        f.close()
+        (fd, self.index_file_name) = tempfile.mkstemp(suffix='.pkl')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.log_file_name)
+        os.remove(self.index_file_name)
+
+    @testattr(stddist_base = True)
+    def test_structured_fmu_log(self):
+        """Test that the structured log has the same layout as before."""
+        log = get_structured_fmu_log(self.log_file_name)
+        nose.tools.assert_equal(to_lists(log), structured_log)
+        jac = log[0]['block_solves'][0]['iterations'][0]['jacobian']
+        nose.tools.assert_equal(jac.shape, (2, 2))
+
+    @testattr(stddist_base = True)
+    def test_find_block_solves(self):
+        """Test finding block solves by block and time window."""
+        index = FMULogIndex(self.log_file_name)
+        nose.tools.assert_equal(index.get_number_of_solves(), 3)
+        nose.tools.assert_equal(index.get_number_of_block_solves(), 4)
+        N.testing.assert_array_equal(index.find_block_solves(1), [0, 1])
+        N.testing.assert_array_equal(index.find_block_solves(2), [2, 3])
+        N.testing.assert_array_equal(
+            index.find_block_solves(t_start=0.5, t_stop=0.5), [1, 2])
+        N.testing.assert_array_equal(
+            index.find_block_solves(2, t_start=0.75), [3])
+        N.testing.assert_array_equal(
+            index.find_block_solves([1, 2], t_stop=0.5), [0, 1, 2])
+        N.testing.assert_array_equal(index.find_solves(t_start=0.25), [1, 2])
+        nose.tools.assert_equal(to_lists(index.get_block_solve(2)), block_3)
+        nose.tools.assert_equal(to_lists(index.get_structured_log(0.5, 1.)),
+                                structured_log[1:])
+
+    @testattr(stddist_base = True)
+    def test_save_load(self):
+        """Test saving and loading the index."""
+        FMULogIndex(self.log_file_name).save(self.index_file_name)
+        index = FMULogIndex.load(self.index_file_name)
+        nose.tools.assert_equal(to_lists(index.get_structured_log()),
+                                structured_log)
+        N.testing.assert_array_equal(index.find_block_solves(2, 0.75), [3])
+
+    @testattr(stddist_base = True)
+    def test_shared_storage(self):
+        """Test that reused Jacobians and scalings are stored once."""
+        index = FMULogIndex(self.log_file_name)
+        nose.tools.assert_equal(len(index.jacobians[1]) - 1, 2)
+        N.testing.assert_array_equal(index.jacobian_rows, [2, 1])
+        N.testing.assert_array_equal(index.iteration_jacobians,
+                                     [0, 0, 0, 1, 1, 1])
+        N.testing.assert_array_equal(index.get_jacobian(0), [[1, 2], [3, 4]])
+        nose.tools.assert_equal(len(index.scalings[1]) - 1, 3)
+        N.testing.assert_array_equal(index.iteration_scalings,
+                                     [0, 0, 0, 1, 1, 2])
+        N.testing.assert_array_equal(index.block_scalings, [0, 0, 1, 2])
+
+    @testattr(stddist_base = True)
+    def test_nan_residual_norm(self):
+        """Test that an iteration with a nan residual norm keeps its residuals."""
+        f = open(self.log_file_name, 'w')
+        for line in ['[NLE_SCALING];1;Updating residual scaling;0;;1.0;',
+                     '[NLE_ITERS];0;Model equations evaluation invoked at time:;0;;0.0',
+                     '[NLE_ITERS];1;Newton solver invoked;0;;x;',
+                     '[NLE_JAC];1;Jacobian;0;;1.0;',
+                     '[NLE_ITERS];1;Iteration;0;;1.0;',
+                     '[NLE_ITERS];1;Residuals;nan;;nan;',
+                     '[NLE_ITERS];1;Iteration;0;;2.0;',
+                     '[NLE_ITERS];1;Newton solver finished with exit flag;-1;;',
+                     '[NLE_ITERS];0;Model equations evaluation finished;0;;']:
+            f.write(log_prefix + line + '\n')
+        f.close()
+        index = FMULogIndex(self.log_file_name)
+        [diverged, last] = index.get_block_solve(0)['iterations']
+        assert N.isnan(diverged['scaled_residual_norm'])
+        nose.tools.assert_equal(len(diverged['residuals']), 1)
+        assert N.isnan(diverged['residuals'][0])
+        assert 'residuals' not in last
+        assert 'scaled_residual_norm' not in last
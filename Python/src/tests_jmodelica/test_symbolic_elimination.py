@@ -29,6 +29,7 @@ from pymodelica import compile_fmu
 
 try: 
     from pyjmi.symbolic_elimination import BLTOptimizationProblem, EliminationOptions
+    from pyjmi.symbolic_elimination import BipartiteGraph, Equation, Variable, Edge
     from pyjmi import transfer_optimization_problem
     import casadi
     from pyjmi.optimization.casadi_collocation import ExternalData
@@ -524,3 +525,32 @@ class TestSymbolicElimination(object):
         assert_results(res_blt, cost_ref, u_norm_ref, u_norm_rtol=1e-2)
         N.testing.assert_allclose([res_dae['p1'][0], res_dae['p3'][0]], [2.022765, 0.992965], rtol=2e-3)
         N.testing.assert_allclose([res_blt['p1'][0], res_blt['p3'][0]], [2.022765, 0.992965], rtol=2e-3)
+
+    @testattr(casadi_base = True)
+    def test_maximum_match(self):
+        """
+        Test Hopcroft-Karp on a graph where the matching needs long augmenting paths.
+        """
+        n = 2000
+        equations = [Equation("eq%d" % i, i, i, False) for i in xrange(n)]
+        variables = [Variable("x%d" % i, i, i, False, False) for i in xrange(n)]
+
+        # Equation i contains x_i and x_(i+1). Listing x_(i+1) first makes the
+        # first phase match equation i with x_(i+1), leaving the last equation
+        # with a path through the whole chain.
+        edges = []
+        for i in xrange(n - 1):
+            edges.append(Edge(equations[i], variables[i + 1]))
+            edges.append(Edge(equations[i], variables[i]))
+        edges.append(Edge(equations[n - 1], variables[0]))
+        graph = BipartiteGraph(equations, variables, edges, EliminationOptions())
+        graph.maximum_match()
+        assert sorted(graph.eq_match) == range(n)
+        assert len(graph.matches) == n
+        for (eq, var) in graph.matches:
+            assert var.global_index in [eq.global_index, (eq.global_index + 1) % n]
+
+        # Structurally singular system
+        edges = [Edge(equations[0], variables[0]), Edge(equations[1], variables[0])]
+        graph = BipartiteGraph(equations[:2], variables[:2], edges, EliminationOptions())
+        N.testing.assert_raises(RuntimeError, graph.maximum_match)
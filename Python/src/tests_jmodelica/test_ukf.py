@@ -18,7 +18,7 @@
 Tests for the UKF, UKFOptions and ScaledVariable classes.
 """
 import sys
-from pyjmi.ukf import UKF, ScaledVariable, UKFOptions
+from pyjmi.ukf import UKF, ScaledVariable, UKFOptions, SigmaPointPool
 from tests_jmodelica import testattr, get_files_path
 from pymodelica import compile_fmu
 from pyfmi import load_fmu
@@ -301,3 +301,15 @@ class Test_AlgorithmMethods_UKF:
         assert N.allclose(self.ukf.K, [[0.99995099], [0.00497003]])
         assert N.allclose(self.ukf.P, [[1.00099995e-01, 4.97003235e-07],
                                        [4.97003235e-07, 1.00115269e+00]])
+    
+    def test_predict_pool(self):
+        #Test that simulating the sigma points in parallel gives the same prediction
+        u = (['u'], N.transpose(N.vstack((0.0,0.1))))
+        with SigmaPointPool(get_fmu(), 2) as pool:
+            self.ukf.pool = pool
+            self.ukf.predict(u, {})
+        assert N.allclose(self.ukf.xp, [[1.00988634], [0.0172094]])
+        assert N.allclose(self.ukf.yp, [[1.00988634]])
+        assert N.allclose(self.ukf.K, [[0.99995099], [0.00497003]])
+        assert N.allclose(self.ukf.P, [[1.00099995e-01, 4.97003235e-07],
+                                       [4.97003235e-07, 1.00115269e+00]])